@@ -1,10 +1,14 @@
 import os
 import sys
 
-# 'src'フォルダをPythonのインポートパスに追加します
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
-
-from models import Base
+# プロジェクトのルートをPythonのインポートパスに追加します
+# (src/models.py は相対インポートを使うため、src パッケージとして読み込む)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# マイグレーション共通のDDL (todo_fts_ddl.py) はこのディレクトリに置く
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from src.models import Base
+from src.config import settings
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -16,6 +20,9 @@ from alembic import context
 # access to the values within the .ini file in use.
 config = context.config
 
+# アプリと同じDBを対象にする (環境変数 DATABASE_URL / .env で切り替え)
+config.set_main_option("sqlalchemy.url", settings.database_url.replace("%", "%%"))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,36 @@
+"""
+マイグレーションで使う、Todoの全文検索 (FTS5) の索引と同期トリガーのDDL。
+
+マイグレーションはその時点のスキーマを作るものなので、src.models.TODO_FTS_DDL (現在のモデル用) ではなく、
+ここに固定したDDLを使う。(env.py がこのディレクトリをインポートパスに追加する)
+"""
+from alembic import op
+
+TODO_FTS_TABLE = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS "Todo_fts" USING fts5("内容", content='Todo', content_rowid='id', tokenize='trigram')"""
+)
+
+TODO_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS "Todo_fts_ai" AFTER INSERT ON "Todo" BEGIN
+            INSERT INTO "Todo_fts"(rowid, "内容") VALUES (new.id, new."内容");
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS "Todo_fts_ad" AFTER DELETE ON "Todo" BEGIN
+            INSERT INTO "Todo_fts"("Todo_fts", rowid, "内容") VALUES ('delete', old.id, old."内容");
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS "Todo_fts_au" AFTER UPDATE OF "内容" ON "Todo" BEGIN
+            INSERT INTO "Todo_fts"("Todo_fts", rowid, "内容") VALUES ('delete', old.id, old."内容");
+            INSERT INTO "Todo_fts"(rowid, "内容") VALUES (new.id, new."内容");
+        END""",
+]
+
+
+def create_fts_triggers() -> None:
+    for ddl in TODO_FTS_TRIGGERS:
+        op.execute(ddl)
+
+
+def recreate_fts_triggers() -> None:
+    # SQLiteのbatch_alter_tableはTodo表を作り直すため、全文検索の同期トリガーも消える
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    create_fts_triggers()
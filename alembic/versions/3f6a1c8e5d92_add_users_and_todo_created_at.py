@@ -0,0 +1,53 @@
+"""Add users table and todo creation timestamp
+
+Revision ID: 3f6a1c8e5d92
+Revises: 7e2b9d4c6a13
+Create Date: 2026-10-16 21:40:12.318407
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from todo_fts_ddl import recreate_fts_triggers
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6a1c8e5d92'
+down_revision: Union[str, Sequence[str], None] = '7e2b9d4c6a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ログイン機能と作成日時はモデルにだけ追加されていたため、create_all で作ったDBには既にある
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(), nullable=False),
+            sa.Column('hashed_password', sa.String(), nullable=False),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+        op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+
+    if '作成日時' not in {c['name'] for c in inspector.get_columns('Todo')}:
+        # SQLiteは CURRENT_TIMESTAMP を既定値とする列を ADD COLUMN できないため、表を作り直す
+        with op.batch_alter_table('Todo', recreate='always') as batch_op:
+            batch_op.add_column(sa.Column('作成日時', sa.DateTime(), server_default=sa.func.now(), nullable=True))
+        recreate_fts_triggers()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('Todo') as batch_op:
+        batch_op.drop_column('作成日時')
+    recreate_fts_triggers()
+    op.drop_index(op.f('ix_users_username'), table_name='users')
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,57 @@
+"""Add primary key and reverse index to todo-tag association
+
+Revision ID: 4b8f2c1d9e7a
+Revises: a7c2e9f4b180
+Create Date: 2026-10-16 10:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8f2c1d9e7a'
+down_revision: Union[str, Sequence[str], None] = 'a7c2e9f4b180'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLiteは既存テーブルに主キーを追加できないため、新しいテーブルを作って
+    # 重複とNULLを取り除いたデータを移し替える
+    op.create_table('設定_new',
+    sa.Column('todo_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tag_id'], ['Tag.id'], ),
+    sa.ForeignKeyConstraint(['todo_id'], ['Todo.id'], ),
+    sa.PrimaryKeyConstraint('todo_id', 'tag_id')
+    )
+    op.execute(
+        'INSERT INTO "設定_new" (todo_id, tag_id) '
+        'SELECT DISTINCT todo_id, tag_id FROM "設定" '
+        'WHERE todo_id IS NOT NULL AND tag_id IS NOT NULL'
+    )
+    op.drop_table('設定')
+    op.rename_table('設定_new', '設定')
+    op.create_index('ix_設定_tag_id_todo_id', '設定', ['tag_id', 'todo_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_設定_tag_id_todo_id', table_name='設定')
+    # 元の代理キー (id) と索引に戻す
+    op.create_table('設定_old',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('todo_id', sa.Integer(), nullable=True),
+    sa.Column('tag_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['tag_id'], ['Tag.id'], ),
+    sa.ForeignKeyConstraint(['todo_id'], ['Todo.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO "設定_old" (todo_id, tag_id) SELECT todo_id, tag_id FROM "設定"')
+    op.drop_table('設定')
+    op.rename_table('設定_old', '設定')
+    op.create_index(op.f('ix_設定_id'), '設定', ['id'], unique=False)
@@ -0,0 +1,66 @@
+"""Add change sequence, updated_at and tombstones for delta sync
+
+Revision ID: 5b1d7e9a2c46
+Revises: 3f6a1c8e5d92
+Create Date: 2026-10-16 23:12:47.905318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from todo_fts_ddl import recreate_fts_triggers
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1d7e9a2c46'
+down_revision: Union[str, Sequence[str], None] = '3f6a1c8e5d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SYNC_TABLES = ['Todo', 'Tag', '設定']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLiteは CURRENT_TIMESTAMP を既定値とする列を ADD COLUMN できないため、表を作り直す
+    for table in SYNC_TABLES:
+        with op.batch_alter_table(table, recreate='always') as batch_op:
+            batch_op.add_column(sa.Column('change_seq', sa.Integer(), nullable=False, server_default='0'))
+            batch_op.add_column(sa.Column('更新日時', sa.DateTime(), server_default=sa.func.now(), nullable=True))
+            batch_op.create_index(op.f(f'ix_{table}_change_seq'), ['change_seq'], unique=False)
+    recreate_fts_triggers()
+
+    op.create_table(
+        'sync_tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('change_seq', sa.Integer(), nullable=False),
+        sa.Column('entity', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=True),
+        sa.Column('deleted_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_sync_tombstone_change_seq'), 'sync_tombstone', ['change_seq'], unique=False)
+    op.create_index(op.f('ix_sync_tombstone_deleted_at'), 'sync_tombstone', ['deleted_at'], unique=False)
+
+    # 既存の行はすべてシーケンス1で作られたことにする (since=0 の全件同期で返るように)
+    for table in SYNC_TABLES:
+        op.execute(f'UPDATE "{table}" SET change_seq = 1')
+    counter = sa.table('change_counter', sa.column('name', sa.String()), sa.column('value', sa.Integer()))
+    op.bulk_insert(counter, [{'name': 'sync', 'value': 1}, {'name': 'sync_compacted', 'value': 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM change_counter WHERE name IN ('sync', 'sync_compacted')")
+    op.drop_index(op.f('ix_sync_tombstone_deleted_at'), table_name='sync_tombstone')
+    op.drop_index(op.f('ix_sync_tombstone_change_seq'), table_name='sync_tombstone')
+    op.drop_table('sync_tombstone')
+    for table in reversed(SYNC_TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(op.f(f'ix_{table}_change_seq'))
+            batch_op.drop_column('更新日時')
+            batch_op.drop_column('change_seq')
+    recreate_fts_triggers()
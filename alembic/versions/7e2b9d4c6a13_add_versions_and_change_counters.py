@@ -0,0 +1,45 @@
+"""Add row versions and change counters for ETags
+
+Revision ID: 7e2b9d4c6a13
+Revises: d41a7c6e2b58
+Create Date: 2026-10-16 14:02:31.542118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from todo_fts_ddl import recreate_fts_triggers
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e2b9d4c6a13'
+down_revision: Union[str, Sequence[str], None] = 'd41a7c6e2b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既存の行はバージョン1から始める (ADD COLUMN なので SQLite でも表の再作成は不要)
+    op.add_column('Todo', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('Tag', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+    counter = op.create_table(
+        'change_counter',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    op.bulk_insert(counter, [{'name': 'Todo', 'value': 0}, {'name': 'Tag', 'value': 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('change_counter')
+    with op.batch_alter_table('Tag') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('Todo') as batch_op:
+        batch_op.drop_column('version')
+    recreate_fts_triggers()
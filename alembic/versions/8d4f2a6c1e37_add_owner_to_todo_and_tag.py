@@ -0,0 +1,115 @@
+"""Add owner to todo and tag with owner-first indexes
+
+Revision ID: 8d4f2a6c1e37
+Revises: 5b1d7e9a2c46
+Create Date: 2026-10-17 10:41:08.263915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from todo_fts_ddl import recreate_fts_triggers
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4f2a6c1e37'
+down_revision: Union[str, Sequence[str], None] = '5b1d7e9a2c46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 表 -> (owner_id から始める新しい索引, 置き換える古い索引)
+OWNER_INDEXES = {
+    'Todo': (
+        {
+            'ix_Todo_owner_id_id': ['owner_id', 'id'],
+            'ix_Todo_owner_id_完了_期限': ['owner_id', '完了/未完了', '期限'],
+            'ix_Todo_owner_id_内容': ['owner_id', '内容'],
+            'ix_Todo_owner_id_期限': ['owner_id', '期限'],
+            'ix_Todo_owner_id_change_seq': ['owner_id', 'change_seq'],
+        },
+        {
+            'ix_Todo_完了_期限': ['完了/未完了', '期限'],
+            'ix_Todo_内容': ['内容'],
+            'ix_Todo_期限': ['期限'],
+            'ix_Todo_change_seq': ['change_seq'],
+        },
+    ),
+    'Tag': (
+        {
+            'ix_Tag_owner_id_id': ['owner_id', 'id'],
+            'ix_Tag_owner_id_説明': ['owner_id', '説明'],
+            'ix_Tag_owner_id_change_seq': ['owner_id', 'change_seq'],
+        },
+        {
+            'ix_Tag_説明': ['説明'],
+            'ix_Tag_change_seq': ['change_seq'],
+        },
+    ),
+}
+# タグの説明はユーザーの中で一意
+UNIQUE_INDEXES = {'ix_Tag_owner_id_説明'}
+
+# 同じ説明のタグのうち、残すもの (最小のID) 以外
+DUPLICATE_TAGS = (
+    'SELECT d.id FROM "Tag" d WHERE d."説明" IS NOT NULL '
+    'AND d.id > (SELECT MIN(k.id) FROM "Tag" k WHERE k."説明" = d."説明")'
+)
+
+
+def merge_duplicate_tags() -> None:
+    # 既存のデータはすべて同じユーザーのものになるので、一意索引を張れるように同じ説明のタグを1つにまとめる
+    # (関連付けは残すタグに付け替える)
+    op.execute(
+        f"""INSERT INTO "設定" (todo_id, tag_id, change_seq)
+        SELECT s.todo_id, (SELECT MIN(k.id) FROM "Tag" k WHERE k."説明" = d."説明") AS kept, MAX(s.change_seq)
+        FROM "設定" s JOIN "Tag" d ON d.id = s.tag_id
+        WHERE d.id IN ({DUPLICATE_TAGS})
+        AND NOT EXISTS (
+            SELECT 1 FROM "設定" x
+            WHERE x.todo_id = s.todo_id AND x.tag_id = (SELECT MIN(k.id) FROM "Tag" k WHERE k."説明" = d."説明")
+        )
+        GROUP BY s.todo_id, kept"""
+    )
+    op.execute(f'DELETE FROM "設定" WHERE tag_id IN ({DUPLICATE_TAGS})')
+    op.execute(f'DELETE FROM "Tag" WHERE id IN ({DUPLICATE_TAGS})')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table, (new_indexes, old_indexes) in OWNER_INDEXES.items():
+        with op.batch_alter_table(table, recreate='always') as batch_op:
+            batch_op.add_column(sa.Column('owner_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(f'fk_{table.lower()}_owner_id_users', 'users', ['owner_id'], ['id'])
+            for name in old_indexes:
+                batch_op.drop_index(name)
+            for name, columns in new_indexes.items():
+                batch_op.create_index(name, columns, unique=name in UNIQUE_INDEXES)
+    recreate_fts_triggers()
+
+    with op.batch_alter_table('sync_tombstone') as batch_op:
+        batch_op.add_column(sa.Column('owner_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_sync_tombstone_owner_id_change_seq', ['owner_id', 'change_seq'], unique=False)
+
+    merge_duplicate_tags()
+    # 既存のデータは最初に登録されたユーザーのものにする (ユーザーがいなければNULLのまま)
+    for table in ['Todo', 'Tag', 'sync_tombstone']:
+        op.execute(f'UPDATE "{table}" SET owner_id = (SELECT MIN(id) FROM users)')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sync_tombstone') as batch_op:
+        batch_op.drop_index('ix_sync_tombstone_owner_id_change_seq')
+        batch_op.drop_column('owner_id')
+
+    for table, (new_indexes, old_indexes) in OWNER_INDEXES.items():
+        with op.batch_alter_table(table, recreate='always') as batch_op:
+            for name in new_indexes:
+                batch_op.drop_index(name)
+            batch_op.drop_constraint(f'fk_{table.lower()}_owner_id_users', type_='foreignkey')
+            batch_op.drop_column('owner_id')
+            for name, columns in old_indexes.items():
+                batch_op.create_index(name, columns, unique=False)
+    recreate_fts_triggers()
@@ -0,0 +1,40 @@
+"""Add full-text search index for todo content
+
+Revision ID: 9c3e5a7b1f20
+Revises: 4b8f2c1d9e7a
+Create Date: 2026-10-16 11:03:18.552094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from todo_fts_ddl import TODO_FTS_TABLE, create_fts_triggers
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3e5a7b1f20'
+down_revision: Union[str, Sequence[str], None] = '4b8f2c1d9e7a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # FTS5 は SQLite 専用 (他のDBでは検索APIが LIKE 検索にフォールバックする)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(TODO_FTS_TABLE)
+    create_fts_triggers()
+    # 既存のTodoを索引に取り込む
+    op.execute("""INSERT INTO "Todo_fts"("Todo_fts") VALUES ('rebuild')""")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS "Todo_fts_au"')
+    op.execute('DROP TRIGGER IF EXISTS "Todo_fts_ad"')
+    op.execute('DROP TRIGGER IF EXISTS "Todo_fts_ai"')
+    op.execute('DROP TABLE IF EXISTS "Todo_fts"')
@@ -0,0 +1,45 @@
+"""Rename todo and tag primary keys to id
+
+Revision ID: a7c2e9f4b180
+Revises: e210cf5ce668
+Create Date: 2026-10-16 10:05:12.318604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2e9f4b180'
+down_revision: Union[str, Sequence[str], None] = 'e210cf5ce668'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# 主キーの列名を "Todo番号" / "Tag番号" から "id" に変更する (モデルの変更に合わせる)
+PRIMARY_KEY_RENAMES = [('Todo', 'Todo番号', 'id'), ('Tag', 'Tag番号', 'id')]
+
+
+def _rename_primary_key(table: str, old: str, new: str) -> None:
+    # create_all で作られたDBは最初から "id" なので何もしない
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}
+    if old not in columns:
+        return
+    op.drop_index(op.f(f'ix_{table}_{old}'), table_name=table)
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.alter_column(old, new_column_name=new)
+    op.create_index(op.f(f'ix_{table}_{new}'), table, [new], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table, old, new in PRIMARY_KEY_RENAMES:
+        _rename_primary_key(table, old, new)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, old, new in PRIMARY_KEY_RENAMES:
+        _rename_primary_key(table, new, old)
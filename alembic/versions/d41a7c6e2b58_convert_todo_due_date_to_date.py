@@ -0,0 +1,81 @@
+"""Convert todo due date to a DATE column and index it
+
+Revision ID: d41a7c6e2b58
+Revises: 9c3e5a7b1f20
+Create Date: 2026-10-16 11:47:05.318770
+
+"""
+import re
+from datetime import date, datetime
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from todo_fts_ddl import recreate_fts_triggers
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a7c6e2b58'
+down_revision: Union[str, Sequence[str], None] = '9c3e5a7b1f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 期限はこれまで自由入力の文字列だったため、よくある書き方を日付として解釈する
+DATE_PATTERN = re.compile(r'^\s*(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*日?')
+
+
+def parse_due_date(value: Optional[str]) -> Optional[date]:
+    if value is None or not value.strip():
+        return None
+    m = DATE_PATTERN.match(value)
+    if m:
+        try:
+            return date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            return None
+    for fmt in ('%Y%m%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+    # 型を直接変更すると SQLite のテーブル再作成時に CAST(期限 AS DATE) が入り、
+    # '2025-10-21' が 2025 に変換されてしまうため、新しい列を作って値を移す
+    with op.batch_alter_table('Todo') as batch_op:
+        batch_op.add_column(sa.Column('期限_new', sa.Date(), nullable=True))
+
+    # データ移行: 既存の値を解釈して新しい列に入れる (解釈できない値は NULL にする)
+    todo = sa.table('Todo', sa.column('id', sa.Integer), sa.column('期限', sa.String), sa.column('期限_new', sa.Date))
+    unparsed = []
+    for todo_id, raw in conn.execute(sa.select(todo.c.id, todo.c['期限']).where(todo.c['期限'].is_not(None))):
+        parsed = parse_due_date(raw)
+        if parsed is None:
+            if raw.strip():
+                unparsed.append((todo_id, raw))
+            continue
+        conn.execute(sa.update(todo).where(todo.c.id == todo_id).values({'期限_new': parsed}))
+    if unparsed:
+        print(f"WARNING: {len(unparsed)} due dates could not be parsed and were cleared: {unparsed}")
+
+    with op.batch_alter_table('Todo') as batch_op:
+        batch_op.drop_column('期限')
+        batch_op.alter_column('期限_new', new_column_name='期限', existing_type=sa.Date(), existing_nullable=True)
+    with op.batch_alter_table('Todo') as batch_op:
+        batch_op.create_index('ix_Todo_期限', ['期限'], unique=False)
+        batch_op.create_index('ix_Todo_完了_期限', ['完了/未完了', '期限'], unique=False)
+    recreate_fts_triggers()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('Todo') as batch_op:
+        batch_op.drop_index('ix_Todo_完了_期限')
+        batch_op.drop_index('ix_Todo_期限')
+        batch_op.alter_column('期限', existing_type=sa.Date(), type_=sa.String(), existing_nullable=True)
+    recreate_fts_triggers()
@@ -0,0 +1,111 @@
+# benchmarks/render.py
+"""
+HTMLページの描画時間を、テンプレートのキャッシュの有無で比べます。プロジェクトのルートで実行します。
+
+    python -m benchmarks.render
+    python -m benchmarks.render --tags 500 --requests 200
+
+一時ファイルのSQLiteにTodoと --tags 件のタグを入れ、各ページを TestClient で --requests 回取得します。
+設定ごとに新しいプロセスで計測し、ページごとに最初の1回 (テンプレートのコンパイルを含む) と
+2回目以降の中央値・p95を表示します。
+- off:  バイトコードキャッシュ・断片キャッシュなし
+- cold: キャッシュあり。バイトコードキャッシュのディレクトリは空
+- warm: キャッシュあり。cold で書き込まれたバイトコードを使う (再起動後のワーカーと同じ状態)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PAGES = [
+    ("index", "/"),
+    ("login", "/login"),
+    ("register", "/register"),
+    ("todo_detail", "/todo/1"),
+    ("todo_edit", "/todo/1/edit"),
+    ("manage_tags", "/todo/1/manage-tags"),
+    ("error", "/todo/999999"),
+]
+
+def _populate(models, owner_id: int, tag_count: int):
+    """owner_id のユーザーのTodoを1件と、tag_count 件のタグを入れます。(Todoには5件のタグを付ける)"""
+    from sqlalchemy import insert
+    with models.SessionLocal.begin() as session:
+        session.execute(insert(models.Tag), [
+            {"id": i, "description": f"タグ{i:04d}", "owner_id": owner_id} for i in range(1, tag_count + 1)
+        ])
+        session.execute(insert(models.Todo), [
+            {"id": 1, "content": "ベンチマーク用のTodo", "is_completed": False, "owner_id": owner_id}
+        ])
+        session.execute(insert(models.todo_tag_association), [
+            {"todo_id": 1, "tag_id": tag_id} for tag_id in range(1, min(tag_count, 5) + 1)
+        ])
+
+def _worker(args):
+    """子プロセス側: アプリを起動して各ページを計測し、結果をJSONで出力します。"""
+    from fastapi.testclient import TestClient
+    from src import models
+    from src.main import ACCESS_TOKEN_COOKIE, app
+
+    results = {}
+    with TestClient(app) as client:
+        # Todoのページはログインが必要なので、ユーザーを作ってトークンをCookieに入れる
+        user = client.post("/api/users/register", json={"username": "bench", "password": "bench-password"}).json()
+        token = client.post("/api/token", data={"username": "bench", "password": "bench-password"}).json()
+        client.cookies.set(ACCESS_TOKEN_COOKIE, token["access_token"])
+        _populate(models, user["id"], args.tags)
+        for name, path in PAGES:
+            timings = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                client.get(path)
+                timings.append(time.perf_counter() - started)
+            warm = sorted(timings[1:])
+            results[name] = {
+                "first": timings[0],
+                "median": statistics.median(warm),
+                "p95": warm[int(len(warm) * 0.95) - 1],
+            }
+    print(json.dumps(results))
+
+def _run(config: str, env: dict, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(env, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'render.db')}")
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.render", "--worker", "--tags", str(args.tags), "--requests", str(args.requests)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.render", description=__doc__.splitlines()[1])
+    parser.add_argument("--tags", type=int, default=200, help="タグの件数 (タグ選択欄の大きさ)")
+    parser.add_argument("--requests", type=int, default=100, help="ページごとのリクエスト数")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        return _worker(args)
+
+    with tempfile.TemporaryDirectory() as bytecode_dir:
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        cached = dict(env, TEMPLATE_BYTECODE_CACHE="true", TEMPLATE_BYTECODE_CACHE_DIR=bytecode_dir)
+        configs = {
+            "off": dict(env, TEMPLATE_BYTECODE_CACHE="false", FRAGMENT_CACHE_TTL_SECONDS="0"),
+            "cold": cached,
+            "warm": cached,
+        }
+        # cold -> warm の順に実行すること (warm は cold が書いたバイトコードを読む)
+        results = {config: _run(config, config_env, args) for config, config_env in configs.items()}
+
+    print(f"{'page':<12} {'config':<5} {'first ms':>9} {'median ms':>10} {'p95 ms':>8}")
+    for name, _ in PAGES:
+        for config in configs:
+            r = results[config][name]
+            print(f"{name:<12} {config:<5} {r['first'] * 1000:9.2f} {r['median'] * 1000:10.2f} {r['p95'] * 1000:8.2f}")
+
+if __name__ == "__main__":
+    main()
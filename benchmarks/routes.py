@@ -0,0 +1,441 @@
+# benchmarks/routes.py
+"""
+src/main.py のすべてのルートの負荷テスト。スループット・レイテンシ・1リクエストあたりのSQL数を計測します。
+
+    python -m benchmarks.routes
+    python -m benchmarks.routes --sizes 1000 --requests 100 --output bench/routes-before.json
+    python -m benchmarks.routes --sizes 1000 --compare bench/routes-before.json --output bench/routes-after.json
+    python -m benchmarks.routes --sizes 100000 --only "GET /api/todo" --only "POST /api/token"
+
+データの件数 (--sizes) ごとに新しいプロセスを起動し、一時ファイルのSQLiteに合成データを入れてから
+アプリをプロセス内の ASGI クライアント (httpx.ASGITransport) で呼び出します。(ネットワークを通さない)
+- Todo: 件数分。内容は語彙からランダムに組み立てる (全文検索が適度に絞り込めるように)
+- Tag:  件数/500 件 (20〜2000件)。Todoには0〜4件を、よく使われるタグに偏るように付ける
+シナリオごとに --warmup 回の後 --requests 回を --concurrency 並列で送り、次を表示します。
+- rps:          1秒あたりのリクエスト数
+- p50/p95/p99:  レイテンシ (ミリ秒)
+- queries:      1リクエストあたりに実行したSQLの数 (ASGIアプリの処理中にエンジンが実行した文の数)
+- errors:       想定外のステータスコードの件数
+--output で結果をJSONに保存し、--compare で以前の結果と比べて --threshold を超えて遅くなった
+(またはSQLが増えた) シナリオを表示します。劣化があれば終了コード1で終わります。(CIで使える)
+
+削除系のシナリオはデータを減らすので最後に実行します。/api/events は終わらないストリームのため計測しません。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, NamedTuple, Optional
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+SEED = 20251016
+
+# Todoの内容に使う語彙 (全文検索は trigram なので3文字以上)
+WORDS = [
+    "打ち合わせ", "請求書", "報告書", "見積もり", "レビュー", "デプロイ", "買い物リスト", "歯医者の予約",
+    "議事録", "契約書", "経費精算", "リリース", "ドキュメント", "障害対応", "勉強会", "引っ越し",
+    "年末調整", "健康診断", "バックアップ", "アンケート", "プレゼン資料", "採用面接", "定例会議", "棚卸し",
+]
+
+# 計測しないルート (理由)
+SKIPPED_ROUTES = {
+    "GET /api/events": "終わらないストリーム (SSE) のため、リクエスト単位の計測ができない",
+    "DELETE /api/users/me": "ログインしているユーザー自体を削除するため、同じヘッダーで繰り返し実行できない",
+}
+
+class Dataset(NamedTuple):
+    """シナリオがリクエストを組み立てるときに使う、投入済みデータの情報。"""
+    size: int           # Todoの件数 (IDは 1..size)
+    tag_count: int      # 通常のタグの件数 (IDは 1..tag_count、1が最もよく使われる)
+    scratch_tag_id: int # 削除用のタグのIDの始まり (どのTodoにも付いていない)
+    headers: dict       # Authorization ヘッダー
+    page_headers: dict  # HTMLページ用のCookieヘッダー (ログイン時に保存するトークン)
+
+class Scenario(NamedTuple):
+    name: str                           # 結果のキー
+    route: str                          # "METHOD /path" (app.routes と突き合わせる)
+    request: Callable                   # (Dataset, i) -> httpx の request() に渡す引数の辞書
+    expect: tuple = (200,)              # 想定するステータスコード
+    max_requests: Optional[int] = None  # 重いシナリオはリクエスト数を抑える
+
+def _todo_id(data: Dataset, i: int) -> int:
+    # 素数の歩幅で散らして、同じ行ばかりを読まないようにする
+    return (i * 7919) % data.size + 1
+
+def _tag_id(data: Dataset, i: int) -> int:
+    return i % data.tag_count + 1
+
+def _word(i: int) -> str:
+    return WORDS[i % len(WORDS)]
+
+def _api(method: str, path: str, **kwargs) -> Callable:
+    """認証付きのAPIリクエストを組み立てる関数を返します。path と kwargs の値は (data, i) を受け取る関数でもよい。"""
+    def build(data: Dataset, i: int) -> dict:
+        request = {k: v(data, i) if callable(v) else v for k, v in kwargs.items()}
+        request.update(method=method, url=path(data, i) if callable(path) else path, headers=data.headers)
+        return request
+    return build
+
+def _page(method: str, path: Callable, **kwargs) -> Callable:
+    """認証なし (HTMLページ・フォーム) のリクエストを組み立てる関数を返します。"""
+    api = _api(method, path, **kwargs)
+    return lambda data, i: dict(api(data, i), headers={})
+
+def _login_page(method: str, path: Callable, **kwargs) -> Callable:
+    """ログインが必要なHTMLページ・フォームのリクエスト (Cookieでトークンを送る) を組み立てる関数を返します。"""
+    api = _api(method, path, **kwargs)
+    return lambda data, i: dict(api(data, i), headers=data.page_headers)
+
+def _import_file(data: Dataset, i: int) -> dict:
+    lines = [
+        json.dumps({"content": f"{_word(i + n)}の取り込み {i}-{n}", "tags": [f"タグ{_tag_id(data, n):04d}"]}, ensure_ascii=False)
+        for n in range(100)
+    ]
+    return {"file": ("todos.ndjson", "\n".join(lines).encode("utf-8"), "application/x-ndjson")}
+
+def _batch(data: Dataset, i: int) -> dict:
+    operations = [{"op": "create", "content": f"バッチで作成 {i}-{n}"} for n in range(4)]
+    operations += [{"op": "update", "id": _todo_id(data, i * 10 + n), "content": f"バッチで更新 {i}-{n}"} for n in range(3)]
+    operations += [{"op": "toggle", "id": _todo_id(data, i * 10 + n)} for n in range(3, 6)]
+    return {"mode": "best_effort", "operations": operations}
+
+SCENARIOS = [
+    # --- HTMLページ ---
+    Scenario("GET /", "GET /", _page("GET", "/")),
+    Scenario("GET /login", "GET /login", _page("GET", "/login")),
+    Scenario("GET /register", "GET /register", _page("GET", "/register")),
+    Scenario("GET /static/css/style.css", "GET /static", _page("GET", "/static/css/style.css")),
+    Scenario("GET /todo/{id}", "GET /todo/{id}", _login_page("GET", lambda d, i: f"/todo/{_todo_id(d, i)}")),
+    Scenario("GET /todo/{id}/edit", "GET /todo/{id}/edit",
+             _login_page("GET", lambda d, i: f"/todo/{_todo_id(d, i)}/edit")),
+    Scenario("GET /todo/{id}/manage-tags", "GET /todo/{id}/manage-tags",
+             _login_page("GET", lambda d, i: f"/todo/{_todo_id(d, i)}/manage-tags")),
+    Scenario("POST /todo/{id}/update", "POST /todo/{id}/update",
+             _login_page("POST", lambda d, i: f"/todo/{_todo_id(d, i)}/update",
+                   data=lambda d, i: {"content": f"フォームで更新 {i}", "due_date": "2025-12-31"}),
+             expect=(303,)),
+    Scenario("POST /todo/{id}/tags/add", "POST /todo/{id}/tags/add",
+             _login_page("POST", lambda d, i: f"/todo/{_todo_id(d, i)}/tags/add", data=lambda d, i: {"tag_id": _tag_id(d, i)}),
+             expect=(303,)),
+    Scenario("POST /tag/create/from-page", "POST /tag/create/from-page",
+             _login_page("POST", "/tag/create/from-page", data=lambda d, i: {"description": f"フォームのタグ {i}", "todo_id": 1}),
+             expect=(303,)),
+    # --- 認証 ---
+    Scenario("POST /api/token", "POST /api/token",
+             _page("POST", "/api/token", data={"username": "bench", "password": "bench-password"}), max_requests=20),
+    Scenario("POST /api/users/register", "POST /api/users/register",
+             _page("POST", "/api/users/register", json=lambda d, i: {"username": f"user{i}", "password": "bench-password"}),
+             expect=(201,), max_requests=20),
+    Scenario("GET /api/users/me", "GET /api/users/me", _api("GET", "/api/users/me")),
+    Scenario("GET /api/security/password-pool", "GET /api/security/password-pool", _api("GET", "/api/security/password-pool")),
+    Scenario("GET /api/security/principal-cache", "GET /api/security/principal-cache", _api("GET", "/api/security/principal-cache")),
+    Scenario("GET /metrics", "GET /metrics", _page("GET", "/metrics")),
+    # --- Todo ---
+    Scenario("GET /api/todo", "GET /api/todo", _api("GET", "/api/todo")),
+    Scenario("GET /api/todo?order_by=due_date&is_completed=false", "GET /api/todo",
+             _api("GET", "/api/todo", params={"order_by": "due_date", "is_completed": "false", "limit": 50})),
+    Scenario("GET /api/todo?tag=1&tag=2&tag_mode=all", "GET /api/todo",
+             _api("GET", "/api/todo", params={"tag": [1, 2], "tag_mode": "all"})),
+    Scenario("GET /api/todo/search", "GET /api/todo/search", _api("GET", "/api/todo/search", params=lambda d, i: {"q": _word(i)})),
+    Scenario("GET /api/todo/export", "GET /api/todo/export", _api("GET", "/api/todo/export"), max_requests=5),
+    Scenario("GET /api/todo/{id}", "GET /api/todo/{id}", _api("GET", lambda d, i: f"/api/todo/{_todo_id(d, i)}")),
+    Scenario("POST /api/todo", "POST /api/todo",
+             _api("POST", "/api/todo", json=lambda d, i: {"content": f"{_word(i)}の新規 {i}", "due_date": "2025-11-01"}),
+             expect=(201,)),
+    Scenario("PUT /api/todo/{id}", "PUT /api/todo/{id}",
+             _api("PUT", lambda d, i: f"/api/todo/{_todo_id(d, i)}", json=lambda d, i: {"content": f"{_word(i)}の更新 {i}"})),
+    Scenario("PUT /api/todo/{id}/toggle", "PUT /api/todo/{id}/toggle",
+             _api("PUT", lambda d, i: f"/api/todo/{_todo_id(d, i)}/toggle")),
+    Scenario("POST /api/todo/batch", "POST /api/todo/batch", _api("POST", "/api/todo/batch", json=_batch)),
+    Scenario("POST /api/todo/import", "POST /api/todo/import",
+             _api("POST", "/api/todo/import", files=_import_file), max_requests=20),
+    Scenario("GET /api/sync", "GET /api/sync", _api("GET", "/api/sync", params={"since": 0})),
+    # --- Tag ---
+    Scenario("GET /api/tag", "GET /api/tag", _api("GET", "/api/tag")),
+    Scenario("GET /api/tag/{id}", "GET /api/tag/{id}", _api("GET", lambda d, i: f"/api/tag/{_tag_id(d, i)}")),
+    Scenario("GET /api/tag/{id}/todos", "GET /api/tag/{id}/todos", _api("GET", lambda d, i: f"/api/tag/{_tag_id(d, i)}/todos")),
+    Scenario("POST /api/tag", "POST /api/tag",
+             _api("POST", "/api/tag", json=lambda d, i: {"description": f"新しいタグ {i}"}), expect=(201,)),
+    # タグ名の変更は付いているTodoのバージョンも上げるので、よく使われるタグほど重い
+    Scenario("PUT /api/tag/{id}", "PUT /api/tag/{id}",
+             _api("PUT", lambda d, i: f"/api/tag/{_tag_id(d, i)}", json=lambda d, i: {"description": f"タグ{_tag_id(d, i):04d}-{i}"}),
+             max_requests=20),
+    # --- 関連付け ---
+    Scenario("POST /api/todo/{todo_id}/tags/{tag_id}", "POST /api/todo/{todo_id}/tags/{tag_id}",
+             _api("POST", lambda d, i: f"/api/todo/{_todo_id(d, i)}/tags/{_tag_id(d, i)}")),
+    Scenario("POST /api/todo/{todo_id}/tags", "POST /api/todo/{todo_id}/tags",
+             _api("POST", lambda d, i: f"/api/todo/{_todo_id(d, i)}/tags",
+                  json=lambda d, i: {"tag_ids": [_tag_id(d, i + n) for n in range(3)]})),
+    Scenario("DELETE /api/todo/{todo_id}/tags", "DELETE /api/todo/{todo_id}/tags",
+             _api("DELETE", lambda d, i: f"/api/todo/{_todo_id(d, i)}/tags",
+                  params=lambda d, i: {"tag_id": [_tag_id(d, i + n) for n in range(3)]})),
+    # --- 削除 (データを減らすので最後) ---
+    Scenario("DELETE /api/todo/{id}", "DELETE /api/todo/{id}", _api("DELETE", lambda d, i: f"/api/todo/{d.size - i}")),
+    Scenario("DELETE /api/tag/{id}", "DELETE /api/tag/{id}", _api("DELETE", lambda d, i: f"/api/tag/{d.scratch_tag_id + i}")),
+]
+
+def _app_routes(app) -> set:
+    """アプリのルートを "METHOD /path" の集合で返します。(マウントした静的ファイルは "GET /static")"""
+    from fastapi.routing import APIRoute
+    from starlette.routing import Mount
+    routes = set()
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            routes.update(f"{method} {route.path}" for method in route.methods if method != "HEAD")
+        elif isinstance(route, Mount):
+            routes.add(f"GET {route.path}")
+    return routes
+
+def _tag_count(size: int) -> int:
+    return min(max(size // 500, 20), 2000)
+
+def _seed(models, owner_id: int, size: int, scratch_tags: int, chunk_size: int = 50000) -> Dataset:
+    """
+    owner_id のユーザーの合成データを入れます。タグの数は _tag_count、1件のTodoのタグ数は 0〜4件 (平均1.5件程度)。
+    タグは順位の逆数の重みで選ぶので、少数のタグに多くのTodoが集まる。
+    """
+    from sqlalchemy import insert
+    rng = random.Random(SEED)
+    tag_count = _tag_count(size)
+    tag_ids = list(range(1, tag_count + 1))
+    weights = [1 / rank for rank in tag_ids]
+    start = date(2025, 1, 1)
+    # ORMのセッションで挿入する (属性名 -> 日本語のカラム名の対応はORMが行う)
+    # change_seq=1 はマイグレーションで既存の行に振るのと同じ (差分同期の全件取得で返るように)
+    with models.SessionLocal.begin() as session:
+        session.execute(insert(models.Tag), [
+            {"id": tag_id, "description": f"タグ{tag_id:04d}", "change_seq": 1, "owner_id": owner_id} for tag_id in tag_ids
+        ] + [
+            {"id": tag_count + n + 1, "description": f"削除用のタグ{n}", "change_seq": 1, "owner_id": owner_id}
+            for n in range(scratch_tags)
+        ])
+    for first in range(1, size + 1, chunk_size):
+        ids = range(first, min(first + chunk_size, size + 1))
+        todos, links = [], []
+        for i in ids:
+            todos.append({
+                "id": i,
+                "content": f"{rng.choice(WORDS)}と{rng.choice(WORDS)}の確認 #{i}",
+                "due_date": start + timedelta(days=rng.randrange(730)) if rng.random() < 0.7 else None,
+                "is_completed": rng.random() < 0.4,
+                "change_seq": 1,
+                "owner_id": owner_id,
+            })
+            fan_out = rng.choices((0, 1, 2, 3, 4), weights=(20, 35, 25, 12, 8))[0]
+            for tag_id in dict.fromkeys(rng.choices(tag_ids, weights=weights, k=fan_out)):
+                links.append({"todo_id": i, "tag_id": tag_id, "change_seq": 1})
+        with models.SessionLocal.begin() as session:
+            session.execute(insert(models.Todo), todos)
+            if links:
+                session.execute(insert(models.todo_tag_association), links)
+        print(f"  seeded {ids[-1]}/{size} todos", file=sys.stderr, flush=True)
+    return Dataset(size, tag_count, tag_count + 1, {}, {})
+
+class QueryCounter:
+    """エンジン (読み込み用・書き込み用) が実行したSQL文の数を合わせて数えます。"""
+    def __init__(self, *engines):
+        from sqlalchemy import event
+        self.count = 0
+        for engine in dict.fromkeys(engines): # 読み書きを分けないときは同じエンジン
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def _percentile(sorted_values: list, q: float) -> float:
+    """最近傍順位法のパーセンタイル。"""
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+async def _measure(client, data: Dataset, scenario: Scenario, counter: QueryCounter, args) -> dict:
+    requests = min(args.requests, scenario.max_requests or args.requests)
+    requests = min(requests, data.size // 2) # 削除系がTodoを使い切らないように
+    next_index = 0
+    timings, statuses = [], {}
+
+    async def send(i: int, record: bool):
+        started = time.perf_counter()
+        response = await client.request(**scenario.request(data, i))
+        elapsed = time.perf_counter() - started
+        if record:
+            timings.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async def worker(end: int, record: bool):
+        nonlocal next_index
+        while next_index < end:
+            i = next_index
+            next_index += 1
+            await send(i, record)
+
+    await worker(args.warmup, record=False)
+    queries_before = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(args.warmup + requests, record=True) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    errors = sum(n for status, n in statuses.items() if status not in scenario.expect)
+    return {
+        "route": scenario.route,
+        "requests": requests,
+        "errors": errors,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "rps": requests / elapsed,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "p50_ms": _percentile(timings, 0.50) * 1000,
+        "p95_ms": _percentile(timings, 0.95) * 1000,
+        "p99_ms": _percentile(timings, 0.99) * 1000,
+        "queries": (counter.count - queries_before) / requests,
+    }
+
+async def _run_worker(args) -> dict:
+    """子プロセス側: データを入れてアプリを起動し、シナリオを順に計測します。"""
+    import httpx
+    from src import main, models
+
+    scenarios = [s for s in SCENARIOS if not args.only or s.name in args.only or s.route in args.only]
+    results = {}
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # データはすべてこのユーザーのものとして入れる
+            user = (await client.post("/api/users/register", json={"username": "bench", "password": "bench-password"})).json()
+            token = (await client.post("/api/token", data={"username": "bench", "password": "bench-password"})).json()
+            started = time.perf_counter()
+            data = _seed(models, user["id"], args.size, scratch_tags=args.requests + args.warmup)
+            print(f"  seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr, flush=True)
+            data = data._replace(
+                headers={"Authorization": f"Bearer {token['access_token']}"},
+                page_headers={"Cookie": f"{main.ACCESS_TOKEN_COOKIE}={token['access_token']}"},
+            )
+            counter = QueryCounter(models.async_engine.sync_engine, models.async_read_engine.sync_engine)
+            for scenario in scenarios:
+                results[scenario.name] = await _measure(client, data, scenario, counter, args)
+                print(f"  {scenario.name}: {results[scenario.name]['p50_ms']:.2f} ms", file=sys.stderr, flush=True)
+    return {
+        "results": results,
+        "missing_routes": sorted(_app_routes(main.app) - {s.route for s in SCENARIOS} - set(SKIPPED_ROUTES)),
+    }
+
+def _run_size(size: int, args) -> dict:
+    """size 件のデータで、新しいプロセスを起動して計測します。(設定やキャッシュを持ち越さない)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'routes.db')}",
+            TEMPLATE_BYTECODE_CACHE_DIR=tmp,
+            PYTHONPATH=os.getcwd(),
+        )
+        command = [
+            sys.executable, "-m", "benchmarks.routes", "--worker", "--size", str(size),
+            "--requests", str(args.requests), "--warmup", str(args.warmup), "--concurrency", str(args.concurrency),
+        ]
+        for name in args.only:
+            command += ["--only", name]
+        output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "concurrency": args.concurrency,
+    }
+
+def _print_table(size: int, results: dict):
+    print(f"\n=== {size:,} todos ===")
+    print(f"{'scenario':<52} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>6}")
+    for name, r in results.items():
+        print(
+            f"{name:<52} {r['rps']:8.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f}"
+            f" {r['queries']:8.1f} {r['errors']:6d}"
+        )
+
+def _regressions(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    以前の結果 (baseline) と比べて、p50/p95 が threshold の割合を超えて遅くなったか、
+    rps が同じ割合を超えて下がったか、SQLの数が増えたシナリオを (件数, シナリオ, 内容) で返します。
+    """
+    found = []
+    for size, results in current["sizes"].items():
+        base_results = baseline.get("sizes", {}).get(size, {})
+        for name, r in results.items():
+            base = base_results.get(name)
+            if base is None:
+                continue
+            for key in ("p50_ms", "p95_ms"):
+                if r[key] > base[key] * (1 + threshold):
+                    found.append((size, name, f"{key} {base[key]:.2f} -> {r[key]:.2f}"))
+            if r["rps"] < base["rps"] / (1 + threshold):
+                found.append((size, name, f"rps {base['rps']:.1f} -> {r['rps']:.1f}"))
+            if r["queries"] > base["queries"] + 0.5:
+                found.append((size, name, f"queries {base['queries']:.1f} -> {r['queries']:.1f}"))
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.routes", description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Todoの件数 (データセットごとに計測)")
+    parser.add_argument("--requests", type=int, default=200, help="シナリオごとのリクエスト数")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前に送るリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に送るリクエスト数")
+    parser.add_argument("--only", action="append", default=[], help="このシナリオ名またはルートだけを計測する (複数指定可)")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比べる以前の結果 (JSONファイル)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="劣化とみなす割合 (0.2 = 20%%遅くなった)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        print(json.dumps(asyncio.run(_run_worker(args))))
+        return
+
+    report = {"metadata": _metadata(args), "sizes": {}}
+    missing_routes = set()
+    for size in args.sizes:
+        print(f"measuring {size:,} todos...", file=sys.stderr, flush=True)
+        worker = _run_size(size, args)
+        report["sizes"][str(size)] = worker["results"]
+        missing_routes.update(worker["missing_routes"])
+        _print_table(size, worker["results"])
+
+    if missing_routes:
+        print(f"\nwarning: routes without a scenario: {', '.join(sorted(missing_routes))}")
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nresults written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        found = _regressions(baseline, report, args.threshold)
+        print(f"\ncompared with {args.compare} (commit {baseline.get('metadata', {}).get('commit')}):")
+        for size, name, detail in found:
+            print(f"  REGRESSION [{int(size):,} todos] {name}: {detail}")
+        if not found:
+            print("  no regressions")
+        else:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# benchmarks/serialization.py
+"""
+一覧APIとエクスポートのJSON書き出しの速度を、従来の経路と高速経路で比べます。プロジェクトのルートで実行します。
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --sizes 1000 10000 --repeat 5
+
+一時ファイルのSQLiteに件数分のTodo (タグ2つずつ) を入れ、次の2つを計測します。
+- list:   全件をページ送りで読んでJSONにする。
+          従来 = get_todos (ORM) -> schemas.TodoPage で検証 -> 標準の json で書き出し
+          高速 = get_todo_rows (行タプル -> 辞書) -> orjson で書き出し
+- export: エクスポートと同じ辞書の行をNDJSONにする。従来 = json.dumps, 高速 = orjson
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+OWNER_ID = 1 # データはすべてこのユーザーのものとして入れる
+
+def _setup_database(path: str):
+    # src の設定はインポート時に読まれるので、先に環境変数でDBを差し替える
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    from src import models
+    models.init_engines()
+    models.Base.metadata.create_all(bind=models.engine)
+    return models
+
+def _populate(models, count: int):
+    """ユーザー OWNER_ID の count 件のTodoと、それぞれに2つずつタグを入れます。"""
+    from sqlalchemy import delete, insert
+    # ORMのセッションで挿入する (属性名 -> 日本語のカラム名の対応はORMが行う)
+    with models.SessionLocal.begin() as session:
+        session.execute(delete(models.todo_tag_association))
+        session.execute(delete(models.Todo))
+        session.execute(delete(models.Tag))
+        session.execute(delete(models.User))
+        session.execute(insert(models.User), [{"id": OWNER_ID, "username": "bench", "hashed_password": "-"}])
+        session.execute(insert(models.Tag), [
+            {"id": i, "description": f"タグ{i}", "owner_id": OWNER_ID} for i in range(1, 21)
+        ])
+        start = date(2025, 1, 1)
+        session.execute(insert(models.Todo), [
+            {
+                "id": i, "content": f"ベンチマーク用のTodo {i}", "due_date": start + timedelta(days=i % 365),
+                "is_completed": i % 3 == 0, "owner_id": OWNER_ID,
+            }
+            for i in range(1, count + 1)
+        ])
+        session.execute(insert(models.todo_tag_association), [
+            {"todo_id": i, "tag_id": tag_id}
+            for i in range(1, count + 1)
+            for tag_id in (i % 20 + 1, (i + 7) % 20 + 1)
+        ])
+
+async def _list_legacy(crud, schemas) -> int:
+    """response_model=schemas.TodoPage + 標準の JSONResponse と同じ処理で全ページを書き出します。"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from src.models import AsyncSessionLocal
+    size, cursor = 0, None
+    async with AsyncSessionLocal() as db:
+        while True:
+            todos, cursor = await crud.get_todos(db, OWNER_ID, limit=crud.MAX_PAGE_SIZE, cursor=cursor)
+            page = schemas.TodoPage.model_validate({"items": todos, "next_cursor": cursor})
+            size += len(JSONResponse(jsonable_encoder(page)).body)
+            if cursor is None:
+                return size
+
+async def _list_fast(crud) -> int:
+    """read_todos_endpoint と同じく、行の辞書を ORJSONResponse で書き出します。"""
+    from fastapi.responses import ORJSONResponse
+    from src.models import AsyncSessionLocal
+    size, cursor = 0, None
+    async with AsyncSessionLocal() as db:
+        while True:
+            todos, cursor = await crud.get_todo_rows(db, OWNER_ID, limit=crud.MAX_PAGE_SIZE, cursor=cursor)
+            size += len(ORJSONResponse({"items": todos, "next_cursor": cursor}).body)
+            if cursor is None:
+                return size
+
+def _ndjson_legacy(rows: list) -> bytes:
+    lines = []
+    for row in rows:
+        row = dict(row, due_date=row["due_date"].isoformat() if row["due_date"] else None)
+        lines.append(json.dumps(row, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+async def _export_rows(crud) -> list:
+    from src.config import settings
+    from src.models import AsyncSessionLocal
+    async with AsyncSessionLocal() as db:
+        return [rows async for rows in crud.iter_todo_export_batches(db, OWNER_ID, settings.todo_export_batch_size)]
+
+def _measure(fn, repeat: int) -> float:
+    """fn を repeat 回実行し、中央値 (秒) を返します。"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def _report(name: str, count: int, legacy: float, fast: float):
+    print(
+        f"{name:<7} {count:>7} items  legacy {legacy * 1000:9.1f} ms ({count / legacy:>10,.0f} items/s)"
+        f"  fast {fast * 1000:9.1f} ms ({count / fast:>10,.0f} items/s)  x{legacy / fast:.1f}"
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization", description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="計測するTodoの件数")
+    parser.add_argument("--repeat", type=int, default=5, help="それぞれの計測の繰り返し回数 (中央値を使う)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        models = _setup_database(os.path.join(tmp, "bench.db"))
+        from src import crud, export, schemas
+        loop = asyncio.new_event_loop()
+        try:
+            for count in args.sizes:
+                _populate(models, count)
+                _report(
+                    "list", count,
+                    _measure(lambda: loop.run_until_complete(_list_legacy(crud, schemas)), args.repeat),
+                    _measure(lambda: loop.run_until_complete(_list_fast(crud)), args.repeat),
+                )
+                batches = loop.run_until_complete(_export_rows(crud))
+                # 高速経路が従来と同じ内容を書き出していることを確かめてから計測する
+                assert [json.loads(line) for b in batches for line in _ndjson_legacy(b).splitlines()] == \
+                    [json.loads(line) for b in batches for line in export._ndjson_chunk(b).splitlines()]
+                _report(
+                    "export", count,
+                    _measure(lambda: [_ndjson_legacy(b) for b in batches], args.repeat),
+                    _measure(lambda: [export._ndjson_chunk(b) for b in batches], args.repeat),
+                )
+        finally:
+            loop.run_until_complete(models.dispose_engines())
+            loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# benchmarks/startup.py
+"""
+アプリの起動時間 (コールドスタート) を計測します。プロジェクトのルートで実行します。
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --top 15
+
+毎回新しいPythonプロセスで次を計測し、中央値を表示します。
+- import:   `import src.main` にかかる時間。インポートでDBファイルが作られていないことも確かめる
+- lifespan: 起動処理 (エンジン作成・スキーマの準備・テンプレート) にかかる時間
+最後に `python -X importtime` で、インポートに時間がかかっているモジュールの上位を表示します。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# 子プロセスで実行するコード。結果を1行のJSONで出力する
+PROBE = """
+import asyncio, json, os, sys, time
+db_path = sys.argv[1]
+started = time.perf_counter()
+import src.main
+imported = time.perf_counter()
+db_created_on_import = os.path.exists(db_path)
+
+async def run_lifespan():
+    async with src.main.lifespan(src.main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(run_lifespan())
+print(json.dumps({"import": imported - started, "lifespan": ready - imported, "db_created_on_import": db_created_on_import}))
+"""
+
+def _probe(env: dict, db_path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, db_path], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _slowest_imports(env: dict, top: int) -> list:
+    """-X importtime の出力から、累積時間の長いモジュールを (マイクロ秒, モジュール名) で返します。"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.main"], env=env, check=True, capture_output=True, text=True
+    ).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), module.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5, help="起動を計測する回数 (中央値を使う)")
+    parser.add_argument("--top", type=int, default=10, help="表示する遅いインポートの件数")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", PYTHONPATH=os.getcwd())
+        results = []
+        for _ in range(args.repeat):
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            results.append(_probe(env, db_path))
+
+        import_ms = statistics.median(r["import"] for r in results) * 1000
+        lifespan_ms = statistics.median(r["lifespan"] for r in results) * 1000
+        print(f"import   {import_ms:8.1f} ms")
+        print(f"lifespan {lifespan_ms:8.1f} ms")
+        if any(r["db_created_on_import"] for r in results):
+            print("warning: importing src.main created the database file (import should not touch the DB)")
+
+        print(f"\nslowest imports (cumulative, top {args.top}):")
+        for micros, module in _slowest_imports(env, args.top):
+            print(f"  {micros / 1000:8.1f} ms  {module}")
+
+if __name__ == "__main__":
+    main()
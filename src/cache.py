@@ -0,0 +1,225 @@
+# src/cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple, Optional
+from .config import settings
+
+class TTLCache:
+    """
+    有効期限 (TTL) 付きのLRUキャッシュ。
+    件数が max_entries を超えると、最も長く使われていないものから捨てます。
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict() # key -> (value, 期限 (monotonic))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        """キーに対応する値を返します。なければ (または期限切れなら) None を返します。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value, ttl: float):
+        """値を ttl 秒間キャッシュします。"""
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable, object], bool]) -> int:
+        """predicate(key, value) が真になるエントリをすべて削除し、削除件数を返します。"""
+        with self._lock:
+            keys = [k for k, (v, _) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# === 認証済みユーザー (principal) のキャッシュ ===
+# トークン -> ユーザー。get_current_user でのトークン検証とusers表の検索を省略する。
+# 期限はトークンの exp と PRINCIPAL_CACHE_TTL_SECONDS の短い方。
+PRINCIPAL_CACHE_MAX_ENTRIES = 10000
+PRINCIPAL_CACHE_TTL_SECONDS = 60
+
+principal_cache = TTLCache(PRINCIPAL_CACHE_MAX_ENTRIES)
+
+def cache_principal(token: str, user, expires_at: Optional[float]):
+    """
+    検証済みのトークンとユーザーをキャッシュします。(expires_at はトークンの exp, UNIX時刻)
+    キャッシュされたユーザーはセッションから切り離された読み取り専用のオブジェクトとして扱います。
+    """
+    ttl = PRINCIPAL_CACHE_TTL_SECONDS
+    if expires_at is not None:
+        ttl = min(ttl, expires_at - time.time())
+    principal_cache.set(token, user, ttl)
+
+def invalidate_principal(username: str) -> int:
+    """
+    指定したユーザーのキャッシュをすべて削除します。(無効化・削除されたユーザー用)
+    """
+    return principal_cache.delete_where(lambda token, user: user.username == username)
+
+# === 描画済みHTML断片 (フラグメント) のキャッシュ ===
+# キーは (断片の名前, データのバージョン, ...)。バージョンが変われば別のキーになるので古い断片は使われないが、
+# 元データの書き込み時には invalidate_fragments() で名前ごとに捨てて、メモリを空ける。
+TAG_SELECTOR_FRAGMENT = "tag_selector"
+
+fragment_cache = TTLCache(settings.fragment_cache_max_entries)
+
+def invalidate_fragments(name: str) -> int:
+    """指定した名前の断片をすべて削除し、削除件数を返します。"""
+    return fragment_cache.delete_where(lambda key, value: key[0] == name)
+
+# === タグ一覧 (カタログ) のキャッシュ ===
+# Tagは件数が少なく、ほとんど読み込みしかされないので、IDと説明の両方をキーにしてメモリに持つ。
+# create_tag / update_tag / delete_tag はコミット後にキャッシュを直接書き換える (ライトスルー)。
+# 複数ワーカーで動かす場合は tag_cache_sync_interval を設定すると、DBの変更カウンタを
+# その間隔で確認し、他のプロセスで変更があればキャッシュ全体を捨てる。
+
+class CachedTag(NamedTuple):
+    """セッションから切り離したTagの読み取り専用のコピー。"""
+    id: int
+    description: str
+    version: int
+    owner_id: Optional[int]
+
+class TagCache:
+    """
+    IDと説明をキーにしたTagのキャッシュ。「存在しない」ことも (None として) キャッシュします。
+    説明はユーザーごとなので (owner_id, 説明) をキーにします。IDで引いたタグの持ち主は呼び出し側で確認する。
+    一覧 (ページ・全件) は、どのタグが変わっても中身が変わるので、書き込みのたびに捨てます。
+
+    DBから読んでいる間に書き込みがあると、読んだ古い内容を捨てた後に書き戻してしまうので、
+    書き込みのたびに writes を増やします。一覧のキーには writes を含め (フラグメントと同じく、
+    書き込み後は別のキーになる)、IDと説明のエントリは読む前の writes から変わっていれば書き込みません。
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.ttl = ttl
+        self._cache = TTLCache(max_entries)
+        self.generation: Optional[int] = None # 最後に確認したDBの変更カウンタ
+        self.writes = 0 # このプロセスでキャッシュを書き換えた回数
+        self._synced_at = 0.0
+
+    def _lookup(self, key: Hashable):
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        return True, entry[0]
+
+    def _store(self, key: Hashable, value, seen: Optional[int] = None):
+        # seen はDBから読む前の writes。その後に書き込みがあれば、読んだ内容は古いかもしれないので捨てる
+        if seen is not None and seen != self.writes:
+            return
+        # 値が None (存在しない) でもヒットとして扱えるように、1要素のタプルに包む
+        self._cache.set(key, (value,), self.ttl)
+
+    def get_by_id(self, tag_id: int):
+        """(ヒットしたか, タグまたはNone) を返します。"""
+        return self._lookup(("id", tag_id))
+
+    def get_by_description(self, owner_id: int, description: str):
+        """(ヒットしたか, タグまたはNone) を返します。"""
+        return self._lookup(("description", owner_id, description))
+
+    def get_list(self, key: tuple, seen: int):
+        return self._lookup(("list", seen) + key)
+
+    def set_by_id(self, tag_id: int, tag: Optional[CachedTag], seen: Optional[int] = None):
+        self._store(("id", tag_id), tag, seen)
+
+    def set_by_description(self, owner_id: int, description: str, tag: Optional[CachedTag], seen: Optional[int] = None):
+        self._store(("description", owner_id, description), tag, seen)
+
+    def set_list(self, key: tuple, value, seen: int):
+        """一覧を書き込みます。(seen はDBから読む前の writes。get_list と同じ値を渡す)"""
+        self._store(("list", seen) + key, value, seen)
+
+    def put(self, tag: CachedTag, old_description: Optional[str] = None):
+        """作成・更新したタグを書き込みます。(説明が変わった場合は古い説明を「存在しない」にする)"""
+        if old_description is not None and old_description != tag.description:
+            self.set_by_description(tag.owner_id, old_description, None)
+        self.set_by_id(tag.id, tag)
+        self.set_by_description(tag.owner_id, tag.description, tag)
+        self._drop_lists()
+
+    def remove(self, tag: CachedTag):
+        """削除したタグを「存在しない」として書き込みます。"""
+        self.set_by_id(tag.id, None)
+        self.set_by_description(tag.owner_id, tag.description, None)
+        self._drop_lists()
+
+    def remove_owner(self, owner_id: int):
+        """削除したユーザーのタグをすべて捨てます。"""
+        def owned(key, entry):
+            if key[0] == "description":
+                return key[1] == owner_id
+            return key[0] == "id" and entry[0] is not None and entry[0].owner_id == owner_id
+        self._cache.delete_where(owned)
+        self._drop_lists()
+
+    def _drop_lists(self):
+        self.writes += 1
+        self._cache.delete_where(lambda key, value: key[0] == "list")
+        # タグ一覧から描画したタグ選択欄も古くなる
+        invalidate_fragments(TAG_SELECTOR_FRAGMENT)
+
+    def sync_due(self, interval: float) -> bool:
+        """前回DBの変更カウンタを確認してから interval 秒以上たっていれば True を返します。"""
+        return time.monotonic() - self._synced_at >= interval
+
+    def sync(self, generation: int):
+        """
+        DBの変更カウンタを受け取り、前回から変わっていれば (他のプロセスで書き込みがあった) 全体を捨てます。
+        自プロセスの書き込みでもカウンタは変わるので、その場合も一度捨てることになります。
+        """
+        if self.generation is not None and generation != self.generation:
+            self.writes += 1
+            self._cache.clear()
+            invalidate_fragments(TAG_SELECTOR_FRAGMENT)
+        self.generation = generation
+        self._synced_at = time.monotonic()
+
+    def clear(self):
+        self.writes += 1
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+tag_cache = TagCache(settings.tag_cache_max_entries, settings.tag_cache_ttl_seconds)
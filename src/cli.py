@@ -0,0 +1,131 @@
+# src/cli.py
+"""
+管理用のコマンドラインツール。プロジェクトのルートで実行します。
+
+    python -m src.cli rebuild-search-index
+    python -m src.cli import-todos --user alice todos.csv
+    python -m src.cli compact-tombstones --days 30
+    python -m src.cli set-user-active --user alice --inactive
+    python -m src.cli delete-user --user alice
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+
+from . import crud, importer, models
+from .config import settings
+
+def rebuild_search_index(args):
+    """Todoの全文検索索引 (FTS5) を既存データから作り直します。"""
+    models.init_engines()
+    with models.engine.begin() as connection:
+        models.rebuild_todo_fts(connection)
+    print("search index rebuilt")
+
+def import_todos(args):
+    """NDJSON/CSVファイルから --user のユーザーのTodoを取り込みます。(HTTPサーバーなしで /api/todo/import と同じ処理)"""
+    format = args.format or importer.detect_format(args.path)
+    if format is None:
+        sys.exit("cannot determine file format; specify --format ndjson or --format csv")
+
+    async def run():
+        models.init_engines()
+        try:
+            async with models.AsyncSessionLocal() as db:
+                user = await crud.get_user_by_username(db, username=args.user)
+                if user is None:
+                    sys.exit(f"user not found: {args.user}")
+                if args.path == "-":
+                    return await importer.import_todos(db, sys.stdin.buffer, format, user.id, args.chunk_size)
+                with open(args.path, "rb") as f:
+                    return await importer.import_todos(db, f, format, user.id, args.chunk_size)
+        finally:
+            await models.dispose_engines()
+
+    try:
+        summary = asyncio.run(run())
+    except importer.ImportFormatError as e:
+        sys.exit(f"import failed: {e}")
+    print(summary.model_dump_json(indent=2))
+    if summary.failed:
+        sys.exit(1)
+
+def compact_tombstones(args):
+    """差分同期用の墓標 (削除の記録) のうち、古いものを削除します。(cronなどで定期的に実行する)"""
+    # deleted_at はDBの CURRENT_TIMESTAMP (UTC) で記録されている
+    older_than = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=args.days)
+
+    async def run():
+        models.init_engines()
+        try:
+            async with models.AsyncSessionLocal() as db:
+                return await crud.compact_tombstones(db, older_than)
+        finally:
+            await models.dispose_engines()
+
+    print(f"{asyncio.run(run())} tombstones removed")
+
+def _run_for_user(username: str, action):
+    """--user のユーザーを探して action(db, user) を実行します。(見つからなければ終了)"""
+    async def run():
+        models.init_engines()
+        try:
+            async with models.AsyncSessionLocal() as db:
+                user = await crud.get_user_by_username(db, username=username)
+                if user is None:
+                    sys.exit(f"user not found: {username}")
+                return await action(db, user)
+        finally:
+            await models.dispose_engines()
+
+    return asyncio.run(run())
+
+def set_user_active(args):
+    """
+    ユーザーを有効/無効にします。
+    認証キャッシュはサーバーのプロセスごとにあるので、動いているサーバーには最大
+    PRINCIPAL_CACHE_TTL_SECONDS の間、無効化前のユーザーが残ります。
+    """
+    _run_for_user(args.user, lambda db, user: crud.set_user_active(db, user.id, args.active))
+    print(f"{args.user} {'activated' if args.active else 'deactivated'}")
+
+def delete_user(args):
+    """ユーザーを、そのユーザーのTodo・Tagと一緒に削除します。(認証キャッシュについては set-user-active と同じ)"""
+    _run_for_user(args.user, lambda db, user: crud.delete_user(db, user.id))
+    print(f"{args.user} deleted")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="ToDoアプリの管理コマンド")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("rebuild-search-index", help="全文検索の索引を作り直す")
+    p.set_defaults(func=rebuild_search_index)
+
+    p = subparsers.add_parser("import-todos", help="NDJSON/CSVファイルからTodoを取り込む")
+    p.add_argument("path", help="取り込むファイル (- で標準入力)")
+    p.add_argument("--user", required=True, help="取り込んだTodoの持ち主 (ユーザー名)")
+    p.add_argument("--format", choices=importer.IMPORT_FORMATS, help="省略時は拡張子から判定")
+    p.add_argument("--chunk-size", type=int, default=None, help="1つのトランザクションに入れる件数")
+    p.set_defaults(func=import_todos)
+
+    p = subparsers.add_parser("compact-tombstones", help="差分同期用の古い墓標を削除する")
+    p.add_argument("--days", type=int, default=settings.sync_tombstone_retention_days, help="これより古い墓標を削除する")
+    p.set_defaults(func=compact_tombstones)
+
+    p = subparsers.add_parser("set-user-active", help="ユーザーを有効/無効にする")
+    p.add_argument("--user", required=True, help="ユーザー名")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument("--active", dest="active", action="store_true", help="有効にする")
+    group.add_argument("--inactive", dest="active", action="store_false", help="無効にする (ログインできなくなる)")
+    p.set_defaults(func=set_user_active)
+
+    p = subparsers.add_parser("delete-user", help="ユーザーをTodo・Tagと一緒に削除する")
+    p.add_argument("--user", required=True, help="ユーザー名")
+    p.set_defaults(func=delete_user)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
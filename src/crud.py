@@ -1,116 +1,1143 @@
-from sqlalchemy.orm import Session
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import and_, or_, select, insert, update, delete, case, literal, literal_column, func, table, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
 from typing import Optional
 from . import models, schemas # 相対インポートを使用
-from .security import get_password_hash
+from .cache import CachedTag, invalidate_principal, tag_cache
+from .config import settings
+from .events import event_hub
+from .metrics import phase
+from .security import get_password_hash_async
+from .writer import write_queue
+
+# === ページング (キーセット方式) ===
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 並び替えキー名 -> カラム。どれも (owner_id, カラム, id) で索引が効くものだけを許可する
+# (SQLiteでは索引の末尾に rowid = id が暗黙的に含まれる)
+TODO_SORT_KEYS = {
+    "id": models.Todo.id,
+    "content": models.Todo.content,
+    "due_date": models.Todo.due_date,
+}
+TAG_SORT_KEYS = {
+    "id": models.Tag.id,
+    "description": models.Tag.description,
+}
+
+class InvalidCursorError(ValueError):
+    """カーソル文字列が壊れている、または並び替えキーと一致しない場合の例外。"""
+
+def encode_cursor(sort: str, value, id: int) -> str:
+    """(並び替えキー, 値, id) を不透明なカーソル文字列にします。"""
+    if isinstance(value, date):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort: str):
+    """カーソル文字列を (値, id) に戻します。"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError("invalid cursor") from e
+    if cursor_sort != sort or not isinstance(last_id, int):
+        raise InvalidCursorError("cursor does not match sort order")
+    return value, last_id
+
+async def _keyset_page(
+    db: AsyncSession, stmt, sort_keys: dict, id_column, sort: str, limit: int, cursor: Optional[str],
+    scalars: bool = True,
+):
+    """
+    (並び替えキー, id) の順でキーセットページングを行います。
+    OFFSETを使わないので、何ページ目でも先頭ページと同じコストで取得できます。
+    scalars=False のときは、ORMオブジェクトではなくカラムを選択した行 (Row) のまま返します。
+    """
+    if sort not in sort_keys:
+        raise InvalidCursorError(f"unknown sort key: {sort}")
+    column = sort_keys[sort]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        if value is not None and column.type.python_type is date:
+            try:
+                value = date.fromisoformat(value)
+            except (TypeError, ValueError) as e:
+                raise InvalidCursorError("invalid cursor") from e
+        if column is id_column:
+            stmt = stmt.where(id_column > last_id)
+        elif value is None:
+            # NULLは先頭に並ぶので、NULLの残りと非NULLのすべてが続きになる
+            stmt = stmt.where(or_(
+                and_(column.is_(None), id_column > last_id),
+                column.is_not(None),
+            ))
+        else:
+            stmt = stmt.where(or_(
+                column > value,
+                and_(column == value, id_column > last_id),
+            ))
+
+    if column is id_column:
+        stmt = stmt.order_by(id_column)
+    else:
+        stmt = stmt.order_by(column.asc().nulls_first(), id_column)
+
+    # 1件多く取得して次ページの有無を判定する
+    result = await db.execute(stmt.limit(limit + 1))
+    rows = result.scalars().all() if scalars else result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, column.key), last.id)
+    return rows, next_cursor
+
+# === 変更カウンタとバージョン (ETag用) ===
+
+TODO_COUNTER = "Todo"
+TAG_COUNTER = "Tag"
+SYNC_COUNTER = "sync" # 同期用のグローバルな変更シーケンス
+SYNC_COMPACTED_COUNTER = "sync_compacted" # 削除済みの墓標 (tombstone) の最大シーケンス
+
+async def _increment_counter(db: AsyncSession, name: str) -> int:
+    """
+    変更カウンタ name を +1 し、新しい値を返します。(行がなければ 1 で作る)
+    SQLite/PostgreSQL では INSERT ... ON CONFLICT DO UPDATE ... RETURNING の1文で行う。
+    """
+    counter = models.ChangeCounter.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        # RETURNING のないDB (MySQL) では、行を作ってから +1 して読み直す
+        await db.execute(_insert_ignore(db, counter).values(name=name, value=0))
+        await db.execute(update(counter).where(counter.c.name == name).values(value=counter.c.value + 1))
+        return (await get_change_counters(db, name))[name]
+    stmt = (
+        dialect_insert(counter)
+        .values(name=name, value=1)
+        .on_conflict_do_update(index_elements=[counter.c.name], set_={"value": counter.c.value + 1})
+        .returning(counter.c.value)
+    )
+    return (await db.execute(stmt)).scalar_one()
+
+async def bump_change_counters(db: AsyncSession, *names: str):
+    """
+    変更カウンタを +1 します。書き込みと同じトランザクション内で呼び出します。(コミットは呼び出し側)
+    """
+    for name in names:
+        await _increment_counter(db, name)
+
+async def next_change_seq(db: AsyncSession) -> int:
+    """
+    同期用の変更シーケンスを1つ進めて、新しい値を返します。書き込みの最初に、同じトランザクション内で呼び出します。
+    カウンタの行はコミットまでロックされるので、シーケンスはコミット順に増える (先に読んだ側が取りこぼさない)。
+    他のカウンタより先に呼び、ロックの順序をそろえる。
+    """
+    return await _increment_counter(db, SYNC_COUNTER)
+
+async def get_change_counters(db: AsyncSession, *names: str) -> dict:
+    """変更カウンタの現在値を {名前: 値} で返します。(まだ書き込みがないものは 0)"""
+    counter = models.ChangeCounter
+    stmt = select(counter.name, counter.value).where(counter.name.in_(names))
+    values = dict((await db.execute(stmt)).all())
+    return {name: values.get(name, 0) for name in names}
+
+async def get_todo_version(db: AsyncSession, id: int, owner_id: int) -> Optional[int]:
+    """Todoのバージョンだけを取得します。(存在しない・他のユーザーのものなら None)"""
+    stmt = select(models.Todo.version).where(models.Todo.id == id, models.Todo.owner_id == owner_id)
+    return (await db.execute(stmt)).scalar()
+
+async def get_tag_version(db: AsyncSession, id: int, owner_id: int) -> Optional[int]:
+    """Tagのバージョンだけを取得します。(存在しない・他のユーザーのものなら None)"""
+    stmt = select(models.Tag.version).where(models.Tag.id == id, models.Tag.owner_id == owner_id)
+    return (await db.execute(stmt)).scalar()
+
+async def _bump_todo_versions(db: AsyncSession, todo_ids, seq: int):
+    """
+    関連付けやタグの変更でレスポンスの中身が変わるTodoのバージョンを +1 します。
+    todo_ids はIDのリストまたはIDを返すサブクエリ。差分同期で取り直されるように change_seq も seq にする。
+    """
+    t = models.Todo.__table__
+    await db.execute(update(t).where(t.c.id.in_(todo_ids)).values(version=t.c.version + 1, change_seq=seq))
+
+# === 書き込みのコミット ===
+
+async def _commit_write(db: AsyncSession, write):
+    """
+    write(db) (コミットしない書き込み) を実行してコミットし、その戻り値を返します。
+    グループコミット (writer.write_queue) が動いていれば、キューに入れて他のリクエストの書き込みと
+    まとめてコミットします。どちらの場合も、戻ってきた時点でコミット済み。(失敗したらロールバックして例外を送出する)
+    (変更イベントの送信やキャッシュの更新は、戻ってきた後に呼び出し側で行う)
+    """
+    if not write_queue.running:
+        try:
+            result = await write(db)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return result
+    # 存在確認などで始まったトランザクションを終えて、書き込み用の接続をキューに譲る
+    # (読み込み済みのオブジェクトはロールバックで期限切れにならないように、先にセッションから切り離す)
+    # write は別のセッションで実行されるので、対象の行の読み込み・確認・変更はすべて write の中で行い、
+    # 呼び出し側からは値 (IDや新しい内容、If-Match のバージョン) だけを受け取ること
+    db.expunge_all()
+    await db.rollback()
+    with phase("write_queue"):
+        return await write_queue.submit(write)
+
+def _check_version(db_obj, expected: Optional[int]):
+    """
+    書き込む行のバージョンが expected (If-Match で確認したもの) でなければ StaleDataError にします。
+    expected が None (If-Match なし) なら確認しません。
+    """
+    if expected is not None and db_obj.version != expected:
+        raise StaleDataError(f"{type(db_obj).__name__} {db_obj.id} was modified by another request")
 
 # === Todo CRUD 関数 ===
+# Todo/Tagはユーザー (owner_id) のもので、読み書きはすべて owner_id で絞り込む。
+# 他のユーザーのTodo/Tagは「存在しない」として扱う (IDの存在も漏らさない)
+
+async def get_todo(db: AsyncSession, id: int, owner_id: int):
+    """IDを指定して単一のTodo項目を取得します。(タグも同時に読み込みます)"""
+    stmt = (
+        select(models.Todo)
+        .options(selectinload(models.Todo.tags))
+        .where(models.Todo.id == id, models.Todo.owner_id == owner_id)
+    )
+    return (await db.execute(stmt)).scalars().first()
+
+async def get_todos(
+    db: AsyncSession,
+    owner_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    due_after: Optional[date] = None,
+    due_before: Optional[date] = None,
+    is_completed: Optional[bool] = None,
+    tag_ids: Optional[list] = None,
+    tag_mode: str = "any",
+):
+    """
+    Todo項目を1ページ分取得します。(項目リスト, 次ページのカーソル) を返します。
+    期限は due_after <= 期限 < due_before で絞り込みます。(期限のないTodoは除外されます)
+    tag_ids を指定すると、tag_mode="any" ならいずれかのタグ、"all" ならすべてのタグが付いたTodoに絞り込みます。
+    """
+    # タグはページ内の全Todo分を1回のSELECT (IN句) でまとめて読み込み、N+1を防ぐ
+    stmt = select(models.Todo).options(selectinload(models.Todo.tags))
+    stmt = _filter_todos(stmt, owner_id, due_after, due_before, is_completed, tag_ids, tag_mode)
+    return await _keyset_page(db, stmt, TODO_SORT_KEYS, models.Todo.id, sort, limit, cursor)
+
+async def get_todo_rows(
+    db: AsyncSession,
+    owner_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    due_after: Optional[date] = None,
+    due_before: Optional[date] = None,
+    is_completed: Optional[bool] = None,
+    tag_ids: Optional[list] = None,
+    tag_mode: str = "any",
+):
+    """
+    get_todos と同じ条件で、ORMオブジェクトを作らずにレスポンス用の辞書のリストを返します。(一覧APIの高速化用)
+    辞書の形は schemas.Todo と同じです。(項目リスト, 次ページのカーソル) を返します。
+    """
+    stmt = select(*TODO_ROW_COLUMNS)
+    stmt = _filter_todos(stmt, owner_id, due_after, due_before, is_completed, tag_ids, tag_mode)
+    rows, next_cursor = await _keyset_page(
+        db, stmt, TODO_SORT_KEYS, models.Todo.id, sort, limit, cursor, scalars=False
+    )
+    return await _todo_rows_to_dicts(db, rows), next_cursor
+
+def _filter_todos(stmt, owner_id, due_after, due_before, is_completed, tag_ids, tag_mode):
+    """Todoの一覧の絞り込み条件を stmt に追加します。(owner_id は必ず絞り込み、索引の先頭に使う)"""
+    stmt = stmt.where(models.Todo.owner_id == owner_id)
+    if is_completed is not None:
+        stmt = stmt.where(models.Todo.is_completed == is_completed)
+    if due_after is not None:
+        stmt = stmt.where(models.Todo.due_date >= due_after)
+    if due_before is not None:
+        stmt = stmt.where(models.Todo.due_date < due_before)
+    if tag_ids:
+        stmt = stmt.where(models.Todo.id.in_(_todo_ids_with_tags(tag_ids, tag_mode)))
+    return stmt
+
+# 辞書で返す一覧・エクスポートで選択するカラム (schemas.Todo のフィールド順)
+TODO_ROW_COLUMNS = (models.Todo.content, models.Todo.due_date, models.Todo.id, models.Todo.is_completed)
+
+async def _load_tag_dicts(db: AsyncSession, todo_ids: list) -> dict:
+    """指定したTodoのタグを1回のクエリで読み込み、{todo_id: [{"description", "id"}, ...]} で返します。"""
+    tags_by_todo = {todo_id: [] for todo_id in todo_ids}
+    if not todo_ids:
+        return tags_by_todo
+    assoc = models.todo_tag_association
+    stmt = (
+        select(assoc.c.todo_id, models.Tag.description, models.Tag.id)
+        .join(models.Tag, models.Tag.id == assoc.c.tag_id)
+        .where(assoc.c.todo_id.in_(todo_ids))
+        .order_by(assoc.c.todo_id, models.Tag.id)
+    )
+    for todo_id, description, tag_id in (await db.execute(stmt)).all():
+        tags_by_todo[todo_id].append({"description": description, "id": tag_id})
+    return tags_by_todo
+
+async def _todo_rows_to_dicts(db: AsyncSession, rows) -> list:
+    """TODO_ROW_COLUMNS の行にタグを付けて、schemas.Todo と同じ形の辞書のリストにします。"""
+    tags_by_todo = await _load_tag_dicts(db, [row.id for row in rows])
+    return [
+        {
+            "content": row.content,
+            "due_date": row.due_date,
+            "id": row.id,
+            "is_completed": row.is_completed,
+            "tags": tags_by_todo[row.id],
+        }
+        for row in rows
+    ]
 
-def get_todo(db: Session, id: int):
-    """IDを指定して単一のTodo項目を取得します。"""
-    return db.query(models.Todo).filter(models.Todo.id == id).first()
+def _todo_ids_with_tags(tag_ids: list, tag_mode: str = "any"):
+    """
+    指定したタグが付いたTodoのIDを返すサブクエリ。(設定表の (tag_id, todo_id) 索引だけで完結する)
+    any: いずれかのタグ (セミジョイン) / all: すべてのタグ (GROUP BY + HAVING COUNT)
+    """
+    assoc = models.todo_tag_association
+    tag_ids = list(dict.fromkeys(tag_ids))
+    stmt = select(assoc.c.todo_id).where(assoc.c.tag_id.in_(tag_ids))
+    if tag_mode == "all":
+        stmt = stmt.group_by(assoc.c.todo_id).having(func.count() == len(tag_ids))
+    elif tag_mode != "any":
+        raise ValueError(f"unknown tag_mode: {tag_mode}")
+    return stmt
 
-def get_todos(db: Session, skip: int = 0, limit: int = 100):
-    """Todo項目のリストを取得します。"""
-    return db.query(models.Todo).offset(skip).limit(limit).all()
+async def count_todos_by_tag(db: AsyncSession, tag_ids: list) -> dict:
+    """タグごとの関連Todo件数を {tag_id: 件数} で返します。(関連のないタグは含まれません)"""
+    if not tag_ids:
+        return {}
+    assoc = models.todo_tag_association
+    stmt = (
+        select(assoc.c.tag_id, func.count())
+        .where(assoc.c.tag_id.in_(tag_ids))
+        .group_by(assoc.c.tag_id)
+    )
+    return dict((await db.execute(stmt)).all())
 
-def create_todo(db: Session, todo: schemas.TodoCreate):
+async def create_todo(db: AsyncSession, todo: schemas.TodoCreate, owner_id: int):
     """新しいTodo項目を作成します。"""
-    db_todo = models.Todo(content=todo.content, due_date=todo.due_date)
-    db.add(db_todo)
-    db.commit()
-    db.refresh(db_todo)
+    async def write(db: AsyncSession):
+        seq = await next_change_seq(db)
+        # tags=[] で空のコレクションを読み込み済みにしておく (非同期セッションでは遅延読み込みできないため)
+        db_todo = models.Todo(content=todo.content, due_date=todo.due_date, tags=[], change_seq=seq, owner_id=owner_id)
+        db.add(db_todo)
+        await bump_change_counters(db, TODO_COUNTER)
+        return db_todo
+
+    db_todo = await _commit_write(db, write)
+    event_hub.publish(owner_id, "todo", "upsert", [db_todo.id])
     return db_todo
 
-def update_todo(db: Session, todo_id: int, content: str, due_date: Optional[str], is_completed: bool):
-    """既存のTodo項目を更新します。"""
-    db_todo = get_todo(db, id=todo_id)
+async def _load_todo_for_write(db: AsyncSession, todo_id: int, owner_id: int):
+    """書き込みの中でTodoを読み込みます。セッションに古い内容が残っていても、DBの現在の行で上書きする。"""
+    stmt = (
+        select(models.Todo)
+        .options(selectinload(models.Todo.tags))
+        .where(models.Todo.id == todo_id, models.Todo.owner_id == owner_id)
+        .execution_options(populate_existing=True)
+    )
+    return (await db.execute(stmt)).scalars().first()
+
+async def _change_todo(db: AsyncSession, todo_id: int, owner_id: int, expected_version: Optional[int], change):
+    """
+    Todoを読み込んで change(db_todo) で変更し、コミットします。(存在しない・他のユーザーのものなら None)
+    変更は書き込みの中で読み込んだ行に対して行う。(グループコミットでは書き込みは順番に実行されるので、
+    読み込みから変更までの間に他の書き込みは入らない) expected_version は If-Match で確認したバージョン (なければ None)。
+    """
+    async def write(db: AsyncSession):
+        db_todo = await _load_todo_for_write(db, todo_id, owner_id)
+        if db_todo:
+            _check_version(db_todo, expected_version)
+            change(db_todo)
+            db_todo.change_seq = await next_change_seq(db)
+            await bump_change_counters(db, TODO_COUNTER)
+        return db_todo
+
+    db_todo = await _commit_write(db, write)
     if db_todo:
+        event_hub.publish(owner_id, "todo", "upsert", [todo_id])
+    return db_todo
+
+async def update_todo(
+    db: AsyncSession, todo_id: int, owner_id: int, content: str, due_date: Optional[date],
+    is_completed: Optional[bool] = None, expected_version: Optional[int] = None,
+):
+    """既存のTodo項目を更新します。is_completed が None なら完了/未完了はそのままにします。"""
+    def change(db_todo: models.Todo):
         db_todo.content = content
         db_todo.due_date = due_date
-        db_todo.is_completed = is_completed
-        db.commit()
-        db.refresh(db_todo)
-    return db_todo
+        if is_completed is not None:
+            db_todo.is_completed = is_completed
 
-def delete_todo(db: Session, todo_id: int):
-    """IDを指定してTodo項目を削除します。"""
-    db_todo = get_todo(db, id=todo_id)
+    return await _change_todo(db, todo_id, owner_id, expected_version, change)
+
+async def toggle_todo(db: AsyncSession, todo_id: int, owner_id: int, expected_version: Optional[int] = None):
+    """Todoの完了/未完了を切り替えます。(書き込みの時点の状態を反転する)"""
+    def change(db_todo: models.Todo):
+        db_todo.is_completed = not db_todo.is_completed
+
+    return await _change_todo(db, todo_id, owner_id, expected_version, change)
+
+async def delete_todo(db: AsyncSession, todo_id: int, owner_id: int, expected_version: Optional[int] = None):
+    """IDを指定してTodo項目を削除します。expected_version は If-Match で確認したバージョン (なければ None)。"""
+    async def write(db: AsyncSession):
+        db_todo = await _load_todo_for_write(db, todo_id, owner_id)
+        if db_todo:
+            _check_version(db_todo, expected_version)
+            seq = await next_change_seq(db)
+            await db.delete(db_todo)
+            db.add(models.SyncTombstone(change_seq=seq, entity="todo", entity_id=todo_id, owner_id=owner_id))
+            await bump_change_counters(db, TODO_COUNTER)
+        return db_todo
+
+    db_todo = await _commit_write(db, write)
     if db_todo:
-        db.delete(db_todo)
-        db.commit()
+        event_hub.publish(owner_id, "todo", "delete", [todo_id])
     return db_todo # 削除されたオブジェクトまたはNoneを返す
 
+# === 全文検索 ===
+
+FTS_MIN_TERM_LENGTH = 3 # trigramトークナイザは3文字未満の語では検索できない
+
+async def search_todos(
+    db: AsyncSession, owner_id: int, q: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+):
+    """
+    Todoの内容を検索し、関連度 (bm25) の高い順に1ページ分返します。
+    空白区切りの語はすべて含むもの (AND) に一致し、各語は部分一致 (前方一致を含む) です。
+    SQLite以外のDB、または3文字未満の語を含む場合は LIKE 検索 (id順) になります。
+    """
+    terms = q.split()
+    if not terms:
+        return [], None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    use_fts = db.get_bind().dialect.name == "sqlite" and all(len(t) >= FTS_MIN_TERM_LENGTH for t in terms)
+    if use_fts:
+        # 各語をフレーズとして引用符で囲み、FTS5の構文として解釈されないようにする
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        fts = literal_column(f'"{models.TODO_FTS_TABLE}"')
+        hits = (
+            select(literal_column(f'"{models.TODO_FTS_TABLE}".rowid').label("id"), func.bm25(fts).label("rank"))
+            .select_from(table(models.TODO_FTS_TABLE))
+            .where(fts.op("MATCH")(match))
+            .subquery()
+        )
+        rank = hits.c.rank # bm25 は小さいほど関連度が高い
+        stmt = select(models.Todo, rank).join(hits, models.Todo.id == hits.c.id).where(models.Todo.owner_id == owner_id)
+    else:
+        rank = literal(0.0)
+        stmt = select(models.Todo, rank.label("rank")).where(
+            models.Todo.owner_id == owner_id,
+            *[models.Todo.content.contains(t, autoescape=True) for t in terms],
+        )
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, "rank")
+        stmt = stmt.where(or_(rank > value, and_(rank == value, models.Todo.id > last_id)))
+    stmt = stmt.options(selectinload(models.Todo.tags)).order_by(rank, models.Todo.id).limit(limit + 1)
+
+    rows = (await db.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_todo, last_rank = rows[-1]
+        next_cursor = encode_cursor("rank", last_rank, last_todo.id)
+    return [todo for todo, _ in rows], next_cursor
+
+# === エクスポート (ストリーミング) ===
+
+async def iter_todo_export_batches(db: AsyncSession, owner_id: int, batch_size: int):
+    """
+    ユーザーのすべてのTodoをタグ付きで batch_size 件ずつ返す非同期ジェネレータ。(id順、(owner_id, id) の索引を使う)
+    サーバーサイドカーソル (yield_per) で読むので、件数が増えてもメモリ使用量は一定。
+    ORMオブジェクトは作らず、各行を辞書で返す。タグはバッチごとに1回のクエリでまとめて読む。
+    """
+    stmt = (
+        select(*TODO_ROW_COLUMNS)
+        .where(models.Todo.owner_id == owner_id)
+        .order_by(models.Todo.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(stmt)
+    async for partition in result.partitions():
+        yield await _todo_rows_to_dicts(db, partition)
+
+# === インポート ===
+
+async def _get_or_create_tag_ids(db: AsyncSession, owner_id: int, descriptions: list, seq: int) -> tuple:
+    """
+    タグの説明のリストをユーザーのタグの {説明: tag_id} に解決します。存在しないタグは変更シーケンス seq でまとめて作成します。
+    (解決結果, 作成したタグの {説明: tag_id}) を返します。
+    """
+    if not descriptions:
+        return {}, {}
+    stmt = (
+        select(models.Tag.description, func.min(models.Tag.id))
+        .where(models.Tag.owner_id == owner_id, models.Tag.description.in_(descriptions))
+        .group_by(models.Tag.description)
+    )
+    resolved = dict((await db.execute(stmt)).all())
+    missing = [d for d in descriptions if d not in resolved]
+    created = {}
+    if missing:
+        # IDを昇順に並べれば行の順と対応する (apply_todo_batch の作成と同じ)
+        stmt = insert(models.Tag).returning(models.Tag.id)
+        new_ids = sorted((await db.scalars(stmt, [{"description": d, "change_seq": seq, "owner_id": owner_id} for d in missing])).all())
+        created = dict(zip(missing, new_ids))
+        resolved.update(created)
+        await bump_change_counters(db, TAG_COUNTER)
+    return resolved, created
+
+async def import_todo_chunk(db: AsyncSession, owner_id: int, rows: list, tag_ids: dict) -> tuple:
+    """
+    インポートするTodoの1チャンクを、owner_id のユーザーのものとして1つのトランザクションで挿入します。(executemany でまとめて挿入)
+    rows は content / due_date / is_completed / tags (タグの説明のリスト) を持つ辞書のリスト。
+    tag_ids は解決済みの {説明: tag_id} で、インポート全体で使い回す (新しく解決したものを追加する)。
+    (新しいTodoのIDのリスト, 作成したタグの件数) を返します。
+    """
+    descriptions = list(dict.fromkeys(d for row in rows for d in row["tags"]))
+    known = {d: tag_ids[d] for d in descriptions if d in tag_ids}
+
+    async def write(db: AsyncSession):
+        seq = await next_change_seq(db)
+        resolved, created = await _get_or_create_tag_ids(db, owner_id, [d for d in descriptions if d not in known], seq)
+        resolved.update(known)
+
+        stmt = insert(models.Todo).returning(models.Todo.id)
+        params = [
+            {
+                "content": row["content"], "due_date": row["due_date"], "is_completed": row["is_completed"],
+                "change_seq": seq, "owner_id": owner_id,
+            }
+            for row in rows
+        ]
+        new_ids = sorted((await db.scalars(stmt, params)).all())
+        links = [
+            {"todo_id": todo_id, "tag_id": resolved[description], "change_seq": seq}
+            for todo_id, row in zip(new_ids, rows)
+            for description in dict.fromkeys(row["tags"])
+        ]
+        if links:
+            await db.execute(insert(models.todo_tag_association), links)
+        await bump_change_counters(db, TODO_COUNTER)
+        return new_ids, resolved, created
+
+    try:
+        new_ids, resolved, created = await _commit_write(db, write)
+    except IntegrityError:
+        # 同じ説明のタグを別のリクエストが先に作成した (一意索引に違反) か、解決済みのタグが削除された。
+        # チャンクはロールバックされているので、タグをすべてDBから読み直して1回だけやり直す
+        known = {}
+        new_ids, resolved, created = await _commit_write(db, write)
+
+    # コミットできたものだけを解決済みとして残し、作成したタグはキャッシュにも書き込む
+    tag_ids.update(resolved)
+    for description, tag_id in created.items():
+        tag_cache.put(CachedTag(id=tag_id, description=description, version=1, owner_id=owner_id))
+    event_hub.publish(owner_id, "tag", "upsert", created.values())
+    event_hub.publish(owner_id, "todo", "upsert", new_ids)
+    return new_ids, len(created)
+
+# === 一括操作 (バッチ) ===
+
+async def apply_todo_batch(db: AsyncSession, owner_id: int, operations: list, atomic: bool = True):
+    """
+    owner_id のユーザーのTodoへの複数のTodo操作 (create/update/toggle/delete) を1つのトランザクションで適用します。
+    操作は種類ごとにまとめて、1種類あたり1回のINSERT/UPDATE/DELETE文で実行します。
+    (同じIDへの複数操作は順序が保証できないため、2件目以降はエラーにします)
+
+    atomic=True の場合、1件でも不正な操作があれば何も適用しません。
+    戻り値は (操作ごとの結果のリスト, コミットしたかどうか) です。
+    """
+    results = [{"index": i, "op": op.op, "id": op.id, "status": "ok"} for i, op in enumerate(operations)]
+
+    def fail(i, status, error):
+        results[i].update(status=status, error=error)
+
+    # --- 入力チェック (DBに触れない) ---
+    seen_ids = set()
+    for i, op in enumerate(operations):
+        if op.op == "create":
+            if op.content is None:
+                fail(i, "invalid", "content is required")
+            continue
+        if op.id is None:
+            fail(i, "invalid", "id is required")
+        elif op.op == "update" and op.content is None:
+            fail(i, "invalid", "content is required")
+        elif op.op in ("toggle", "delete") and op.is_completed is not None:
+            fail(i, "invalid", f"is_completed is not allowed for {op.op}")
+        elif op.id in seen_ids:
+            fail(i, "invalid", "duplicate id in batch")
+        else:
+            seen_ids.add(op.id)
+
+    # --- ここから先はDBに触れるので、書き込み (write) の中で行う ---
+    # グループコミットでは別のセッションで実行されるので、存在チェックも書き込みと同じトランザクションで行う
+    by_op = {"create": [], "update": [], "toggle": [], "delete": []}
+
+    async def write(db: AsyncSession) -> bool:
+        # --- 存在チェック (参照される全IDを1回のSELECTで確認。他のユーザーのTodoは存在しないものとする) ---
+        # 以降のUPDATE/DELETEはここで確認したIDだけを対象にするので、owner_id で絞り込まなくてよい
+        if seen_ids:
+            stmt = select(models.Todo.id).where(models.Todo.id.in_(seen_ids), models.Todo.owner_id == owner_id)
+            existing_ids = set((await db.execute(stmt)).scalars().all())
+            for i, op in enumerate(operations):
+                if op.op != "create" and results[i]["status"] == "ok" and op.id not in existing_ids:
+                    fail(i, "not_found", "todo not found")
+
+        valid = [i for i, r in enumerate(results) if r["status"] == "ok"]
+        if atomic and len(valid) != len(operations):
+            for i in valid:
+                results[i]["status"] = "aborted"
+            return False
+        if not valid:
+            return True
+
+        for i in valid:
+            by_op[operations[i].op].append(i)
+
+        seq = await next_change_seq(db)
+        if by_op["create"]:
+            # sort_by_parameter_order=True はSQLiteでは1行ずつのINSERTになるので使わない。
+            # 1つのINSERT文の中ではIDは行の順に増えていく (SQLiteのrowid、PostgreSQLのシーケンス) ので、
+            # 返ってきたIDを昇順に並べれば操作の順と対応する
+            stmt = insert(models.Todo).returning(models.Todo.id)
+            params = [
+                {
+                    "content": operations[i].content, "due_date": operations[i].due_date,
+                    "is_completed": bool(operations[i].is_completed), "change_seq": seq, "owner_id": owner_id,
+                }
+                for i in by_op["create"]
+            ]
+            new_ids = sorted((await db.scalars(stmt, params)).all())
+            for i, new_id in zip(by_op["create"], new_ids):
+                results[i]["id"] = new_id
+
+        if by_op["update"]:
+            # パラメータのリストを渡して1つのUPDATE文を executemany で実行する
+            # (is_completed が省略された行は COALESCE で元の値のままにする)
+            t = models.Todo.__table__
+            stmt = (
+                update(t)
+                .where(t.c.id == bindparam("b_id"))
+                .values({
+                    t.c["内容"]: bindparam("b_content"),
+                    t.c["期限"]: bindparam("b_due_date"),
+                    t.c["完了/未完了"]: func.coalesce(bindparam("b_is_completed", type_=t.c["完了/未完了"].type), t.c["完了/未完了"]),
+                    t.c.version: t.c.version + 1,
+                    t.c.change_seq: seq,
+                })
+            )
+            params = [
+                {
+                    "b_id": operations[i].id, "b_content": operations[i].content,
+                    "b_due_date": operations[i].due_date, "b_is_completed": operations[i].is_completed,
+                }
+                for i in by_op["update"]
+            ]
+            await db.execute(stmt, params)
+
+        if by_op["toggle"]:
+            toggle_ids = [operations[i].id for i in by_op["toggle"]]
+            stmt = (
+                update(models.Todo)
+                .where(models.Todo.id.in_(toggle_ids))
+                .values(
+                    is_completed=case((models.Todo.is_completed == True, False), else_=True),
+                    version=models.Todo.version + 1,
+                    change_seq=seq,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(stmt)
+            stmt = select(models.Todo.id, models.Todo.is_completed).where(models.Todo.id.in_(toggle_ids))
+            new_status = dict((await db.execute(stmt)).all())
+            for i in by_op["toggle"]:
+                results[i]["is_completed"] = new_status[operations[i].id]
+
+        if by_op["delete"]:
+            delete_ids = [operations[i].id for i in by_op["delete"]]
+            await db.execute(
+                delete(models.todo_tag_association)
+                .where(models.todo_tag_association.c.todo_id.in_(delete_ids))
+            )
+            await db.execute(
+                delete(models.Todo)
+                .where(models.Todo.id.in_(delete_ids))
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                insert(models.SyncTombstone),
+                [
+                    {"change_seq": seq, "entity": "todo", "entity_id": todo_id, "owner_id": owner_id}
+                    for todo_id in delete_ids
+                ],
+            )
+
+        await bump_change_counters(db, TODO_COUNTER)
+        return True
+
+    if not await _commit_write(db, write):
+        return results, False
+    upserted = [results[i]["id"] for op in ("create", "update", "toggle") for i in by_op[op]]
+    event_hub.publish(owner_id, "todo", "upsert", upserted)
+    event_hub.publish(owner_id, "todo", "delete", [operations[i].id for i in by_op["delete"]])
+    return results, True
+
+# === 差分同期 (GET /api/sync) ===
+# ユーザーの行のうち change_seq が since より大きいものと、墓標 (削除の記録) を返す。
+# シーケンスは全ユーザーで共通なので、1人のユーザーから見ると飛び飛びになる。
+# ページはシーケンスの境目で区切り、1つのシーケンス (=1つのトランザクションの書き込み) を分けない。
+
+class SyncExpiredError(Exception):
+    """since より後の墓標が圧縮 (削除) 済みで、差分では同期できない場合のエラー。"""
+    pass
+
+def _sync_sources(owner_id: int) -> dict:
+    """名前 -> (ユーザーで絞り込んだSELECT文, change_seq の列)"""
+    todo, tag, assoc, tomb = models.Todo, models.Tag, models.todo_tag_association, models.SyncTombstone
+    return {
+        "todos": (
+            select(todo.id, todo.content, todo.due_date, todo.is_completed, todo.version, todo.updated_at, todo.change_seq)
+            .where(todo.owner_id == owner_id),
+            todo.change_seq,
+        ),
+        "tags": (
+            select(tag.id, tag.description, tag.version, tag.updated_at, tag.change_seq).where(tag.owner_id == owner_id),
+            tag.change_seq,
+        ),
+        # 関連付けはTodoと同じユーザーのもの
+        "links": (
+            select(assoc.c.todo_id, assoc.c.tag_id, assoc.c.change_seq)
+            .join(todo, todo.id == assoc.c.todo_id)
+            .where(todo.owner_id == owner_id),
+            assoc.c.change_seq,
+        ),
+        "tombstones": (
+            select(tomb.entity, tomb.entity_id.label("id"), tomb.tag_id, tomb.change_seq, tomb.deleted_at)
+            .where(tomb.owner_id == owner_id),
+            tomb.change_seq,
+        ),
+    }
+
+async def _fetch_sync_rows(db: AsyncSession, owner_id: int, since: int, upto: int, limit: Optional[int]) -> dict:
+    """各テーブルから since < change_seq <= upto の行をシーケンス順に取得します。(limit は各テーブルごと)"""
+    fetched = {}
+    for name, (stmt, seq_column) in _sync_sources(owner_id).items():
+        stmt = stmt.where(seq_column > since, seq_column <= upto).order_by(seq_column)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        fetched[name] = (await db.execute(stmt)).all()
+    return fetched
+
+async def get_sync_changes(db: AsyncSession, owner_id: int, since: int, limit: int) -> dict:
+    """
+    ユーザーの行と墓標のうち、変更シーケンスが since より後のものを、合計がおよそ limit 件になるように返します。
+    next_since を次の since にして、has_more が False になるまで繰り返します。(since=0 は全件)
+    1つのシーケンスの行が limit より多い場合は、そのシーケンスの行をすべて返します。
+    """
+    counters = await get_change_counters(db, SYNC_COUNTER, SYNC_COMPACTED_COUNTER)
+    head = counters[SYNC_COUNTER]
+    if 0 < since < counters[SYNC_COMPACTED_COUNTER]:
+        raise SyncExpiredError(f"changes before sequence {counters[SYNC_COMPACTED_COUNTER]} have been compacted")
+    if since > head:
+        # DBが作り直された (または別のDBの) シーケンス
+        raise SyncExpiredError(f"sequence {since} is ahead of the current sequence {head}")
+    upto = head
+    fetched = await _fetch_sync_rows(db, owner_id, since, upto, limit + 1)
+    seqs = sorted(row.change_seq for rows in fetched.values() for row in rows)
+    if len(seqs) > limit:
+        # limit+1 件目のシーケンスの手前で区切る。それより前の行は各テーブルの limit+1 件に必ず含まれている
+        upto = seqs[limit] - 1
+        if upto <= since:
+            upto = seqs[limit]
+            fetched = await _fetch_sync_rows(db, owner_id, since, upto, None)
+
+    def rows_upto(name):
+        return [row._asdict() for row in fetched[name] if row.change_seq <= upto]
+
+    return {
+        "since": since,
+        "next_since": upto,
+        "has_more": upto < head,
+        "todos": rows_upto("todos"),
+        "tags": rows_upto("tags"),
+        "links": rows_upto("links"),
+        "tombstones": rows_upto("tombstones"),
+    }
+
+async def compact_tombstones(db: AsyncSession, older_than: datetime) -> int:
+    """
+    older_than より前に記録された墓標を削除し、削除件数を返します。(cronなどで定期的に実行する)
+    削除した最大のシーケンスを記録し、それより古い since での同期は SyncExpiredError にします。
+    (そのクライアントは since=0 で全件を取り直す)
+    """
+    tomb = models.SyncTombstone
+    max_seq = (await db.execute(select(func.max(tomb.change_seq)).where(tomb.deleted_at < older_than))).scalar()
+    if max_seq is None:
+        return 0
+    result = await db.execute(delete(tomb).where(tomb.change_seq <= max_seq))
+    counter = models.ChangeCounter.__table__
+    await db.execute(_insert_ignore(db, counter).values(name=SYNC_COMPACTED_COUNTER, value=0))
+    await db.execute(
+        update(counter)
+        .where(counter.c.name == SYNC_COMPACTED_COUNTER, counter.c.value < max_seq)
+        .values(value=max_seq)
+    )
+    await db.commit()
+    return result.rowcount
+
 # === Tag CRUD 関数 ===
+# 読み込みはタグのキャッシュ (cache.tag_cache) を通し、セッションから切り離した CachedTag を返す。
+# キャッシュは全ユーザーで共有するので、IDで引いたタグは持ち主を確認してから返す。
+# 書き込みはセッション上のTagを読み直して更新し、コミット後にキャッシュへ書き込む。
+
+def _cached_tag(db_tag: models.Tag) -> CachedTag:
+    return CachedTag(id=db_tag.id, description=db_tag.description, version=db_tag.version, owner_id=db_tag.owner_id)
+
+async def _sync_tag_cache(db: AsyncSession):
+    """
+    tag_cache_sync_interval が設定されていれば、その間隔でDBの変更カウンタを確認し、
+    他のプロセスでタグが変更されていたらキャッシュを捨てます。
+    """
+    interval = settings.tag_cache_sync_interval
+    if interval <= 0 or not tag_cache.sync_due(interval):
+        return
+    counters = await get_change_counters(db, TAG_COUNTER)
+    tag_cache.sync(counters[TAG_COUNTER])
+
+async def _load_tag(db: AsyncSession, id: int, owner_id: int):
+    """更新・削除用に、セッション上のTagを取得します。(キャッシュは使わず、セッションに古い内容が残っていても上書きする)"""
+    stmt = (
+        select(models.Tag)
+        .where(models.Tag.id == id, models.Tag.owner_id == owner_id)
+        .execution_options(populate_existing=True)
+    )
+    return (await db.execute(stmt)).scalars().first()
+
+async def _get_tag_by_id(db: AsyncSession, id: int) -> Optional[CachedTag]:
+    """IDでタグを取得します。(持ち主は確認しない)"""
+    await _sync_tag_cache(db)
+    hit, tag = tag_cache.get_by_id(id)
+    if hit:
+        return tag
+    seen = tag_cache.writes
+    db_tag = (await db.execute(select(models.Tag).where(models.Tag.id == id))).scalars().first()
+    tag = _cached_tag(db_tag) if db_tag else None
+    tag_cache.set_by_id(id, tag, seen)
+    return tag
 
-def get_tag(db: Session, id: int):
+async def get_tag(db: AsyncSession, id: int, owner_id: int) -> Optional[CachedTag]:
     """IDを指定して単一のTag項目を取得します。"""
-    return db.query(models.Tag).filter(models.Tag.id == id).first()
-
-def get_tag_by_description(db: Session, description: str):
-    """description（説明）を指定してTag項目を取得します。"""
-    return db.query(models.Tag).filter(models.Tag.description == description).first()
-
-def get_tags(db: Session, skip: int = 0, limit: int = 100):
-    """Tag項目のリストを取得します。"""
-    return db.query(models.Tag).offset(skip).limit(limit).all()
-
-def create_tag(db: Session, tag: schemas.TagCreate):
-    """新しいTag項目を作成します。"""
-    db_tag = models.Tag(description=tag.description)
-    db.add(db_tag)
-    db.commit()
-    db.refresh(db_tag)
-    return db_tag
-
-def update_tag(db: Session, tag_id: int, tag: schemas.TagCreate):
-    """既存のTag項目を更新します。"""
-    db_tag = get_tag(db, id=tag_id)
-    if db_tag:
+    tag = await _get_tag_by_id(db, id)
+    return tag if tag is not None and tag.owner_id == owner_id else None
+
+async def get_tag_by_description(db: AsyncSession, owner_id: int, description: str) -> Optional[CachedTag]:
+    """description（説明）を指定してユーザーのTag項目を取得します。"""
+    await _sync_tag_cache(db)
+    hit, tag = tag_cache.get_by_description(owner_id, description)
+    if hit:
+        return tag
+    seen = tag_cache.writes
+    stmt = select(models.Tag).where(models.Tag.owner_id == owner_id, models.Tag.description == description)
+    db_tag = (await db.execute(stmt)).scalars().first()
+    tag = _cached_tag(db_tag) if db_tag else None
+    tag_cache.set_by_description(owner_id, description, tag, seen)
+    return tag
+
+async def get_tags(
+    db: AsyncSession, owner_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, sort: str = "id"
+):
+    """Tag項目を1ページ分取得します。(項目リスト, 次ページのカーソル) を返します。"""
+    await _sync_tag_cache(db)
+    # 書き込み回数 (seen) をキーに含めるので、読んでいる間に書き込みがあれば古い一覧は使われない
+    seen = tag_cache.writes
+    key = ("page", owner_id, sort, limit, cursor)
+    hit, page = tag_cache.get_list(key, seen)
+    if hit:
+        return page
+    stmt = select(models.Tag).where(models.Tag.owner_id == owner_id)
+    db_tags, next_cursor = await _keyset_page(db, stmt, TAG_SORT_KEYS, models.Tag.id, sort, limit, cursor)
+    page = ([_cached_tag(t) for t in db_tags], next_cursor)
+    tag_cache.set_list(key, page, seen)
+    return page
+
+async def get_all_tags(db: AsyncSession, owner_id: int):
+    """ユーザーのすべてのTag項目を説明順で取得します。(タグ選択欄など、HTMLページ用)"""
+    await _sync_tag_cache(db)
+    seen = tag_cache.writes
+    key = ("all", owner_id)
+    hit, tags = tag_cache.get_list(key, seen)
+    if hit:
+        return tags
+    stmt = select(models.Tag).where(models.Tag.owner_id == owner_id).order_by(models.Tag.description, models.Tag.id)
+    tags = [_cached_tag(t) for t in (await db.execute(stmt)).scalars().all()]
+    tag_cache.set_list(key, tags, seen)
+    return tags
+
+class DuplicateTagError(ValueError):
+    """ユーザーのタグに同じ説明のものが既にある場合の例外。(説明は一意索引 ix_Tag_owner_id_説明 で守る)"""
+
+async def _check_description_free(db: AsyncSession, owner_id: int, description: str, tag_id: Optional[int] = None):
+    """
+    ユーザーの他のタグ (tag_id 以外) が同じ説明を使っていれば DuplicateTagError にします。
+    書き込みの中で呼ぶので、グループコミットでも確認から書き込みまでの間に他の書き込みは入らない。
+    (それでもすり抜けたもの、例えば別のワーカーの書き込みは一意索引で防ぐ)
+    """
+    stmt = select(models.Tag.id).where(models.Tag.owner_id == owner_id, models.Tag.description == description)
+    if tag_id is not None:
+        stmt = stmt.where(models.Tag.id != tag_id)
+    if (await db.execute(stmt.limit(1))).first() is not None:
+        raise DuplicateTagError("tag description already exists")
+
+async def _commit_tag_write(db: AsyncSession, write):
+    """_commit_write と同じ。説明が一意索引に違反したら DuplicateTagError にします。"""
+    try:
+        return await _commit_write(db, write)
+    except IntegrityError as e:
+        await db.rollback()
+        raise DuplicateTagError("tag description already exists") from e
+
+async def create_tag(db: AsyncSession, tag: schemas.TagCreate, owner_id: int):
+    """新しいTag項目を作成します。同じ説明のタグがあれば DuplicateTagError。"""
+    async def write(db: AsyncSession):
+        await _check_description_free(db, owner_id, tag.description)
+        db_tag = models.Tag(description=tag.description, change_seq=await next_change_seq(db), owner_id=owner_id)
+        db.add(db_tag)
+        await bump_change_counters(db, TAG_COUNTER)
+        return db_tag
+
+    db_tag = await _commit_tag_write(db, write)
+    cached = _cached_tag(db_tag)
+    tag_cache.put(cached)
+    event_hub.publish(owner_id, "tag", "upsert", [cached.id])
+    return cached
+
+async def update_tag(
+    db: AsyncSession, tag_id: int, owner_id: int, tag: schemas.TagCreate, expected_version: Optional[int] = None
+):
+    """
+    既存のTag項目を更新します。他に同じ説明のタグがあれば DuplicateTagError。
+    expected_version は If-Match で確認したバージョン (なければ None)。
+    """
+    async def write(db: AsyncSession):
+        db_tag = await _load_tag(db, id=tag_id, owner_id=owner_id)
+        if db_tag is None:
+            return None, None
+        _check_version(db_tag, expected_version)
+        await _check_description_free(db, owner_id, tag.description, tag_id)
+        old_description = db_tag.description
         db_tag.description = tag.description
-        db.commit()
-        db.refresh(db_tag)
-    return db_tag
-
-def delete_tag(db: Session, tag_id: int):
-    """IDを指定してTag項目を削除します。"""
-    db_tag = get_tag(db, id=tag_id)
-    if db_tag:
-        db.delete(db_tag)
-        db.commit()
-    return db_tag # 削除されたオブジェクトまたはNoneを返す
+        db_tag.change_seq = await next_change_seq(db)
+        # タグ名はTodoのレスポンスにも含まれるので、関連するTodoのバージョンも上げる
+        await _bump_todo_versions(db, _todo_ids_with_tags([tag_id]), db_tag.change_seq)
+        await bump_change_counters(db, TAG_COUNTER, TODO_COUNTER)
+        return db_tag, old_description
+
+    db_tag, old_description = await _commit_tag_write(db, write)
+    if db_tag is None:
+        return None
+    cached = _cached_tag(db_tag)
+    tag_cache.put(cached, old_description=old_description)
+    event_hub.publish(owner_id, "tag", "upsert", [cached.id])
+    return cached
+
+async def delete_tag(db: AsyncSession, tag_id: int, owner_id: int, expected_version: Optional[int] = None):
+    """IDを指定してTag項目を削除します。expected_version は If-Match で確認したバージョン (なければ None)。"""
+    async def write(db: AsyncSession):
+        db_tag = await _load_tag(db, id=tag_id, owner_id=owner_id)
+        if db_tag is None:
+            return None
+        _check_version(db_tag, expected_version)
+        cached = _cached_tag(db_tag)
+        seq = await next_change_seq(db)
+        await _bump_todo_versions(db, _todo_ids_with_tags([tag_id]), seq)
+        await db.delete(db_tag)
+        db.add(models.SyncTombstone(change_seq=seq, entity="tag", entity_id=tag_id, owner_id=owner_id))
+        await bump_change_counters(db, TAG_COUNTER, TODO_COUNTER)
+        return cached
+
+    cached = await _commit_write(db, write)
+    if cached is None:
+        return None
+    tag_cache.remove(cached)
+    event_hub.publish(owner_id, "tag", "delete", [cached.id])
+    return cached # 削除されたタグを返す
 
 # === 関連付け用関数 ===
 
-def add_tag_to_todo(db: Session, todo_id: int, tag_id: int):
-    """TodoにTagを関連付けます。"""
-    db_todo = get_todo(db, id=todo_id)
-    db_tag = get_tag(db, id=tag_id)
-    if db_todo and db_tag:
-        # 同じタグを複数回追加しないようにチェック（任意）
-        if db_tag not in db_todo.tags:
-            db_todo.tags.append(db_tag)
-            db.commit()
-            db.refresh(db_todo)
+def _insert_ignore(db: AsyncSession, table):
+    """
+    重複 (主キー衝突) を無視するINSERT文を返します。
+    (SQLite/PostgreSQL: ON CONFLICT DO NOTHING, MySQL: INSERT IGNORE)
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(table).prefix_with("IGNORE")
+    return dialect_insert(table).on_conflict_do_nothing()
+
+async def todo_exists(db: AsyncSession, id: int, owner_id: int) -> bool:
+    """ユーザーのTodoが存在するかどうかだけを確認します。(タグなどは読み込みません)"""
+    stmt = select(models.Todo.id).where(models.Todo.id == id, models.Todo.owner_id == owner_id)
+    return (await db.execute(stmt)).first() is not None
+
+async def get_missing_tag_ids(db: AsyncSession, owner_id: int, tag_ids: list) -> list:
+    """
+    指定したTag IDのうち、存在しない (他のユーザーのものを含む) ものを返します。
+    (キャッシュにないものだけDBで確認する)
+    """
+    await _sync_tag_cache(db)
+    missing, unknown = [], []
+    for tag_id in dict.fromkeys(tag_ids):
+        hit, tag = tag_cache.get_by_id(tag_id)
+        if not hit:
+            unknown.append(tag_id)
+        elif tag is None or tag.owner_id != owner_id:
+            missing.append(tag_id)
+    if unknown:
+        seen = tag_cache.writes
+        stmt = select(models.Tag).where(models.Tag.id.in_(unknown))
+        found = {t.id: _cached_tag(t) for t in (await db.execute(stmt)).scalars().all()}
+        for tag_id in unknown:
+            tag_cache.set_by_id(tag_id, found.get(tag_id), seen)
+            if tag_id not in found or found[tag_id].owner_id != owner_id:
+                missing.append(tag_id)
+    return [tag_id for tag_id in dict.fromkeys(tag_ids) if tag_id in missing]
+
+async def _reload_todo(db: AsyncSession, todo_id: int):
+    """
+    関連付けを直接SQLで変更した後に、タグを含めてTodoを読み直します。
+    (セッション内に古いタグ一覧が残っていても上書きする)
+    """
+    stmt = (
+        select(models.Todo)
+        .options(selectinload(models.Todo.tags))
+        .where(models.Todo.id == todo_id)
+        .execution_options(populate_existing=True)
+    )
+    return (await db.execute(stmt)).scalars().first()
+
+async def attach_tags(db: AsyncSession, todo_id: int, owner_id: int, tag_ids: list):
+    """
+    ユーザーのTodoに複数のTagをまとめて関連付けます。(Todoが存在しない・他のユーザーのものなら None)
+    既に関連付け済みのものは INSERT ... ON CONFLICT DO NOTHING で無視するので、
+    タグ一覧を読み込んで重複を確認する必要はありません。存在しない・他のユーザーのTag IDは無視されます。
+    """
+    if not tag_ids:
+        return await _reload_todo(db, todo_id)
+
+    async def write(db: AsyncSession):
+        if not await todo_exists(db, todo_id, owner_id): # 呼び出し側の確認の後に削除された
+            return None
+        seq = await next_change_seq(db)
+        rows = (
+            select(literal(todo_id), models.Tag.id, literal(seq))
+            .where(models.Tag.id.in_(tag_ids), models.Tag.owner_id == owner_id)
+        )
+        stmt = _insert_ignore(db, models.todo_tag_association).from_select(["todo_id", "tag_id", "change_seq"], rows)
+        await db.execute(stmt)
+        await _bump_todo_versions(db, [todo_id], seq)
+        await bump_change_counters(db, TODO_COUNTER)
+        return await _reload_todo(db, todo_id)
+
+    db_todo = await _commit_write(db, write)
+    if db_todo:
+        event_hub.publish(owner_id, "todo", "upsert", [todo_id])
+    return db_todo
+
+async def detach_tags(db: AsyncSession, todo_id: int, owner_id: int, tag_ids: list):
+    """
+    ユーザーのTodoから複数のTagの関連付けを1回のDELETEでまとめて外します。(実際に外れたものを同期用に記録する)
+    Todoが存在しない・他のユーザーのものなら None を返します。
+    """
+    if not tag_ids:
+        return await _reload_todo(db, todo_id)
+
+    async def write(db: AsyncSession):
+        if not await todo_exists(db, todo_id, owner_id):
+            return None
+        seq = await next_change_seq(db)
+        assoc = models.todo_tag_association
+        stmt = (
+            delete(assoc)
+            .where(assoc.c.todo_id == todo_id, assoc.c.tag_id.in_(tag_ids))
+            .returning(assoc.c.tag_id)
+        )
+        removed = (await db.execute(stmt)).scalars().all()
+        if removed:
+            await db.execute(
+                insert(models.SyncTombstone),
+                [
+                    {"change_seq": seq, "entity": "todo_tag", "entity_id": todo_id, "tag_id": t, "owner_id": owner_id}
+                    for t in removed
+                ],
+            )
+        await _bump_todo_versions(db, [todo_id], seq)
+        await bump_change_counters(db, TODO_COUNTER)
+        return await _reload_todo(db, todo_id)
+
+    db_todo = await _commit_write(db, write)
+    if db_todo:
+        event_hub.publish(owner_id, "todo", "upsert", [todo_id])
     return db_todo
 
-def get_user(db: Session, user_id: int):
+async def add_tag_to_todo(db: AsyncSession, todo_id: int, owner_id: int, tag_id: int):
+    """TodoにTagを関連付けます。"""
+    return await attach_tags(db, todo_id, owner_id, [tag_id])
+
+async def get_user(db: AsyncSession, user_id: int):
     """
     IDでユーザーを1件取得
     """
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    stmt = select(models.User).where(models.User.id == user_id)
+    return (await db.execute(stmt)).scalars().first()
 
-def get_user_by_username(db: Session, username: str):
+async def get_user_by_username(db: AsyncSession, username: str):
     """
     ユーザー名でユーザーを1件取得 (ログイン認証時に使用)
     """
-    return db.query(models.User).filter(models.User.username == username).first()
+    stmt = select(models.User).where(models.User.username == username)
+    return (await db.execute(stmt)).scalars().first()
 
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     """
     新しいユーザーを作成
     """
-    # パスワードをハッシュ化
-    hashed_password = get_password_hash(user.password)
+    # ユーザー名の確認などで始まったトランザクションを終えて接続をプールに返し、
+    # ハッシュ化を待つ間に書き込み用の接続をふさがないようにする
+    await db.rollback()
+    # パスワードをハッシュ化 (専用のワーカープールで実行。満杯なら PasswordHashPoolSaturated)
+    hashed_password = await get_password_hash_async(user.password)
     
     # データベースモデルを作成
     db_user = models.User(
@@ -119,6 +1146,47 @@ def create_user(db: Session, user: schemas.UserCreate):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    await db.commit()
+    return db_user
+
+async def set_user_active(db: AsyncSession, user_id: int, is_active: bool):
+    """
+    ユーザーの有効/無効を切り替えます。無効化した場合は認証キャッシュからも削除します。
+    """
+    async def write(db: AsyncSession):
+        db_user = await get_user(db, user_id=user_id)
+        if db_user:
+            db_user.is_active = is_active
+        return db_user
+
+    db_user = await _commit_write(db, write)
+    if db_user and not is_active:
+        invalidate_principal(db_user.username)
+    return db_user
+
+async def delete_user(db: AsyncSession, user_id: int):
+    """
+    ユーザーを、そのユーザーのTodo・Tag (関連付けと墓標も) と一緒に削除し、認証キャッシュからも削除します。
+    持ち主のいないTodo/Tagを残さないように、同じトランザクションで削除する。
+    (削除したユーザーの同期はもう行われないので、墓標は記録しない) 削除したユーザー名またはNoneを返します。
+    """
+    async def write(db: AsyncSession):
+        db_user = await get_user(db, user_id=user_id)
+        if db_user is None:
+            return None
+        assoc = models.todo_tag_association
+        owned_todos = select(models.Todo.id).where(models.Todo.owner_id == user_id)
+        await db.execute(delete(assoc).where(assoc.c.todo_id.in_(owned_todos)))
+        await db.execute(delete(models.Todo).where(models.Todo.owner_id == user_id))
+        await db.execute(delete(models.Tag).where(models.Tag.owner_id == user_id))
+        await db.execute(delete(models.SyncTombstone).where(models.SyncTombstone.owner_id == user_id))
+        await bump_change_counters(db, TODO_COUNTER, TAG_COUNTER)
+        await db.delete(db_user)
+        return db_user.username
+
+    username = await _commit_write(db, write)
+    if username is None:
+        return None
+    invalidate_principal(username)
+    tag_cache.remove_owner(user_id)
+    return username
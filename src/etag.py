@@ -0,0 +1,47 @@
+# src/etag.py
+import zlib
+from typing import Optional
+from fastapi import HTTPException, status
+
+def make_etag(*parts) -> str:
+    """バージョンなどの値から強いETag ("..." 形式) を作ります。"""
+    return '"' + "-".join(str(p) for p in parts) + '"'
+
+def _parse_etags(header: str) -> list:
+    """If-None-Match / If-Match ヘッダーをETagのリストにします。"""
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+def if_none_match(header: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match が現在のETagと一致すれば True を返します。(304を返してよい)
+    RFC 9110 に従い、弱い比較 (W/ を無視) で判定します。
+    """
+    if not header:
+        return False
+    tags = _parse_etags(header)
+    if "*" in tags:
+        return True
+    return _strip_weak(etag) in (_strip_weak(t) for t in tags)
+
+def check_if_match(header: Optional[str], etag: Optional[str]):
+    """
+    If-Match が指定されていて現在のETagと一致しなければ 412 を送出します。
+    強い比較なので W/ 付きのETagは一致しません。etag が None (リソースなし) の場合は何もしません。
+    """
+    if not header or etag is None:
+        return
+    tags = _parse_etags(header)
+    if "*" in tags or etag in tags:
+        return
+    raise HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="Resource has been modified",
+        headers={"ETag": etag},
+    )
+
+def query_digest(query: str) -> str:
+    """一覧のETag用に、クエリ文字列 (ページ・並び順・絞り込み) を短いハッシュにします。"""
+    return format(zlib.crc32(query.encode()), "08x")
@@ -0,0 +1,166 @@
+# src/events.py
+"""
+Todo/Tagの変更イベントの配信 (Server-Sent Events, GET /api/events)。
+
+crudの書き込みはコミット後に event_hub.publish() で小さなイベントを流し、
+接続中のクライアントはそれを受け取って画面を更新します。(GET /api/todo のポーリングが不要になる)
+
+    {"entity": "todo", "op": "upsert", "ids": [3, 4]}   作成・更新 (最新の内容は GET /api/todo/{id} で取得)
+    {"entity": "todo", "op": "delete", "ids": [5]}
+    {"entity": "tag",  "op": "upsert", "ids": [1]}      タグ名の変更は、そのタグが付いたTodoの表示にも影響する
+    {"entity": "tag",  "op": "delete", "ids": [2]}
+    {"op": "resync"}                                    取りこぼしがあったので、一覧を取得し直す
+
+イベントは書き込んだユーザー (Todo/Tagの持ち主) の接続にだけ配信されます。
+また、プロセス内でだけ配信されます。(複数ワーカーの場合、別のワーカーでの書き込みは届かない)
+"""
+import asyncio
+import signal
+from collections import deque
+from typing import AsyncIterator, NamedTuple, Optional
+
+import orjson
+
+from .config import settings
+
+class ChangeEvent(NamedTuple):
+    id: int       # プロセス内の通し番号 (SSEの id: / Last-Event-ID)
+    data: bytes   # JSON
+    owner_id: Optional[int] = None # 届けるユーザー (None ならすべての接続)
+
+    def encode(self) -> bytes:
+        return b"id: %d\ndata: %s\n\n" % (self.id, self.data)
+
+RESYNC_DATA = orjson.dumps({"op": "resync"})
+HEARTBEAT = b": ping\n\n" # SSEのコメント行。プロキシに無通信で切断されないように送る
+RETRY = b"retry: 3000\n\n" # 切断されたときにブラウザが再接続するまでの時間 (ミリ秒)
+
+class Subscriber:
+    """
+    接続中のクライアント1つ分の送信待ちキュー。
+    読み出しの遅いクライアントのためにキューが max_queue 件を超えたら、溜まったイベントを捨てて
+    resync イベント1件に置き換えます。(メモリを使い続けず、クライアントは一覧を取り直せばよい)
+    """
+    def __init__(self, owner_id: int, max_queue: int):
+        self.owner_id = owner_id
+        self.queue: "asyncio.Queue[Optional[ChangeEvent]]" = asyncio.Queue(max_queue)
+        self.overflows = 0
+
+    def push(self, event: ChangeEvent):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(ChangeEvent(event.id, RESYNC_DATA))
+            self.overflows += 1
+
+    def close(self):
+        """ストリームを終了させます。(None を受け取ったら送信をやめる)"""
+        while self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class EventHub:
+    """
+    プロセス内のpub/sub。publish() は待たずに各クライアントのキューに入れるだけなので、
+    書き込みのリクエストがクライアントの遅さに引きずられることはありません。
+    直近 replay_size 件を覚えておき、再接続したクライアントには Last-Event-ID の続きから送り直します。
+    """
+    def __init__(self, max_queue: int, replay_size: int):
+        self.max_queue = max_queue
+        self._subscribers: set = set()
+        self._history: "deque[ChangeEvent]" = deque(maxlen=replay_size)
+        self._last_id = 0
+
+    def publish(self, owner_id: int, entity: str, op: str, ids):
+        """変更イベントを owner_id のユーザーの接続中のクライアントに送ります。(コミット後に呼ぶ)"""
+        ids = list(ids)
+        if not ids:
+            return
+        self._last_id += 1
+        event = ChangeEvent(self._last_id, orjson.dumps({"entity": entity, "op": op, "ids": ids}), owner_id)
+        self._history.append(event)
+        for subscriber in self._subscribers:
+            if subscriber.owner_id == owner_id:
+                subscriber.push(event)
+
+    def subscribe(self, owner_id: int, last_event_id: Optional[str] = None) -> Subscriber:
+        """
+        owner_id のユーザーのクライアントを登録します。last_event_id (再接続時の Last-Event-ID) があれば、
+        その後のイベントを先にキューに入れます。覚えている範囲より古い (またはサーバーが再起動した) 場合は
+        resync を送ります。
+        """
+        subscriber = Subscriber(owner_id, self.max_queue)
+        if last_event_id is not None:
+            try:
+                last_id = int(last_event_id)
+            except ValueError:
+                last_id = -1
+            oldest_id = self._history[0].id if self._history else self._last_id + 1
+            if 0 <= last_id <= self._last_id and last_id >= oldest_id - 1:
+                for event in self._history:
+                    if event.id > last_id and event.owner_id == owner_id:
+                        subscriber.push(event)
+            else:
+                subscriber.push(ChangeEvent(self._last_id, RESYNC_DATA))
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def close(self):
+        """すべてのストリームを終了させます。(シャットダウン時。close_on_shutdown_signal から呼ばれる)"""
+        for subscriber in list(self._subscribers):
+            subscriber.close()
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "last_event_id": self._last_id,
+            "overflows": sum(s.overflows for s in self._subscribers),
+        }
+
+event_hub = EventHub(settings.event_queue_size, settings.event_replay_size)
+
+def close_on_shutdown_signal():
+    """
+    SIGINT/SIGTERM を受けたときにイベントストリームを終わらせるように、現在のシグナルハンドラ (uvicorn) を包みます。
+    uvicorn は開いている接続がすべて閉じるまで lifespan の終了処理を呼ばないので、そこで閉じるのでは間に合わない。
+    アプリの起動時 (lifespan) に呼びます。
+    """
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(event_hub.close)
+            previous(signum, frame)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            return # メインスレッド以外 (TestClient など) ではシグナルハンドラを設定できない
+
+async def stream_events(subscriber: Subscriber, heartbeat: float) -> AsyncIterator[bytes]:
+    """
+    SSEのバイト列のジェネレータ。(StreamingResponse 用)
+    heartbeat 秒イベントがなければコメント行を送ります。クライアントが切断するとジェネレータが
+    キャンセルされ、登録を解除します。
+    """
+    try:
+        yield RETRY
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            if event is None:
+                return
+            yield event.encode()
+    finally:
+        event_hub.unsubscribe(subscriber)
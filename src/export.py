@@ -0,0 +1,53 @@
+# src/export.py
+import csv
+import io
+from typing import AsyncIterator
+
+import orjson
+
+from . import crud
+from .config import settings
+from .models import AsyncReadSessionLocal
+
+EXPORT_FORMATS = {
+    # 形式 -> (Content-Type, ファイルの拡張子)
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+CSV_COLUMNS = ["id", "content", "due_date", "is_completed", "tags"]
+CSV_TAG_SEPARATOR = ";"
+
+def _ndjson_chunk(rows: list) -> bytes:
+    # orjson は date をそのまま ISO 形式で書き出せる
+    return b"".join(orjson.dumps(row) + b"\n" for row in rows)
+
+def _csv_chunk(rows: list) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row["id"],
+            row["content"],
+            row["due_date"].isoformat() if row["due_date"] else "",
+            "true" if row["is_completed"] else "false",
+            CSV_TAG_SEPARATOR.join(tag["description"] for tag in row["tags"]),
+        ])
+    return buffer.getvalue().encode("utf-8")
+
+def _csv_header() -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_COLUMNS)
+    return buffer.getvalue().encode("utf-8")
+
+async def stream_todo_export(format: str, owner_id: int) -> AsyncIterator[bytes]:
+    """
+    ユーザーのすべてのTodoを指定した形式で書き出すバイト列のジェネレータ。(StreamingResponse 用)
+    レスポンスの送信中もDBを読み続けるため、リクエストの依存関係とは別に自前のセッションを開く。
+    """
+    chunk = _csv_chunk if format == "csv" else _ndjson_chunk
+    if format == "csv":
+        yield _csv_header() # ヘッダーは行を読む前に送る (最初のバイトをすぐに返す)
+    async with AsyncReadSessionLocal() as db:
+        async for rows in crud.iter_todo_export_batches(db, owner_id, settings.todo_export_batch_size):
+            yield chunk(rows)
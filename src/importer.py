@@ -0,0 +1,147 @@
+# src/importer.py
+"""
+TodoのインポートをNDJSON/CSVファイルから行います。(/api/todo/import と `python -m src.cli import-todos` で共通)
+
+ファイルは先頭から1レコードずつ読み、chunk_size 件ごとに1つのトランザクションで挿入するので、
+ファイル全体をメモリに載せることはありません。形式は /api/todo/export の出力と同じです。
+(id は無視され、新しいIDが振られます。タグは説明で指定し、存在しなければ作成されます)
+"""
+import asyncio
+import csv
+import io
+import json
+import os
+from typing import BinaryIO, Iterator, Optional
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, schemas
+from .config import settings
+from .export import CSV_TAG_SEPARATOR
+
+IMPORT_FORMATS = ("ndjson", "csv")
+MAX_REPORTED_ERRORS = 1000 # サマリーに含める行エラーの最大件数
+
+# 拡張子 -> 形式
+FORMAT_BY_EXTENSION = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+
+class ImportFormatError(ValueError):
+    """ファイル全体として読み込めない (CSVのヘッダーがないなど) 場合のエラー。"""
+    pass
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """ファイル名の拡張子から形式を推定します。わからなければ None を返します。"""
+    if not filename:
+        return None
+    return FORMAT_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
+
+def _iter_ndjson(text: io.TextIOBase) -> Iterator[tuple]:
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, None, f"invalid JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "each line must be a JSON object"
+            continue
+        yield line_no, record, None
+
+def _iter_csv(text: io.TextIOBase) -> Iterator[tuple]:
+    # ヘッダーはここで読んで確認し、不正ならレコードを読む前にエラーにする
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None or "content" not in reader.fieldnames:
+        raise ImportFormatError("CSV header must contain a 'content' column")
+    return _iter_csv_records(reader)
+
+def _iter_csv_records(reader: csv.DictReader) -> Iterator[tuple]:
+    line_no = reader.line_num + 1
+    for record in reader:
+        # 空欄は未指定として扱う
+        record = {k: v for k, v in record.items() if k is not None and v not in (None, "")}
+        if "tags" in record:
+            record["tags"] = [t for t in record["tags"].split(CSV_TAG_SEPARATOR) if t]
+        yield line_no, record, None
+        line_no = reader.line_num + 1
+
+def _to_row(record: dict) -> dict:
+    """レコードを検証し、crud.import_todo_chunk に渡す辞書にします。"""
+    # エクスポートの出力ではタグは {"id", "description"} なので、説明だけを取り出す
+    tags = record.get("tags")
+    if isinstance(tags, list):
+        record = dict(record, tags=[t.get("description") if isinstance(t, dict) else t for t in tags])
+    return schemas.TodoImportRow.model_validate(record).model_dump()
+
+def _format_validation_error(e: ValidationError) -> str:
+    err = e.errors()[0]
+    loc = ".".join(str(part) for part in err["loc"])
+    return f"{loc}: {err['msg']}" if loc else err["msg"]
+
+def _read_chunk(records: Iterator[tuple], chunk_size: int) -> tuple:
+    """
+    次の chunk_size 件を読んで検証します。(ファイルの読み込みを伴うのでスレッドで実行する)
+    (正常な行のリスト, (行番号, エラー) のリスト, ファイルの終わりに達したか) を返します。
+    """
+    rows, errors = [], []
+    line_no = 0
+    while len(rows) + len(errors) < chunk_size:
+        try:
+            line_no, record, error = next(records)
+        except StopIteration:
+            return rows, errors, True
+        except UnicodeDecodeError:
+            errors.append((line_no + 1, "file must be UTF-8 encoded; import stopped here"))
+            return rows, errors, True
+        if error is None:
+            try:
+                rows.append(_to_row(record))
+                continue
+            except ValidationError as e:
+                error = _format_validation_error(e)
+        errors.append((line_no, error))
+    return rows, errors, False
+
+async def import_todos(
+    db: AsyncSession, file: BinaryIO, format: str, owner_id: int, chunk_size: Optional[int] = None
+) -> schemas.TodoImportSummary:
+    """
+    ファイル (バイナリ) からTodoを owner_id のユーザーのものとしてインポートし、結果のサマリーを返します。
+    チャンクごとにコミットするので、途中で失敗してもそれまでのチャンクは取り込まれたままになります。
+    """
+    if format not in IMPORT_FORMATS:
+        raise ImportFormatError(f"unsupported format: {format}")
+    chunk_size = chunk_size or settings.todo_import_chunk_size
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        return await _import_text(db, text, format, owner_id, chunk_size)
+    finally:
+        text.detach() # 呼び出し側のファイルを閉じない
+
+async def _import_text(
+    db: AsyncSession, text: io.TextIOBase, format: str, owner_id: int, chunk_size: int
+) -> schemas.TodoImportSummary:
+    parse = _iter_csv if format == "csv" else _iter_ndjson
+    try:
+        records = await asyncio.to_thread(parse, text)
+    except UnicodeDecodeError:
+        raise ImportFormatError("file must be UTF-8 encoded")
+
+    summary = schemas.TodoImportSummary()
+    tag_ids = {} # インポート全体で解決済みのユーザーのタグ {説明: id}
+    done = False
+    while not done:
+        rows, errors, done = await asyncio.to_thread(_read_chunk, records, chunk_size)
+        if rows:
+            new_ids, tags_created = await crud.import_todo_chunk(db, owner_id, rows, tag_ids)
+            summary.imported += len(new_ids)
+            summary.tags_created += tags_created
+        summary.failed += len(errors)
+        for line_no, error in errors:
+            if len(summary.errors) >= MAX_REPORTED_ERRORS:
+                summary.errors_truncated = True
+                break
+            summary.errors.append(schemas.TodoImportError(line=line_no, error=error))
+    return summary
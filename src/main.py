@@ -1,169 +1,318 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from typing import List, Optional
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Form, Query, File, UploadFile
+from fastapi.responses import HTMLResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+from typing import List, Literal, Optional
 from starlette.responses import RedirectResponse
 from starlette import status
 from fastapi.staticfiles import StaticFiles
 
 # --- ↓↓↓ ログイン機能のために追加 ↓↓↓ ---
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from datetime import timedelta
+from datetime import date, timedelta
 from . import security # security.py を import
 # --- ↑↑↑ ログイン機能のために追加 ↑↑↑ ---
 
-from . import crud, models, schemas
-from .models import SessionLocal, engine
+from . import crud, importer, metrics, models, schema, schemas, templating
+from .cache import principal_cache, cache_principal
+from .config import settings
+from .events import close_on_shutdown_signal, event_hub, stream_events
+from .etag import make_etag, if_none_match, check_if_match, query_digest
+from .export import EXPORT_FORMATS, stream_todo_export
+from .metrics import TimedORJSONResponse
+from .writer import write_queue
+from .models import AsyncReadSessionLocal, AsyncSessionLocal
+
+# uvicorn が設定済みのロガーに出すことで、起動ログに並んで表示される
+logger = logging.getLogger("uvicorn.error")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # インポート時にはDBやテンプレートに触れず、起動時にまとめて準備する
+    # (ワーカーの起動やテストでのインポートを速くするため)
+    models.init_engines()
+    logger.info("%s", models.describe_engine_config())
+    if settings.metrics_enabled:
+        metrics.instrument_engine(models.async_engine.sync_engine)
+        if models.async_read_engine is not models.async_engine:
+            metrics.instrument_engine(models.async_read_engine.sync_engine)
+    try:
+        async with models.async_engine.begin() as connection:
+            await connection.run_sync(schema.prepare_schema)
+        app.state.templates = templating.create_templates()
+        close_on_shutdown_signal() # 開いたままのイベントストリームがシャットダウンを止めないようにする
+        if settings.write_group_commit:
+            await write_queue.start()
+            logger.info(
+                "write group commit: max_batch=%d max_delay=%.1fms",
+                write_queue.max_batch, write_queue.max_delay * 1000,
+            )
+        yield
+    finally:
+        await write_queue.stop() # 受け付け済みの書き込みをコミットしてから接続を閉じる
+        await models.dispose_engines()
 
-# データベースのテーブルを作成
-models.Base.metadata.create_all(bind=engine)
+# APIのJSONは orjson で書き出す (HTMLページは response_class=HTMLResponse を指定している)
+app = FastAPI(lifespan=lifespan, default_response_class=TimedORJSONResponse)
 
-app = FastAPI()
+# ルートごとのレイテンシ・SQL数などを計測する (GET /metrics で公開)
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware)
 
-# 静的ファイルとテンプレートの設定 (プロジェクトルート基準)
+# 静的ファイルの設定 (プロジェクトルート基準。テンプレートは lifespan で app.state.templates に作る)
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
 
-# DBセッション取得用の依存関係
-def get_db():
-    db = SessionLocal()
-    try:
+# DBセッション取得用の依存関係 (非同期セッション)
+# GET/HEAD/OPTIONS は読み込み用のセッション (SQLiteでは読み込み専用の接続)、それ以外は書き込み用のセッションを使う。
+# メソッドと実際の処理が合わないエンドポイントは @db_access("read") / @db_access("write") で指定する
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+def db_access(mode: Literal["read", "write"]):
+    """
+    エンドポイントが使うDBセッションを、HTTPメソッドからの判定の代わりに指定するデコレーター。
+    @app.post などの下 (関数の直前) に付ける。
+    """
+    def decorator(endpoint):
+        endpoint.db_access = mode
+        return endpoint
+    return decorator
+
+async def get_db(request: Request):
+    endpoint = request.scope.get("endpoint")
+    mode = getattr(endpoint, "db_access", None) or ("read" if request.method in READ_METHODS else "write")
+    session_factory = AsyncReadSessionLocal if mode == "read" else AsyncSessionLocal
+    async with session_factory() as db:
         yield db
-    finally:
-        db.close()
 
 # --- ↓↓↓ ログイン機能 (OAuth2/JWT) の設定 ↓↓↓ ---
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# HTMLページ (/todo/{id} など) は Authorization ヘッダーを送れないので、ログイン時に
+# 同じトークンをこの名前のCookieにも保存する (templates/login.html)
+ACCESS_TOKEN_COOKIE = "todo_access_token"
+
+class LoginRequired(Exception):
+    """HTMLページでログインしていない (Cookieのトークンが無効な) 場合の例外。ログインページにリダイレクトする。"""
+    pass
+
+async def authenticate_token(token: str, db: AsyncSession):
     """
-    トークンをデコードし、現在のユーザーを取得する依存関係
+    トークンをデコードし、ユーザーを返します。(無効なら401、無効化されたユーザーなら400の HTTPException)
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    username = security.decode_access_token(token)
-    if username is None:
+    # 検証済みのトークンならキャッシュから返す (JWT検証とusers表の検索を省略)
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+
+    with metrics.phase("auth"):
+        claims = security.decode_access_token_claims(token)
+    if claims is None:
         raise credentials_exception
     
-    user = crud.get_user_by_username(db, username=username)
+    user = await crud.get_user_by_username(db, username=claims["sub"])
     if user is None:
         raise credentials_exception
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    cache_principal(token, user, claims.get("exp"))
     return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """
+    トークンをデコードし、現在のユーザーを取得する依存関係
+    """
+    return await authenticate_token(token, db)
+
+async def get_page_user(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    HTMLページ用に、Cookieのトークンから現在のユーザーを取得する依存関係。
+    (ログインしていなければ LoginRequired でログインページにリダイレクトする)
+    """
+    token = request.cookies.get(ACCESS_TOKEN_COOKIE)
+    if not token:
+        raise LoginRequired()
+    try:
+        return await authenticate_token(token, db)
+    except HTTPException:
+        raise LoginRequired()
+
+def todo_etag(todo_id: int, version: int) -> str:
+    return make_etag("todo", todo_id, version)
+
+def tag_etag(tag_id: int, version: int) -> str:
+    return make_etag("tag", tag_id, version)
+
+def if_match_version(request: Request, version: Optional[int]) -> Optional[int]:
+    """
+    If-Match を確認したバージョンを返します。crudの書き込みに expected_version として渡すと、
+    書き込む時点でもこのバージョンのままであることを確かめる。(If-Match がない・"*" なら None で、確かめない)
+    """
+    header = request.headers.get("if-match")
+    if not header or header.strip() == "*":
+        return None
+    return version
+
+async def check_tag_if_match(request: Request, db: AsyncSession, tag_id: int, owner_id: int) -> Optional[int]:
+    """
+    タグの If-Match を確認し、書き込みに渡すバージョン (if_match_version) を返します。
+    get_tag はキャッシュを返すことがあるので、バージョンはDBから読み直す。
+    """
+    header = request.headers.get("if-match")
+    if not header:
+        return None
+    version = await crud.get_tag_version(db, id=tag_id, owner_id=owner_id)
+    check_if_match(header, tag_etag(tag_id, version) if version is not None else None)
+    return if_match_version(request, version)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+def password_pool_saturated_exception():
+    """
+    パスワードハッシュ用プールが満杯のときに返す 503 (待たせずに即座に失敗させる)
+    """
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
 # --- ↑↑↑ ログイン機能 (OAuth2/JWT) の設定 ↑↑↑ ---
 
 
 # === フロントエンド用エンドポイント (HTMLページ) ===
 
 @app.get("/", response_class=HTMLResponse)
-def read_root(request: Request):
+async def read_root(request: Request):
     """
     ToDoアプリのメインページ
     """
-    return templates.TemplateResponse("index.html", {"request": request})
+    return request.app.state.templates.TemplateResponse("index.html", {"request": request})
 
 @app.get("/login", response_class=HTMLResponse)
-def login_page(request: Request):
+async def login_page(request: Request):
     """
     ログインページのHTMLを返します。
     """
-    return templates.TemplateResponse("login.html", {"request": request})
+    return request.app.state.templates.TemplateResponse("login.html", {"request": request})
 
 @app.get("/register", response_class=HTMLResponse)
-def register_page(request: Request):
+async def register_page(request: Request):
     """
     ユーザー登録ページのHTMLを返します。
     """
-    return templates.TemplateResponse("register.html", {"request": request})
+    return request.app.state.templates.TemplateResponse("register.html", {"request": request})
 
 ### --- ↓↓↓ これが /todo/1 などのアクセスを処理するエンドポイントです ↓↓↓ ---
 @app.get("/todo/{id}", response_class=HTMLResponse)
-def read_todo_detail(request: Request, id: int, db: Session = Depends(get_db)):
+async def read_todo_detail(
+    request: Request, id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_page_user)
+):
     """
     単一のToDo項目の詳細を表示します。
     """
-    todo = crud.get_todo(db, id=id)
+    todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if todo is None:
         raise HTTPException(status_code=404, detail=f"ID {id} のTodoは見つかりません")
     
     # templates/todo_detail.html を表示
-    return templates.TemplateResponse("todo_detail.html", {"request": request, "todo": todo})
+    return request.app.state.templates.TemplateResponse("todo_detail.html", {"request": request, "todo": todo})
 
 @app.get("/todo/{id}/edit", response_class=HTMLResponse)
-def edit_todo_form(request: Request, id: int, db: Session = Depends(get_db)):
+async def edit_todo_form(
+    request: Request, id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_page_user)
+):
     """
     既存のToDoを編集するためのフォームを表示します。
     """
-    todo = crud.get_todo(db, id=id)
+    todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if todo is None:
         raise HTTPException(status_code=404, detail=f"ID {id} のTodoは見つかりません")
-    return templates.TemplateResponse("todo_edit.html", {"request": request, "todo": todo})
+    return request.app.state.templates.TemplateResponse("todo_edit.html", {"request": request, "todo": todo})
 
 @app.post("/todo/{id}/update", status_code=status.HTTP_303_SEE_OTHER)
-def update_todo_from_form(
+async def update_todo_from_form(
     id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     content: str = Form(...),
     due_date: Optional[str] = Form(None), 
-    is_completed: Optional[bool] = Form(False)
+    is_completed: Optional[bool] = Form(False),
+    current_user: models.User = Depends(get_page_user)
 ):
     """
     ToDoを更新するためのフォーム送信を処理します。
     """
     completed_status = True if is_completed else False
-    due_date_val = due_date if due_date else None
+    try:
+        due_date_val = date.fromisoformat(due_date) if due_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="期限は YYYY-MM-DD の形式で入力してください")
 
-    updated_todo = crud.update_todo(db=db, todo_id=id, content=content, due_date=due_date_val, is_completed=completed_status)
+    updated_todo = await crud.update_todo(
+        db=db, todo_id=id, owner_id=current_user.id,
+        content=content, due_date=due_date_val, is_completed=completed_status
+    )
     if updated_todo is None:
          raise HTTPException(status_code=404, detail=f"ID {id} のTodoは見つかりません")
     return RedirectResponse(url=f"/todo/{id}", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.get("/todo/{id}/manage-tags", response_class=HTMLResponse)
-def manage_todo_tags_form(request: Request, id: int, db: Session = Depends(get_db)):
+async def manage_todo_tags_form(
+    request: Request, id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_page_user)
+):
     """
     特定のToDoに関連付けられたタグを管理するページを表示します。
     """
-    todo = crud.get_todo(db, id=id)
+    todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if todo is None:
         raise HTTPException(status_code=404, detail=f"ID {id} のTodoは見つかりません")
 
-    all_tags = crud.get_tags(db)
-    return templates.TemplateResponse("manage_tags.html", {
+    tag_selector = await templating.render_tag_selector(request.app.state.templates, db, todo)
+    return request.app.state.templates.TemplateResponse("manage_tags.html", {
         "request": request,
         "todo": todo,
-        "all_tags": all_tags
+        "tag_selector": tag_selector
     })
 
 @app.post("/todo/{id}/tags/add", status_code=status.HTTP_303_SEE_OTHER)
-def add_tag_to_todo_from_form(id: int, tag_id: int = Form(...), db: Session = Depends(get_db)):
+async def add_tag_to_todo_from_form(
+    id: int,
+    tag_id: int = Form(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_page_user)
+):
     """
     フォームから送信されたタグIDを特定のToDoに関連付けます。
     """
-    if crud.get_todo(db, id=id) is None:
+    if not await crud.todo_exists(db, id=id, owner_id=current_user.id):
         raise HTTPException(status_code=404, detail=f"ID {id} のTodoは見つかりません")
-    if crud.get_tag(db, id=tag_id) is None:
+    if await crud.get_missing_tag_ids(db, current_user.id, [tag_id]):
          raise HTTPException(status_code=404, detail=f"ID {tag_id} のTagは見つかりません")
         
-    crud.add_tag_to_todo(db=db, todo_id=id, tag_id=tag_id)
+    await crud.add_tag_to_todo(db=db, todo_id=id, owner_id=current_user.id, tag_id=tag_id)
     return RedirectResponse(url=f"/todo/{id}/manage-tags", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/tag/create/from-page", status_code=status.HTTP_303_SEE_OTHER)
-def create_tag_from_form(
-    db: Session = Depends(get_db), 
+async def create_tag_from_form(
+    db: AsyncSession = Depends(get_db), 
     description: str = Form(...), 
-    todo_id: int = Form(...) # 戻るためにToDoのIDを受け取る
+    todo_id: int = Form(...), # 戻るためにToDoのIDを受け取る
+    current_user: models.User = Depends(get_page_user)
 ):
     """
     フォームから送信されたデータで新しいタグを作成します。
     """
-    db_tag = crud.get_tag_by_description(db, description=description)
-    if not db_tag:
-        tag_create = schemas.TagCreate(description=description)
-        crud.create_tag(db=db, tag=tag_create)
+    try:
+        await crud.create_tag(db=db, tag=schemas.TagCreate(description=description), owner_id=current_user.id)
+    except crud.DuplicateTagError:
+        pass # 作成済みなのでそのまま戻る
     return RedirectResponse(url=f"/todo/{todo_id}/manage-tags", status_code=status.HTTP_303_SEE_OTHER)
 ### --- ↑↑↑ HTMLページ用エンドポイントここまで ↑↑↑ ---
 
@@ -173,12 +322,17 @@ def create_tag_from_form(
 # --- 認証API (ログイン・登録) ---
 
 @app.post("/api/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@db_access("read") # ユーザーを読むだけ (パスワードの検証の間、書き込み用の接続をふさがない)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     ユーザー名とパスワードで認証し、アクセストークンを返します。
     """
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    user = await crud.get_user_by_username(db, username=form_data.username)
+    try:
+        password_ok = user is not None and await security.verify_password_async(form_data.password, user.hashed_password)
+    except security.PasswordHashPoolSaturated:
+        raise password_pool_saturated_exception()
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -192,15 +346,32 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/api/users/register", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """
     新しいユーザーを登録します。
     """
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    return crud.create_user(db=db, user=user)
+    try:
+        return await crud.create_user(db=db, user=user)
+    except security.PasswordHashPoolSaturated:
+        raise password_pool_saturated_exception()
+
+@app.get("/api/security/password-pool", response_model=schemas.PasswordHashPoolStats)
+async def read_password_pool_stats(current_user: models.User = Depends(get_current_user)):
+    """
+    パスワードハッシュ用ワーカープールの利用状況を返します。
+    """
+    return security.password_hash_pool.stats()
+
+@app.get("/api/security/principal-cache", response_model=schemas.CacheStats)
+async def read_principal_cache_stats(current_user: models.User = Depends(get_current_user)):
+    """
+    認証済みユーザーキャッシュのヒット/ミス件数を返します。
+    """
+    return principal_cache.stats()
 
 @app.get("/api/users/me", response_model=schemas.User)
 async def read_users_me(current_user: models.User = Depends(get_current_user)):
@@ -209,176 +380,481 @@ async def read_users_me(current_user: models.User = Depends(get_current_user)):
     """
     return current_user
 
+@app.delete("/api/users/me", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_users_me(db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """
+    現在のログインユーザーを、そのユーザーのTodo・Tagと一緒に削除します。(以後このトークンは使えない)
+    """
+    await crud.delete_user(db, user_id=current_user.id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 
 # --- ToDo API (ログイン必須) ---
 
 @app.post("/api/todo", response_model=schemas.Todo, status_code=status.HTTP_201_CREATED)
-def create_todo_endpoint(
+async def create_todo_endpoint(
     todo: schemas.TodoCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    return await crud.create_todo(db=db, todo=todo, owner_id=current_user.id)
+
+@app.get("/api/todo", response_model=schemas.TodoPage)
+async def read_todos_endpoint(
+    request: Request,
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order_by: str = Query("id", enum=list(crud.TODO_SORT_KEYS)),
+    due_after: Optional[date] = Query(None, description="この日以降が期限のもの (この日を含む)"),
+    due_before: Optional[date] = Query(None, description="この日より前が期限のもの (この日を含まない)"),
+    is_completed: Optional[bool] = None,
+    tag: List[int] = Query([], description="タグIDで絞り込み (例: ?tag=1&tag=2)"),
+    tag_mode: Literal["any", "all"] = "any",
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    ログインユーザーのTodoの一覧を返します。ユーザー・変更カウンタ・クエリから作ったETagが
+    If-None-Match と一致すれば304を返します。(カウンタは全ユーザー共通なので、他のユーザーの変更でもETagは変わる)
+    行は辞書のまま orjson で書き出す (response_model は APIドキュメント用で、検証は通さない)。
+    """
+    counters = await crud.get_change_counters(db, crud.TODO_COUNTER)
+    etag = make_etag("todos", current_user.id, counters[crud.TODO_COUNTER], query_digest(request.url.query))
+    if if_none_match(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    try:
+        todos, next_cursor = await crud.get_todo_rows(
+            db, owner_id=current_user.id, limit=limit, cursor=cursor, sort=order_by,
+            due_after=due_after, due_before=due_before, is_completed=is_completed,
+            tag_ids=tag, tag_mode=tag_mode,
+        )
+    except crud.InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return TimedORJSONResponse({"items": todos, "next_cursor": next_cursor}, headers={"ETag": etag})
+
+@app.get("/api/todo/search", response_model=schemas.TodoPage)
+async def search_todos_endpoint(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    return crud.create_todo(db=db, todo=todo) 
+    """
+    Todoの内容を全文検索します。関連度の高い順に返します。
+    """
+    try:
+        todos, next_cursor = await crud.search_todos(db, owner_id=current_user.id, q=q, limit=limit, cursor=cursor)
+    except crud.InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": todos, "next_cursor": next_cursor}
+
+@app.get("/api/todo/export")
+async def export_todos_endpoint(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    ログインユーザーのすべてのTodoをタグ付きで NDJSON または CSV としてストリーミングで書き出します。
+    """
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        stream_todo_export(format, current_user.id),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="todos.{extension}"'},
+    )
 
-@app.get("/api/todo", response_model=List[schemas.Todo])
-def read_todos_endpoint(
-    db: Session = Depends(get_db),
+@app.post("/api/todo/import", response_model=schemas.TodoImportSummary)
+async def import_todos_endpoint(
+    file: UploadFile = File(...),
+    format: Optional[Literal["ndjson", "csv"]] = Query(None, description="省略時はファイル名の拡張子から判定"),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    todos = crud.get_todos(db) 
-    return todos
+    """
+    NDJSON または CSV ファイルからTodoをまとめて取り込みます。(形式は /api/todo/export と同じ)
+    不正な行はスキップし、行番号とエラー内容をサマリーで返します。
+    """
+    format = format or importer.detect_format(file.filename)
+    if format is None:
+        raise HTTPException(status_code=400, detail="Cannot determine file format; specify ?format=ndjson or ?format=csv")
+    try:
+        return await importer.import_todos(db, file.file, format, current_user.id)
+    except importer.ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/todo/batch", response_model=schemas.TodoBatchResponse)
+async def batch_todos_endpoint(
+    batch: schemas.TodoBatchRequest,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    複数のTodoの作成・更新・完了切替・削除を1つのトランザクションでまとめて実行します。
+    atomicモードで失敗した場合は何も適用せず、409と操作ごとの結果を返します。
+    """
+    results, committed = await crud.apply_todo_batch(
+        db, current_user.id, batch.operations, atomic=batch.mode == "atomic"
+    )
+    if not committed:
+        response.status_code = status.HTTP_409_CONFLICT
+    return {"committed": committed, "results": results}
 
 @app.get("/api/todo/{id}", response_model=schemas.Todo)
-def read_todo_endpoint(
+async def read_todo_endpoint(
     id: int, 
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_todo = crud.get_todo(db, id=id)
+    # 先にバージョンだけを読み、304で済むなら行データは読まない
+    version = await crud.get_todo_version(db, id=id, owner_id=current_user.id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    etag = todo_etag(id, version)
+    if if_none_match(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    db_todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="Todo not found")
+    response.headers["ETag"] = todo_etag(id, db_todo.version)
     return db_todo
 
 @app.put("/api/todo/{id}", response_model=schemas.Todo)
-def update_todo_endpoint(
+async def update_todo_endpoint(
     id: int, 
     todo: schemas.TodoCreate, 
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_todo = crud.get_todo(db, id=id)
+    db_todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="Todo not found")
+    # 読み込んだバージョンで If-Match を確認し、書き込みの時点でも同じバージョンであることを確かめる
+    # (違っていれば StaleDataError で412)
+    check_if_match(request.headers.get("if-match"), todo_etag(id, db_todo.version))
     
-    updated_todo = crud.update_todo(
-        db=db, todo_id=id,
+    updated_todo = await crud.update_todo(
+        db=db, todo_id=id, owner_id=current_user.id,
         content=todo.content,
         due_date=todo.due_date,
-        is_completed=db_todo.is_completed 
+        expected_version=if_match_version(request, db_todo.version),
     )
+    if updated_todo is None: # 読み込んだ後に削除された
+        raise HTTPException(status_code=404, detail="Todo not found")
+    response.headers["ETag"] = todo_etag(id, updated_todo.version)
     return updated_todo
 
 @app.delete("/api/todo/{id}", response_model=schemas.Todo) 
-def delete_todo_endpoint(
+async def delete_todo_endpoint(
     id: int, 
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_todo = crud.get_todo(db, id=id) 
+    db_todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="Todo not found")
-    deleted_todo = crud.delete_todo(db, todo_id=id)
+    check_if_match(request.headers.get("if-match"), todo_etag(id, db_todo.version))
+    deleted_todo = await crud.delete_todo(
+        db, todo_id=id, owner_id=current_user.id, expected_version=if_match_version(request, db_todo.version)
+    )
+    if deleted_todo is None: # 読み込んだ後に削除された
+        raise HTTPException(status_code=404, detail="Todo not found")
     return deleted_todo
 
 @app.put("/api/todo/{id}/toggle", response_model=schemas.Todo)
-def toggle_todo_completed(
+async def toggle_todo_completed(
     id: int, 
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_todo = crud.get_todo(db, id=id)
+    db_todo = await crud.get_todo(db, id=id, owner_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="Todo not found")
+    check_if_match(request.headers.get("if-match"), todo_etag(id, db_todo.version))
     
-    new_status = not db_todo.is_completed
-    updated_todo = crud.update_todo(
-        db=db, todo_id=id,
-        content=db_todo.content, due_date=db_todo.due_date, is_completed=new_status
+    # 切り替え後の値は書き込みの時点の行から決める (ここで読み込んだ値は古いことがある)
+    updated_todo = await crud.toggle_todo(
+        db, todo_id=id, owner_id=current_user.id, expected_version=if_match_version(request, db_todo.version)
     )
-    if updated_todo is None:
-         raise HTTPException(status_code=500, detail="Todoの更新に失敗しました")
+    if updated_todo is None: # 読み込んだ後に削除された
+        raise HTTPException(status_code=404, detail="Todo not found")
+    response.headers["ETag"] = todo_etag(id, updated_todo.version)
     return updated_todo
 
 
+# --- 変更イベント (ログイン必須) ---
+
+@app.get("/api/events")
+async def stream_events_endpoint(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    ログインユーザーのTodo/Tagの変更イベントを Server-Sent Events で送り続けます。(形式は src/events.py を参照)
+    再接続時に Last-Event-ID を送ると、その続きから受け取れます。
+    EventSource は Authorization ヘッダーを送れないため、fetch でストリームを読んでください。
+    """
+    # ストリームの間DBの接続を持ち続けないように、認証に使ったセッションはここで閉じる
+    await db.close()
+    subscriber = event_hub.subscribe(current_user.id, request.headers.get("last-event-id"))
+    return StreamingResponse(
+        stream_events(subscriber, settings.event_heartbeat_seconds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # プロキシにバッファリングさせない
+    )
+
+
+# --- 差分同期 (ログイン必須) ---
+
+@app.get("/api/sync", response_model=schemas.SyncChanges)
+async def sync_endpoint(
+    since: int = Query(0, ge=0, description="前回のレスポンスの next_since。0なら全件"),
+    limit: int = Query(settings.sync_page_size, ge=1, le=settings.sync_max_page_size),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    変更シーケンスが since より後に作成・更新・削除された、ログインユーザーのTodo/Tag/関連付けを返します。
+    since が古すぎる (墓標が圧縮済み) 場合は410を返すので、since=0 で全件を取り直してください。
+    """
+    try:
+        changes = await crud.get_sync_changes(db, owner_id=current_user.id, since=since, limit=limit)
+    except crud.SyncExpiredError as e:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(e))
+    return TimedORJSONResponse(changes)
+
+
 # --- Tag API (ログイン必須) ---
 
 @app.post("/api/tag", response_model=schemas.Tag, status_code=status.HTTP_201_CREATED)
-def create_tag_endpoint(
+async def create_tag_endpoint(
     tag: schemas.TagCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_tag = crud.get_tag_by_description(db, description=tag.description)
-    if db_tag:
+    # 説明の重複は書き込みの中で確認する (同時に作成されても重複しない)
+    try:
+        return await crud.create_tag(db=db, tag=tag, owner_id=current_user.id)
+    except crud.DuplicateTagError:
         raise HTTPException(status_code=400, detail="Tag description already exists")
-    return crud.create_tag(db=db, tag=tag)
 
-@app.get("/api/tag", response_model=List[schemas.Tag])
-def read_tags_endpoint(
-    db: Session = Depends(get_db),
+@app.get("/api/tag", response_model=schemas.TagPage)
+async def read_tags_endpoint(
+    request: Request,
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order_by: str = Query("id", enum=list(crud.TAG_SORT_KEYS)),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    Tagの一覧を件数付きで返します。件数はTodoの変更でも変わるため、ETagには両方のカウンタを含めます。
+    """
+    counters = await crud.get_change_counters(db, crud.TAG_COUNTER, crud.TODO_COUNTER)
+    etag = make_etag(
+        "tags", current_user.id, counters[crud.TAG_COUNTER], counters[crud.TODO_COUNTER], query_digest(request.url.query)
+    )
+    if if_none_match(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    try:
+        tags, next_cursor = await crud.get_tags(db, owner_id=current_user.id, limit=limit, cursor=cursor, sort=order_by)
+    except crud.InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    counts = await crud.count_todos_by_tag(db, [t.id for t in tags])
+    items = [{"description": t.description, "id": t.id, "todo_count": counts.get(t.id, 0)} for t in tags]
+    return TimedORJSONResponse({"items": items, "next_cursor": next_cursor}, headers={"ETag": etag})
+
+@app.get("/api/tag/{id}/todos", response_model=schemas.TagTodoPage)
+async def read_tag_todos_endpoint(
+    id: int,
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order_by: str = Query("id", enum=list(crud.TODO_SORT_KEYS)),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    tags = crud.get_tags(db)
-    return tags
+    """
+    指定したタグが付いたTodoを1ページ分と、その総件数を返します。
+    """
+    db_tag = await crud.get_tag(db, id=id, owner_id=current_user.id)
+    if db_tag is None:
+        raise HTTPException(status_code=404, detail="Tag not found")
+    try:
+        todos, next_cursor = await crud.get_todo_rows(
+            db, owner_id=current_user.id, limit=limit, cursor=cursor, sort=order_by, tag_ids=[id]
+        )
+    except crud.InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    counts = await crud.count_todos_by_tag(db, [id])
+    tag = {"description": db_tag.description, "id": db_tag.id}
+    return TimedORJSONResponse({"items": todos, "next_cursor": next_cursor, "tag": tag, "todo_count": counts.get(id, 0)})
 
 @app.get("/api/tag/{id}", response_model=schemas.Tag)
-def read_tag_endpoint(
+async def read_tag_endpoint(
     id: int, 
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_tag = crud.get_tag(db, id=id)
+    # タグはキャッシュから返るので、304の判定でもDBは読まない
+    db_tag = await crud.get_tag(db, id=id, owner_id=current_user.id)
     if db_tag is None:
         raise HTTPException(status_code=404, detail="Tag not found")
+    etag = tag_etag(id, db_tag.version)
+    if if_none_match(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return db_tag
 
 @app.put("/api/tag/{id}", response_model=schemas.Tag)
-def update_tag_endpoint(
+async def update_tag_endpoint(
     id: int, 
     tag: schemas.TagCreate, 
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_tag_to_update = crud.get_tag(db, id=id)
+    db_tag_to_update = await crud.get_tag(db, id=id, owner_id=current_user.id)
     if db_tag_to_update is None:
         raise HTTPException(status_code=404, detail="Tag not found")
+    expected_version = await check_tag_if_match(request, db, id, current_user.id)
 
-    existing_tag = crud.get_tag_by_description(db, description=tag.description)
-    if existing_tag and existing_tag.id != id:
-         raise HTTPException(status_code=400, detail="Another tag with this description already exists")
-
-    updated_tag = crud.update_tag(db, tag_id=id, tag=tag)
+    try:
+        updated_tag = await crud.update_tag(
+            db, tag_id=id, owner_id=current_user.id, tag=tag, expected_version=expected_version
+        )
+    except crud.DuplicateTagError:
+        raise HTTPException(status_code=400, detail="Another tag with this description already exists")
+    if updated_tag is None: # 読み込んだ後に削除された
+        raise HTTPException(status_code=404, detail="Tag not found")
+    response.headers["ETag"] = tag_etag(id, updated_tag.version)
     return updated_tag
 
 @app.delete("/api/tag/{id}", response_model=schemas.Tag)
-def delete_tag_endpoint(
+async def delete_tag_endpoint(
     id: int, 
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_tag = crud.get_tag(db, id=id)
+    db_tag = await crud.get_tag(db, id=id, owner_id=current_user.id)
     if db_tag is None:
         raise HTTPException(status_code=404, detail="Tag not found")
-    deleted_tag = crud.delete_tag(db, tag_id=id)
+    expected_version = await check_tag_if_match(request, db, id, current_user.id)
+    deleted_tag = await crud.delete_tag(db, tag_id=id, owner_id=current_user.id, expected_version=expected_version)
+    if deleted_tag is None: # 読み込んだ後に削除された
+        raise HTTPException(status_code=404, detail="Tag not found")
     return deleted_tag
 
 # --- 関連付けAPI (ログイン必須) ---
 @app.post("/api/todo/{todo_id}/tags/{tag_id}", response_model=schemas.Todo)
-def add_tag_to_todo_endpoint(
+async def add_tag_to_todo_endpoint(
     todo_id: int, 
     tag_id: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user) # <--- 保護
 ):
-    db_todo = crud.get_todo(db, id=todo_id)
-    if db_todo is None:
+    if not await crud.todo_exists(db, id=todo_id, owner_id=current_user.id):
         raise HTTPException(status_code=404, detail=f"Todo with id {todo_id} not found")
-    db_tag = crud.get_tag(db, id=tag_id)
-    if db_tag is None:
+    if await crud.get_missing_tag_ids(db, current_user.id, [tag_id]):
         raise HTTPException(status_code=404, detail=f"Tag with id {tag_id} not found")
 
-    updated_todo = crud.add_tag_to_todo(db, todo_id=todo_id, tag_id=tag_id)
+    updated_todo = await crud.add_tag_to_todo(db, todo_id=todo_id, owner_id=current_user.id, tag_id=tag_id)
+    if updated_todo is None: # 確認した後に削除された
+        raise HTTPException(status_code=404, detail=f"Todo with id {todo_id} not found")
+    return updated_todo
+
+@app.post("/api/todo/{todo_id}/tags", response_model=schemas.Todo)
+async def attach_tags_endpoint(
+    todo_id: int,
+    body: schemas.TodoTagIds,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    Todoに複数のタグをまとめて関連付けます。(関連付け済みのものは無視)
+    """
+    if not await crud.todo_exists(db, id=todo_id, owner_id=current_user.id):
+        raise HTTPException(status_code=404, detail=f"Todo with id {todo_id} not found")
+    missing = await crud.get_missing_tag_ids(db, current_user.id, body.tag_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Tags not found: {missing}")
+    updated_todo = await crud.attach_tags(db, todo_id=todo_id, owner_id=current_user.id, tag_ids=body.tag_ids)
+    if updated_todo is None: # 確認した後に削除された
+        raise HTTPException(status_code=404, detail=f"Todo with id {todo_id} not found")
+    return updated_todo
+
+@app.delete("/api/todo/{todo_id}/tags", response_model=schemas.Todo)
+async def detach_tags_endpoint(
+    todo_id: int,
+    tag_id: List[int] = Query(..., min_length=1),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user) # <--- 保護
+):
+    """
+    Todoから複数のタグの関連付けをまとめて外します。(例: ?tag_id=1&tag_id=2)
+    """
+    if not await crud.todo_exists(db, id=todo_id, owner_id=current_user.id):
+        raise HTTPException(status_code=404, detail=f"Todo with id {todo_id} not found")
+    updated_todo = await crud.detach_tags(db, todo_id=todo_id, owner_id=current_user.id, tag_ids=tag_id)
+    if updated_todo is None: # 確認した後に削除された
+        raise HTTPException(status_code=404, detail=f"Todo with id {todo_id} not found")
     return updated_todo
 
 
+# --- 計測 (Prometheus) ---
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    """
+    ルートごとのレイテンシ・SQLの数と時間・フェーズごとの時間を Prometheus のテキスト形式で返します。
+    (このワーカープロセスの値。ユーザーのログインではなく、許可したIPアドレスか metrics_token で制限する)
+    """
+    client_host = request.client.host if request.client else None
+    if not settings.metrics_enabled or not metrics.scrape_allowed(client_host, request.headers.get("Authorization")):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # === カスタムエラーハンドラ (JSONではなくHTMLを返す) ===
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """
     HTMLエラーページをレンダリングするためのカスタムハンドラ。
     """
-    return templates.TemplateResponse(
+    return request.app.state.templates.TemplateResponse(
         "error.html",
         {"request": request, "status_code": exc.status_code, "detail": exc.detail},
         status_code=exc.status_code,
+        headers=getattr(exc, "headers", None), # WWW-Authenticate や Retry-After を失わないように
     )
+
+@app.exception_handler(LoginRequired)
+async def login_required_exception_handler(request: Request, exc: LoginRequired):
+    """
+    ログインしていない状態でHTMLページを開いた場合は、ログインページにリダイレクトします。
+    """
+    return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+
+@app.exception_handler(StaleDataError)
+async def stale_data_exception_handler(request: Request, exc: StaleDataError):
+    """
+    読み込み後に別のリクエストが同じ行を更新していた場合 (バージョン不一致) のエラー。
+    If-Match を付けたリクエストなら前提条件の不一致として412、付けていなければ競合として409にします。
+    """
+    if request.headers.get("if-match"):
+        exc = HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Resource has been modified")
+    else:
+        exc = HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Resource was modified concurrently, retry")
+    return await http_exception_handler(request, exc)
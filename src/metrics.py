@@ -0,0 +1,266 @@
+# src/metrics.py
+"""
+リクエストごとの計測と、Prometheus のテキスト形式での書き出し (GET /metrics)。
+
+MetricsMiddleware がリクエストごとに RequestStats を作って contextvar に置き、処理中の各所が
+それに時間を足していきます。
+- SQL:       エンジンのイベント (instrument_engine) で文の数と実行時間
+- フェーズ:   phase("auth") などで囲んだ区間の時間 (JWTの検証・パスワードハッシュ・テンプレート描画・JSON書き出し)
+グループコミット (src/writer.py) が動いている場合、キューに入れた書き込みのSQLは書き込み用のタスクで
+実行されるので、リクエストのSQLの数と時間には入りません。(その待ち時間はフェーズ write_queue に入る)
+リクエストが終わったら、ルート (例: "/api/todo/{id}") ごとのヒストグラムに記録します。
+
+値はプロセス内で集計します。(複数ワーカーの場合は、ワーカーごとに別々の値になる)
+slow_request_log_ms を設定すると、それより遅いリクエストが実行したSQLをログに出します。
+"""
+import logging
+import secrets
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import event
+
+from .config import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# グループコミット1回あたりの書き込みの数
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# 1リクエストあたりのSQL文の数
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """ラベルごとの累積値 (Prometheus の counter 型)。"""
+    def __init__(self, name: str, help: str, labelnames: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """
+    ラベルごとのヒストグラム (Prometheus の histogram 型)。
+    バケットごとの件数は累積せずに持ち、書き出すときに累積します。(observe を軽くするため)
+    """
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: dict = {} # ラベル -> [バケットごとの件数..., +Infの件数, 合計]
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, including streaming the body.",
+    ("method", "route"), LATENCY_BUCKETS,
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements",
+    "SQL statements executed per request (not counting writes run by the group-commit write queue).",
+    ("method", "route"), STATEMENT_BUCKETS,
+)
+REQUEST_SQL_DURATION = Histogram(
+    "http_request_sql_duration_seconds",
+    "Time spent executing SQL per request (not counting writes run by the group-commit write queue).",
+    ("method", "route"), LATENCY_BUCKETS,
+)
+REQUEST_PHASE_DURATION = Histogram(
+    "http_request_phase_duration_seconds",
+    "Time spent per request in auth (JWT decode), password_hash (bcrypt, including pool wait), "
+    "template (Jinja2 render), serialize (JSON encode) and write_queue (waiting for a group commit).",
+    ("method", "route", "phase"), LATENCY_BUCKETS,
+)
+WRITE_BATCH_SIZE = Histogram(
+    "db_write_batch_size", "Writes committed together by the group-commit write queue.", (), BATCH_BUCKETS,
+)
+METRICS = [
+    REQUESTS, REQUEST_DURATION, REQUEST_SQL_STATEMENTS, REQUEST_SQL_DURATION, REQUEST_PHASE_DURATION, WRITE_BATCH_SIZE,
+]
+
+def render() -> str:
+    """すべての計測値を Prometheus のテキスト形式で返します。"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def scrape_allowed(client_host: Optional[str], authorization: Optional[str]) -> bool:
+    """
+    /metrics を読んでよいリクエストなら True を返します。
+    (metrics_allowed_clients のIPアドレスからか、metrics_token のBearerトークンを送ったもの)
+    """
+    if settings.metrics_token and authorization is not None:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and secrets.compare_digest(token.encode(), settings.metrics_token.encode()):
+            return True
+    return client_host is not None and client_host in settings.metrics_allowed_clients
+
+class RequestStats:
+    """処理中のリクエスト1つ分の計測値。"""
+    __slots__ = ("sql_count", "sql_seconds", "phases", "statements")
+
+    def __init__(self, capture_statements: bool):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.phases: dict = {}
+        # 遅いリクエストのログ用に (秒, SQL) を記録する (slow_request_log_ms が0なら None で記録しない)
+        self.statements: Optional[list] = [] if capture_statements else None
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+@contextmanager
+def phase(name: str):
+    """with の中の時間を、処理中のリクエストのフェーズ name に足します。(リクエストの外では何もしない)"""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[name] = stats.phases.get(name, 0.0) + time.perf_counter() - started
+
+# --- SQL ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = getattr(context, "_metrics_started", None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if stats.statements is not None and len(stats.statements) < settings.slow_request_log_max_statements:
+        stats.statements.append((elapsed, statement)) # パラメータは個人情報を含みうるので残さない
+
+def instrument_engine(engine):
+    """エンジン (非同期エンジンなら .sync_engine) が実行するSQLを計測します。(アプリの起動時に呼ぶ)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+# --- JSONの書き出し ---
+
+class TimedORJSONResponse(ORJSONResponse):
+    """JSONの書き出しを serialize フェーズとして計測する ORJSONResponse。"""
+    def render(self, content) -> bytes:
+        with phase("serialize"):
+            return super().render(content)
+
+# --- ミドルウェア ---
+
+def _route_label(scope: dict) -> str:
+    """ルーティング後の scope から、ラベルに使うルートのパスを返します。(IDなどを含まない "/api/todo/{id}" の形)"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("endpoint") is not None: # マウントしたアプリ (静的ファイル)
+        return scope.get("root_path", "")[len(scope.get("app_root_path", "")):] or "/"
+    return "<unmatched>"
+
+class MetricsMiddleware:
+    """リクエストごとに RequestStats を用意し、終わったらルートごとの計測値に記録するASGIミドルウェア。"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(capture_statements=settings.slow_request_log_ms > 0)
+        status_code = 500 # レスポンスを始める前に例外になった場合
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status_code, streaming
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                streaming = any(k == b"content-type" and v.startswith(b"text/event-stream") for k, v in message["headers"])
+            await send(message)
+
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            self._record(scope, status_code, elapsed, stats, streaming)
+
+    def _record(self, scope: dict, status_code: int, elapsed: float, stats: RequestStats, streaming: bool):
+        method, route = scope["method"], _route_label(scope)
+        labels = (method, route)
+        REQUESTS.inc((method, route, str(status_code)))
+        REQUEST_DURATION.observe(labels, elapsed)
+        REQUEST_SQL_STATEMENTS.observe(labels, stats.sql_count)
+        REQUEST_SQL_DURATION.observe(labels, stats.sql_seconds)
+        for name, seconds in stats.phases.items():
+            REQUEST_PHASE_DURATION.observe((method, route, name), seconds)
+        # イベントストリームは接続している間ずっと続くので、遅いリクエストとしては扱わない
+        if stats.statements is not None and not streaming and elapsed * 1000 >= settings.slow_request_log_ms:
+            self._log_slow_request(scope, status_code, elapsed, stats)
+
+    def _log_slow_request(self, scope: dict, status_code: int, elapsed: float, stats: RequestStats):
+        phases = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in stats.phases.items())
+        lines = [
+            f"slow request: {scope['method']} {scope['path']} -> {status_code} in {elapsed * 1000:.1f}ms "
+            f"(sql {stats.sql_count} statements {stats.sql_seconds * 1000:.1f}ms{' ' + phases if phases else ''})"
+        ]
+        for seconds, statement in stats.statements:
+            lines.append(f"  {seconds * 1000:8.2f}ms  {' '.join(statement.split())}")
+        if stats.sql_count > len(stats.statements):
+            lines.append(f"  ... {stats.sql_count - len(stats.statements)} more statements")
+        logger.warning("\n".join(lines))
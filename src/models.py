@@ -7,45 +7,289 @@ from sqlalchemy import (
     Boolean,
     ForeignKey,
     Table,
+    Index,
+    Date,
     DateTime,
     func,
 )
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker # sessionmakerを追加
+from typing import Optional
+from urllib.parse import quote
+from .config import settings
 
-# データベースの接続設定
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# 同期URLのドライバ名 -> 非同期ドライバ名
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
 
-# ↓↓↓ SessionLocalの定義を追加 ↓↓↓
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def to_async_url(url: str) -> str:
+    """同期用のDB URLを非同期ドライバのURLに変換します。"""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if u.drivername in ASYNC_DRIVERS.values() or backend not in ASYNC_DRIVERS:
+        return url
+    return u.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def is_sqlite_memory(url: str) -> bool:
+    """インメモリのSQLite (接続ごとに別のDBになるので、読み込み用の接続を分けられない)"""
+    u = make_url(url)
+    return u.database in (None, "", ":memory:") or u.query.get("mode") == "memory"
+
+def uses_read_write_split(url: str) -> bool:
+    """読み込み専用の接続と書き込み用の接続を分けるかどうか。(db_read_write_split、ファイルのSQLiteのみ)"""
+    return settings.db_read_write_split and is_sqlite(url) and not is_sqlite_memory(url)
+
+def to_read_only_url(url: str) -> str:
+    """SQLiteのURLを、読み込み専用 (mode=ro) で開くURIファイル名のURLに変換します。"""
+    u = make_url(url)
+    database = u.database
+    if u.query.get("uri") != "true":
+        database = "file:" + quote(database, safe="/:")
+    return u.set(database=database, query={**u.query, "mode": "ro", "uri": "true"}).render_as_string(hide_password=False)
+
+def engine_options(url: str, role: Optional[str] = None) -> dict:
+    """
+    create_engine / create_async_engine に渡すオプションを設定から組み立てます。
+    role ("read" / "write") を指定すると、読み書きを分けたときのSQLiteの接続プールの大きさにします。
+    """
+    options = {"echo": settings.db_echo}
+    if is_sqlite(url):
+        if not make_url(url).drivername.endswith("aiosqlite"):
+            options["connect_args"] = {"check_same_thread": False}
+        if role == "write":
+            # 書き込みは専用の接続だけで行い、足りなければプールで待つ (SQLiteの書き込みはどのみち1つずつ)
+            options.update(pool_size=settings.sqlite_writer_pool_size, max_overflow=0, pool_timeout=settings.db_pool_timeout)
+        elif role == "read":
+            options.update(
+                pool_size=settings.sqlite_reader_pool_size,
+                max_overflow=settings.db_max_overflow,
+                pool_timeout=settings.db_pool_timeout,
+            )
+    else:
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+    return options
+
+def _set_common_sqlite_pragmas(cursor):
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}") # 負の値はKiB単位
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLiteの接続ごとにPRAGMAを設定します。(engineの "connect" イベント)"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    _set_common_sqlite_pragmas(cursor)
+    cursor.close()
+
+def set_sqlite_read_pragmas(dbapi_connection, connection_record):
+    """
+    読み込み専用の接続のPRAGMAを設定します。(読み込み用engineの "connect" イベント)
+    journal_mode はDBファイルに記録されていて、読み込み専用の接続からは変更できないので設定しない。
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON") # 誤って書き込もうとしたらエラーにする
+    _set_common_sqlite_pragmas(cursor)
+    cursor.close()
+
+def describe_engine_config() -> str:
+    """起動時ログ用に、実際に使われるDB設定を1行にまとめます。(パスワードは伏せる)"""
+    url = make_url(SQLALCHEMY_DATABASE_URL).render_as_string(hide_password=True)
+    if is_sqlite(SQLALCHEMY_DATABASE_URL):
+        detail = (
+            f"journal_mode={settings.sqlite_journal_mode} synchronous={settings.sqlite_synchronous} "
+            f"busy_timeout={settings.sqlite_busy_timeout_ms}ms mmap_size={settings.sqlite_mmap_size} "
+            f"cache_size={settings.sqlite_cache_size_kib}KiB"
+        )
+        if uses_read_write_split(ASYNC_SQLALCHEMY_DATABASE_URL):
+            detail += (
+                f" read_write_split=on readers={settings.sqlite_reader_pool_size} "
+                f"writers={settings.sqlite_writer_pool_size}"
+            )
+    else:
+        detail = (
+            f"pool_size={settings.db_pool_size} max_overflow={settings.db_max_overflow} "
+            f"pool_timeout={settings.db_pool_timeout}s pool_recycle={settings.db_pool_recycle}s "
+            f"pool_pre_ping={settings.db_pool_pre_ping}"
+        )
+    return f"database url={url} async_driver={make_url(ASYNC_SQLALCHEMY_DATABASE_URL).drivername} {detail}"
+
+# データベースの接続設定 (config.py / 環境変数 DATABASE_URL から)
+SQLALCHEMY_DATABASE_URL = settings.database_url
+# 非同期用の接続設定 (APIエンドポイントはこちらを使い、イベントループをブロックしない)
+ASYNC_SQLALCHEMY_DATABASE_URL = settings.async_database_url or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+# エンジンは init_engines() で作る (インポートしただけではDBに触れない)。
+# セッションのファクトリはインポート時に作り、init_engines() でエンジンに結び付ける。
+engine = None
+async_engine = None      # 書き込み用 (読み書きを分けないときは読み込みにも使う)
+async_read_engine = None # 読み込み用 (読み書きを分けないときは async_engine と同じもの)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+# expire_on_commit=False: コミット後に属性へアクセスしても再読み込み (=同期I/O) が起きないようにする
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+# 読み込みだけのリクエスト (GETなど) 用のセッション
+AsyncReadSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+def init_engines():
+    """
+    同期・非同期のエンジンを作り、SessionLocal / AsyncSessionLocal / AsyncReadSessionLocal に結び付けます。
+    アプリの起動時 (lifespan) とCLIから呼びます。2回目以降は何もしません。
+    """
+    global engine, async_engine, async_read_engine
+    if engine is not None:
+        return
+    url = ASYNC_SQLALCHEMY_DATABASE_URL
+    split = uses_read_write_split(url)
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+    async_engine = create_async_engine(url, **engine_options(url, role="write" if split else None))
+    async_read_engine = async_engine
+    if split:
+        async_read_engine = create_async_engine(to_read_only_url(url), **engine_options(url, role="read"))
+    if is_sqlite(SQLALCHEMY_DATABASE_URL):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    if split:
+        event.listen(async_read_engine.sync_engine, "connect", set_sqlite_read_pragmas)
+    SessionLocal.configure(bind=engine)
+    AsyncSessionLocal.configure(bind=async_engine)
+    AsyncReadSessionLocal.configure(bind=async_read_engine)
+
+async def dispose_engines():
+    """
+    接続プールを閉じます。(アプリの終了時)
+    aiosqlite の接続ごとのスレッドが残るとプロセスが終了できないため、必ず呼びます。
+    """
+    global engine, async_engine, async_read_engine
+    if engine is None:
+        return
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    await async_engine.dispose()
+    engine.dispose()
+    engine = async_engine = async_read_engine = None
 
 Base = declarative_base()
 
+# 同期 (GET /api/sync) 用の列。書き込みのたびに、グローバルな変更シーケンス (change_counter の "sync") を
+# 1つ進めて change_seq に入れる。クライアントは前回受け取ったシーケンスより後の行だけを取得する。
+# 既定値の0は「シーケンスを振る前からある行」(マイグレーションで1にする)
+# (Todo/Tagはユーザーごとに同期するので、単独の索引ではなく (owner_id, change_seq) の索引を張る)
+def change_seq_column(index: bool = True):
+    return Column("change_seq", Integer, nullable=False, server_default="0", index=index)
+
+def owner_id_column():
+    # 既存のデータにはマイグレーションで最初のユーザーを設定する (ユーザーがいなければNULLのまま)
+    return Column("owner_id", Integer, ForeignKey("users.id"), nullable=True)
+
+def updated_at_column():
+    return Column("更新日時", DateTime, server_default=func.now(), onupdate=func.now())
+
 # 中間テーブルの定義
+# (todo_id, tag_id) の複合主キーで重複を防ぎ、Todo -> Tag の検索にも使う。
+# Tag -> Todo の検索用に (tag_id, todo_id) の逆向きインデックスを張る。
 todo_tag_association = Table(
     "設定",
     Base.metadata,
-    Column("todo_id", Integer, ForeignKey("Todo.id")),
-    Column("tag_id", Integer, ForeignKey("Tag.id")),
+    Column("todo_id", Integer, ForeignKey("Todo.id"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("Tag.id"), primary_key=True),
+    change_seq_column(),
+    updated_at_column(),
+    Index("ix_設定_tag_id_todo_id", "tag_id", "todo_id"),
 )
 
 class Todo(Base):
     __tablename__ = "Todo"
     id = Column("id", Integer, primary_key=True, index=True)
-    content = Column("内容", String, index=True)
-    due_date = Column("期限", String)
+    owner_id = owner_id_column()
+    content = Column("内容", String)
+    due_date = Column("期限", Date)
     is_completed = Column("完了/未完了", Boolean, default=False)
     created_at = Column("作成日時", DateTime, server_default=func.now())
+    # 行のバージョン (ETag / If-Match 用)。ORMでの更新時に自動で +1 され、
+    # 読み込み後に他のリクエストが更新していた場合は StaleDataError になる
+    version = Column("version", Integer, nullable=False, server_default="1")
+    updated_at = updated_at_column()
+    change_seq = change_seq_column(index=False)
+
+    # 一覧はすべてユーザーで絞り込むので、索引はどれも owner_id から始める
+    # (1ユーザー分の範囲だけを走査するので、他のユーザーのTodoが増えても遅くならない)
+    __table_args__ = (
+        Index("ix_Todo_owner_id_id", owner_id, id),
+        # 「未完了で期限切れ」「今週が期限」などの絞り込み + 期限順の並び替えを索引の範囲走査で行う
+        Index("ix_Todo_owner_id_完了_期限", owner_id, is_completed, due_date),
+        # 内容順・期限順の並び替え (TODO_SORT_KEYS) 用
+        Index("ix_Todo_owner_id_内容", owner_id, content),
+        Index("ix_Todo_owner_id_期限", owner_id, due_date),
+        Index("ix_Todo_owner_id_change_seq", owner_id, change_seq),
+    )
+    __mapper_args__ = {"version_id_col": version}
     
     tags = relationship("Tag", secondary=todo_tag_association, back_populates="todos")
 
 class Tag(Base):
     __tablename__ = "Tag"
     id = Column("id", Integer, primary_key=True, index=True)
-    description = Column("説明", String, index=True)
+    owner_id = owner_id_column()
+    description = Column("説明", String)
+    version = Column("version", Integer, nullable=False, server_default="1")
+    updated_at = updated_at_column()
+    change_seq = change_seq_column(index=False)
+    # タグもユーザーごと。説明はユーザーの中で一意 (同時に作成されても重複しないように一意索引で守る)
+    __table_args__ = (
+        Index("ix_Tag_owner_id_id", owner_id, id),
+        Index("ix_Tag_owner_id_説明", owner_id, description, unique=True),
+        Index("ix_Tag_owner_id_change_seq", owner_id, change_seq),
+    )
+    __mapper_args__ = {"version_id_col": version}
 
     todos = relationship("Todo", secondary=todo_tag_association, back_populates="tags")
 
+class ChangeCounter(Base):
+    """
+    テーブルごとの変更カウンタ。crudの書き込みのたびに同じトランザクション内で +1 する。
+    一覧のETagに使う (値が変わっていなければ一覧の中身も変わっていない)。
+    DBに持つので、複数のワーカープロセス間でも一貫する。
+    """
+    __tablename__ = "change_counter"
+
+    name = Column(String, primary_key=True) # "Todo" / "Tag"
+    value = Column(Integer, nullable=False, default=0)
+
+class SyncTombstone(Base):
+    """
+    削除された行の記録 (同期用)。クライアントは change_seq の順に適用して、手元の行を削除する。
+    entity は "todo" / "tag" / "todo_tag"。"todo_tag" のときは entity_id が todo_id で、tag_id も入る。
+    Todo/Tagを削除したときの関連付けは個別には記録しない (Todo/Tagの削除が関連付けの削除を兼ねる)。
+    古いものは `python -m src.cli compact-tombstones` で削除する。
+    """
+    __tablename__ = "sync_tombstone"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, nullable=True) # 削除された行の持ち主 (その人の同期にだけ返す)
+    change_seq = Column(Integer, nullable=False, index=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    tag_id = Column(Integer, nullable=True)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+
+    __table_args__ = (
+        Index("ix_sync_tombstone_owner_id_change_seq", owner_id, change_seq),
+    )
+
 class User(Base):
     """
     ユーザーモデル
@@ -55,4 +299,41 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+
+
+# === 全文検索 (SQLite FTS5) ===
+# Todo.内容 を検索するための外部コンテンツ型FTS5テーブル。本文はTodo表にだけ持ち、
+# トリガーで索引を同期する (一括INSERT/UPDATE/DELETEでも漏れない)。
+# 日本語は単語の区切りがないため trigram トークナイザで部分一致 (前方一致を含む) を行う。
+TODO_FTS_TABLE = "Todo_fts"
+TODO_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS "Todo_fts" USING fts5("内容", content='Todo', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS "Todo_fts_ai" AFTER INSERT ON "Todo" BEGIN
+        INSERT INTO "Todo_fts"(rowid, "内容") VALUES (new.id, new."内容");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "Todo_fts_ad" AFTER DELETE ON "Todo" BEGIN
+        INSERT INTO "Todo_fts"("Todo_fts", rowid, "内容") VALUES ('delete', old.id, old."内容");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "Todo_fts_au" AFTER UPDATE OF "内容" ON "Todo" BEGIN
+        INSERT INTO "Todo_fts"("Todo_fts", rowid, "内容") VALUES ('delete', old.id, old."内容");
+        INSERT INTO "Todo_fts"(rowid, "内容") VALUES (new.id, new."内容");
+    END""",
+]
+
+def create_todo_fts(connection):
+    """FTS5テーブルと同期用トリガーを作成します。(SQLite以外では何もしません)"""
+    if connection.dialect.name != "sqlite":
+        return
+    for ddl in TODO_FTS_DDL:
+        connection.exec_driver_sql(ddl)
+
+def rebuild_todo_fts(connection):
+    """Todo表の内容からFTS5索引を作り直します。(既存データの取り込み・修復用)"""
+    if connection.dialect.name != "sqlite":
+        return
+    create_todo_fts(connection)
+    connection.exec_driver_sql(f"""INSERT INTO "{TODO_FTS_TABLE}"("{TODO_FTS_TABLE}") VALUES ('rebuild')""")
+
+# create_all でTodo表を作ったときに、FTS5テーブルも一緒に作る
+event.listen(Todo.__table__, "after_create", lambda target, connection, **kw: create_todo_fts(connection))
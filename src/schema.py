@@ -0,0 +1,39 @@
+# src/schema.py
+"""
+起動時のスキーマの準備。(settings.schema_mode で切り替え)
+
+    create_all: 足りないテーブルを作る (開発用。既存のテーブルは変更しない)
+    alembic:    スキーマは `alembic upgrade head` だけで管理する。
+                DBのリビジョンが head と一致しなければ SchemaNotAtHeadError で起動を中止する。
+"""
+from .config import settings
+from .models import Base
+
+class SchemaNotAtHeadError(RuntimeError):
+    """DBのAlembicリビジョンが最新 (head) ではない場合のエラー。"""
+    pass
+
+def alembic_heads() -> set:
+    """マイグレーションスクリプトの head リビジョンを返します。"""
+    # alembic の読み込みは重いので、schema_mode="alembic" のときだけインポートする
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    return set(ScriptDirectory.from_config(Config(settings.alembic_config)).get_heads())
+
+def check_schema_at_head(connection):
+    """DBのリビジョンが head と一致するか確認し、一致しなければ SchemaNotAtHeadError を送出します。"""
+    from alembic.runtime.migration import MigrationContext
+    heads = alembic_heads()
+    current = set(MigrationContext.configure(connection).get_current_heads())
+    if current != heads:
+        raise SchemaNotAtHeadError(
+            f"database schema is at {sorted(current) or 'no revision'}, expected head {sorted(heads)}; "
+            "run `alembic upgrade head`"
+        )
+
+def prepare_schema(connection):
+    """settings.schema_mode に従ってスキーマを準備します。(AsyncConnection.run_sync から呼ぶ)"""
+    if settings.schema_mode == "alembic":
+        check_schema_at_head(connection)
+    else:
+        Base.metadata.create_all(bind=connection)
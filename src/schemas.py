@@ -1,6 +1,8 @@
 # schemas.py
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
+from datetime import date, datetime
+from .config import settings
 
 
 #　ここから
@@ -28,7 +30,7 @@ class Token(BaseModel):
 # --- まず、基本となるスキーマを定義します ---(元5行目)
 class TodoBase(BaseModel):
     content: str
-    due_date: Optional[str] = None
+    due_date: Optional[date] = None # YYYY-MM-DD
 
 class TagBase(BaseModel):
     description: str
@@ -56,6 +58,112 @@ class Todo(TodoBase):
     class Config:
         from_attributes = True
 
+# --- 一覧取得 (キーセットページング) 用のスキーマ ---
+class TodoPage(BaseModel):
+    items: List[Todo]
+    next_cursor: Optional[str] = None # 次ページがない場合は None
+
+class TagWithCount(Tag):
+    todo_count: int = 0 # このタグが付いたTodoの件数
+
+class TagPage(BaseModel):
+    items: List[TagWithCount]
+    next_cursor: Optional[str] = None
+
+class TagTodoPage(TodoPage):
+    tag: Tag
+    todo_count: int # このタグが付いたTodoの総件数
+
+# --- タグの一括関連付け用のスキーマ ---
+class TodoTagIds(BaseModel):
+    tag_ids: List[int] = Field(..., min_length=1)
+
+# --- 一括操作 (バッチ) 用のスキーマ ---
+class TodoBatchOperation(BaseModel):
+    op: Literal["create", "update", "toggle", "delete"]
+    id: Optional[int] = None # update/toggle/delete で必須
+    content: Optional[str] = None # create/update で必須
+    due_date: Optional[date] = None
+    is_completed: Optional[bool] = None # create/update のみ (省略時は作成なら未完了、更新なら変更しない)
+
+class TodoBatchRequest(BaseModel):
+    # atomic: 1件でも失敗したら何も適用しない / best_effort: 成功したものだけ適用する
+    mode: Literal["atomic", "best_effort"] = "atomic"
+    operations: List[TodoBatchOperation] = Field(..., min_length=1, max_length=settings.todo_batch_max_size)
+
+class TodoBatchResult(BaseModel):
+    index: int
+    op: str
+    status: str # ok / invalid / not_found / aborted
+    id: Optional[int] = None
+    is_completed: Optional[bool] = None # toggle の結果
+    error: Optional[str] = None
+
+class TodoBatchResponse(BaseModel):
+    committed: bool
+    results: List[TodoBatchResult]
+
+# --- インポート (/api/todo/import) 用のスキーマ ---
+class TodoImportRow(BaseModel):
+    """インポートするファイルの1行分。(id は無視され、新しいIDが振られる)"""
+    content: str
+    due_date: Optional[date] = None
+    is_completed: bool = False
+    tags: List[str] = [] # タグの説明。存在しないタグは作成される
+
+class TodoImportError(BaseModel):
+    line: int # ファイル上の行番号 (1始まり)
+    error: str
+
+class TodoImportSummary(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    tags_created: int = 0
+    errors: List[TodoImportError] = []
+    errors_truncated: bool = False # エラーが多すぎて一部しか返していない場合 True
+
+# --- 差分同期 (/api/sync) 用のスキーマ ---
+class SyncTodo(BaseModel):
+    content: str
+    due_date: Optional[date] = None
+    id: int
+    is_completed: bool
+    version: int
+    updated_at: Optional[datetime] = None
+    change_seq: int
+
+class SyncTag(BaseModel):
+    description: str
+    id: int
+    version: int
+    updated_at: Optional[datetime] = None
+    change_seq: int
+
+class SyncLink(BaseModel):
+    todo_id: int
+    tag_id: int
+    change_seq: int
+
+class SyncTombstone(BaseModel):
+    entity: Literal["todo", "tag", "todo_tag"]
+    id: int # 削除された行のID ("todo_tag" では todo_id)
+    tag_id: Optional[int] = None # "todo_tag" のときだけ
+    change_seq: int
+    deleted_at: datetime
+
+class SyncChanges(BaseModel):
+    """
+    since より後の変更。クライアントは todos / tags / links / tombstones を change_seq の順に適用し、
+    next_since を保存する。has_more が True なら next_since を since にして続けて取得する。
+    """
+    since: int
+    next_since: int
+    has_more: bool
+    todos: List[SyncTodo]
+    tags: List[SyncTag]
+    links: List[SyncLink]
+    tombstones: List[SyncTombstone]
+
 
 class UserBase(BaseModel):
     username: str
@@ -76,4 +184,23 @@ class Token(BaseModel):
     token_type: str
 
 class TokenData(BaseModel):
-    username: Optional[str] = None
\ No newline at end of file
+    username: Optional[str] = None
+
+# パスワードハッシュ用ワーカープールの利用状況
+class PasswordHashPoolStats(BaseModel):
+    max_workers: int
+    max_queue: int
+    active: int
+    queued: int
+    utilization: float
+    completed: int
+    rejected: int
+    busy_seconds: float
+
+# キャッシュの利用状況
+class CacheStats(BaseModel):
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
\ No newline at end of file
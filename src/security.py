@@ -1,8 +1,14 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone # <-- 'timedelta' も 'datetime' から必要です
 from typing import Optional # <--- この行を追加してください
 from jose import JWTError, jwt
 
+from .metrics import phase
+
 # Bcryptアルゴリズムを使用してパスワードをハッシュ化する設定
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -18,6 +24,90 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
+# === パスワードハッシュ用のワーカープール ===
+# bcryptは1回あたり数百msかかるため、イベントループ上で直接実行すると
+# その間すべてのリクエストが止まってしまう。専用のスレッドプールで実行する。
+# (bcryptはハッシュ計算中にGILを解放するので、スレッドで並列に動く)
+PASSWORD_HASH_WORKERS = 4   # 同時に計算するスレッド数
+PASSWORD_HASH_MAX_QUEUE = 16  # 実行待ちにできる最大件数 (超えたら即座に失敗させる)
+
+class PasswordHashPoolSaturated(Exception):
+    """パスワードハッシュ用プールが満杯で、これ以上受け付けられない場合の例外。"""
+
+class PasswordHashPool:
+    """
+    サイズと待ち行列の長さに上限があるパスワードハッシュ用のスレッドプール。
+    """
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._in_flight = 0 # 実行中 + 待ち行列
+        self._active = 0    # 実行中
+        self._completed = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+
+    async def run(self, fn, *args):
+        """fn(*args) をプールで実行します。満杯なら PasswordHashPoolSaturated を送出します。"""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise PasswordHashPoolSaturated("password hash pool is saturated")
+            self._in_flight += 1
+        future = self._executor.submit(self._timed_call, fn, args)
+        # キャンセルされた場合も含め、終わった時点で件数を戻す
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _timed_call(self, fn, args):
+        with self._lock:
+            self._active += 1
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._active -= 1
+                self._busy_seconds += elapsed
+
+    def _on_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+
+    def stats(self) -> dict:
+        """プールの利用状況を返します。"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": self._in_flight - self._active,
+                "utilization": self._active / self.max_workers,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "busy_seconds": self._busy_seconds,
+            }
+
+password_hash_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password をワーカープールで実行します。(イベントループをブロックしません)
+    """
+    with phase("password_hash"): # プールの空き待ちも含める
+        return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    get_password_hash をワーカープールで実行します。(イベントループをブロックしません)
+    """
+    with phase("password_hash"):
+        return await password_hash_pool.run(get_password_hash, password)
+
 # JWT (JSON Web Token) の設定
 # このSECRET_KEYは非常に重要です。実際には環境変数などから読み込むべきです。
 # (ターミナルで `openssl rand -hex 32` を実行して生成したランダムな文字列に置き換えてください)
@@ -40,15 +130,24 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def decode_access_token(token: str) -> Optional[str]:
+def decode_access_token_claims(token: str) -> Optional[dict]:
     """
-    JWTアクセストークンをデコードし、ユーザー名 (sub) を返します。
+    JWTアクセストークンを検証・デコードし、クレーム (sub, exp など) を返します。
+    検証に失敗した場合、または sub がない場合は None を返します。
     """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+def decode_access_token(token: str) -> Optional[str]:
+    """
+    JWTアクセストークンをデコードし、ユーザー名 (sub) を返します。
+    """
+    payload = decode_access_token_claims(token)
+    if payload is None:
+        return None
+    return payload["sub"]
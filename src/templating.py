@@ -0,0 +1,56 @@
+# src/templating.py
+"""
+HTMLページ用のテンプレートの準備と、描画済みの断片 (フラグメント) のキャッシュ。
+"""
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+from markupsafe import Markup
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud
+from .cache import TAG_SELECTOR_FRAGMENT, fragment_cache
+from .config import settings
+from .metrics import phase
+
+TEMPLATE_DIRECTORY = "templates" # プロジェクトルート基準
+
+class TimedTemplate(Template):
+    """描画を template フェーズとして計測するテンプレート。(/metrics 用)"""
+    def render(self, *args, **kwargs) -> str:
+        with phase("template"):
+            return super().render(*args, **kwargs)
+
+def create_templates() -> Jinja2Templates:
+    """
+    Jinja2Templates を作ります。(アプリの起動時に1回)
+    template_bytecode_cache が有効なら、コンパイル済みのテンプレートをファイルに保存して
+    別のワーカーや再起動後のプロセスでも使い回します。(テンプレートが変わればキーも変わる)
+    """
+    bytecode_cache = None
+    if settings.template_bytecode_cache:
+        bytecode_cache = FileSystemBytecodeCache(settings.template_bytecode_cache_dir)
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIRECTORY),
+        autoescape=True,
+        auto_reload=settings.template_auto_reload,
+        bytecode_cache=bytecode_cache,
+    )
+    env.template_class = TimedTemplate
+    return Jinja2Templates(env=env)
+
+async def render_tag_selector(templates: Jinja2Templates, db: AsyncSession, todo) -> Markup:
+    """
+    タグ管理ページの「追加するタグ」の選択欄を返します。(todo の持ち主のタグのうち、付いていないものの一覧)
+    持ち主・タグの変更カウンタ・todo に付いているタグの組み合わせごとにキャッシュするので、
+    ヒットすればタグ一覧の読み込みも描画も行いません。
+    """
+    counters = await crud.get_change_counters(db, crud.TAG_COUNTER)
+    attached_tag_ids = tuple(sorted(tag.id for tag in todo.tags))
+    key = (TAG_SELECTOR_FRAGMENT, todo.owner_id, counters[crud.TAG_COUNTER], attached_tag_ids)
+    html = fragment_cache.get(key)
+    if html is None:
+        all_tags = await crud.get_all_tags(db, owner_id=todo.owner_id)
+        template = templates.get_template("_tag_selector.html")
+        html = Markup(template.render(all_tags=all_tags, attached_tag_ids=set(attached_tag_ids)))
+        fragment_cache.set(key, html, settings.fragment_cache_ttl_seconds)
+    return html
@@ -0,0 +1,151 @@
+# src/writer.py
+"""
+書き込みのグループコミット (settings.write_group_commit、既定では無効)。
+
+crudの小さな書き込み (Todoの作成・更新・完了の切り替え・削除、タグの作成・変更・削除、関連付け) は
+それぞれコミットしますが、SQLiteではコミットのたびにfsyncが走ります。
+有効にすると、crudは書き込み (コミットしない関数) を write_queue に入れ、書き込み用のタスクが
+同時に届いたものを最大 write_group_commit_max_batch 件までまとめて1つのトランザクションで実行し、
+1回でコミットします。(最初の1件から最大 write_group_commit_max_delay_ms ミリ秒だけ後続を待つ)
+
+- 書き込みはそれぞれSAVEPOINTの中で実行するので、1件が失敗してもその書き込みだけが取り消され、
+  例外はその呼び出し元にだけ返る。他の書き込みはそのままコミットされる
+- コミット自体が失敗した場合は、そのバッチのすべての呼び出し元に例外が返る
+- 呼び出し元はコミットが終わるまで待つので、戻ってきた時点で書き込みは永続化されている
+
+書き込みは書き込み用のエンジン (AsyncSessionLocal) の接続1本で順番に実行します。
+プロセス内でだけまとめます。(複数ワーカーの場合は、ワーカーごとに別々にコミットする)
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import metrics
+from .config import settings
+from .models import AsyncSessionLocal
+
+logger = logging.getLogger("uvicorn.error")
+
+WriteFunc = Callable[[AsyncSession], Awaitable]
+
+class WriteQueue:
+    """
+    書き込みをためてまとめてコミットするキュー。start() で書き込み用のタスクを起動し、
+    stop() で残りを書き込んでから終了します。起動していないときは submit() できません。
+    (crud._commit_write は running を見て、起動していなければその場でコミットする)
+    """
+    def __init__(self, max_batch: int, max_delay: float):
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay)
+        self._queue: "Optional[asyncio.Queue]" = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.operations = 0
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """受け付けを止め、キューに残った書き込みをコミットしてからタスクを終了します。(アプリの終了時)"""
+        task, self._task = self._task, None
+        if task is not None:
+            self._queue.put_nowait(None)
+            await task
+
+    async def submit(self, write: WriteFunc):
+        """
+        write(db) をキューに入れ、コミットされたらその戻り値を返します。(write の中ではコミットしない)
+        write が例外を出した場合や、コミットに失敗した場合はその例外を出します。
+        """
+        if self._task is None:
+            raise RuntimeError("write queue is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((write, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            # コミット中に届いたものはすでにキューにあるので、待たずに取り出す
+            while len(batch) < self.max_batch:
+                try:
+                    if self._queue.empty():
+                        item = await asyncio.wait_for(self._queue.get(), deadline - loop.time())
+                    else:
+                        item = self._queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: list):
+        outcomes = [] # (future, 戻り値, 例外)
+        try:
+            async with AsyncSessionLocal() as db:
+                if db.bind.dialect.name == "sqlite":
+                    # SAVEPOINTより先にトランザクションを始めておく (sqlite3 は SAVEPOINT の前に BEGIN を出さないので、
+                    # 最初のSAVEPOINTの RELEASE でコミットされてしまう)。IMMEDIATE で書き込みのロックも先に取る
+                    await db.execute(text("BEGIN IMMEDIATE"))
+                for write, future in batch:
+                    if future.done(): # 呼び出し元がキャンセル済み
+                        continue
+                    try:
+                        async with db.begin_nested():
+                            result = await write(db)
+                            await db.flush()
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    # 次の書き込みが同じ行を読んだときに、返したオブジェクトを書き換えないように切り離す
+                    db.expunge_all()
+                await db.commit()
+        except Exception as e:
+            logger.exception("group commit of %d writes failed", len(batch))
+            self.failures += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        committed = sum(1 for _, _, error in outcomes if error is None)
+        self.batches += 1
+        self.operations += committed
+        self.failures += len(outcomes) - committed
+        metrics.WRITE_BATCH_SIZE.observe((), committed)
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "batches": self.batches,
+            "operations": self.operations,
+            "failures": self.failures,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+write_queue = WriteQueue(settings.write_group_commit_max_batch, settings.write_group_commit_max_delay_ms / 1000)
@@ -0,0 +1,149 @@
+# tests/conftest.py
+import os
+import sqlite3
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+# src を読み込む前に設定するので、アプリ自体のエンジンも一時ディレクトリのDBを使う (./test.db には触れない)
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='todo-tests-')}/test.db"
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src import models, writer
+from src.cache import fragment_cache, tag_cache
+from src.config import settings
+from src.main import ACCESS_TOKEN_COOKIE, app, get_db
+
+ROOT = Path(__file__).resolve().parent.parent
+
+@pytest.fixture
+def engine(tmp_path):
+    """テストごとの空の一時DBの非同期エンジン。(アプリと同じオプションとPRAGMAを使う)"""
+    url = f"sqlite:///{tmp_path}/test.db"
+    sync_engine = create_engine(url)
+    models.Base.metadata.create_all(bind=sync_engine)
+    sync_engine.dispose()
+    async_url = models.to_async_url(url)
+    engine = create_async_engine(async_url, **models.engine_options(async_url))
+    event.listen(engine.sync_engine, "connect", models.set_sqlite_pragmas)
+    # DBを作り直すとIDや変更カウンタが再利用されるので、前のテストのキャッシュは捨てる
+    tag_cache.clear()
+    fragment_cache.clear()
+    yield engine
+
+@pytest.fixture
+def app_engine():
+    """
+    アプリ自体 (CLIや lifespan) が使うDBの同期エンジン。テーブルがなければ作ります。
+    models.engine は lifespan / CLI の中でしか作られないので、テストからはこちらで読み書きする。
+    """
+    engine = create_engine(models.SQLALCHEMY_DATABASE_URL)
+    models.Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def session_factory(engine):
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+@pytest.fixture
+def client(session_factory, monkeypatch):
+    """一時DBを使うテスト用のクライアント。(グループコミットの書き込みも一時DBに向ける)"""
+    monkeypatch.setattr(writer, "AsyncSessionLocal", session_factory)
+    async def get_test_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = get_test_db
+    try:
+        with TestClient(app) as test_client:
+            yield test_client
+    finally:
+        app.dependency_overrides.clear()
+
+@pytest.fixture
+def run_db(client, session_factory):
+    """run_db(fn) で、テスト用のセッションを渡して await fn(db) をアプリのイベントループ上で実行します。"""
+    async def call(fn):
+        async with session_factory() as db:
+            return await fn(db)
+    return lambda fn: client.portal.call(call, fn)
+
+def login(client, username: str, password: str = "pw") -> dict:
+    """
+    ユーザーを登録してログインし、Authorizationヘッダーを返します。
+    (HTMLページ用に、ブラウザと同じくトークンをCookieにも保存する)
+    """
+    response = client.post("/api/users/register", json={"username": username, "password": password})
+    assert response.status_code == 201, response.text
+    response = client.post("/api/token", data={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    token = response.json()["access_token"]
+    client.cookies.set(ACCESS_TOKEN_COOKIE, token)
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def headers(client):
+    """ログイン済みのユーザーのAuthorizationヘッダー。"""
+    return login(client, f"user-{uuid.uuid4().hex[:12]}")
+
+@pytest.fixture
+def user_id(client, headers) -> int:
+    """headers のユーザーのID。"""
+    return client.get("/api/users/me", headers=headers).json()["id"]
+
+def write_queue_statements() -> int:
+    """
+    グループコミット (WRITE_GROUP_COMMIT) で1件の書き込みに増えるSQL文の数。
+    (BEGIN IMMEDIATE、SAVEPOINT、RELEASE。キューが動いていなければ0)
+    """
+    return 3 if writer.write_queue.running else 0
+
+class QueryCounter:
+    """実行したSQL文を記録します。(count は件数)"""
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+@pytest.fixture
+def count_queries(engine):
+    """with count_queries() as counter: の中で実行されたSQL文を数えます。(before_cursor_execute で数える)"""
+    @contextmanager
+    def counting():
+        counter = QueryCounter()
+        event.listen(engine.sync_engine, "before_cursor_execute", counter)
+        try:
+            yield counter
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", counter)
+    return counting
+
+@pytest.fixture
+def migrate(tmp_path, monkeypatch):
+    """migrate(revision) で一時DBをそのリビジョンまで上げ (または下げ)、sqlite3 の接続を返します。"""
+    from alembic import command
+    from alembic.config import Config
+
+    path = tmp_path / "migrate.db"
+    monkeypatch.setattr(settings, "database_url", f"sqlite:///{path}")
+    # alembic.ini は読まない (ログの設定を書き換えないように)
+    config = Config()
+    config.set_main_option("script_location", str(ROOT / "alembic"))
+
+    def run(revision, downgrade=False):
+        (command.downgrade if downgrade else command.upgrade)(config, revision)
+        return sqlite3.connect(path)
+    run.path = path
+    run.config = config # command.stamp などに使う
+    return run
@@ -0,0 +1,52 @@
+# tests/test_async.py
+"""ルートと認証の依存関係がイベントループをブロックしない (async def で、スレッドプールを使わない) こと。"""
+import asyncio
+import inspect
+
+import httpx
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from src import crud, models
+from src.main import app, get_current_user, get_db
+
+def test_routes_and_auth_dependencies_are_async():
+    sync_routes = [
+        route.path for route in app.routes
+        if isinstance(route, APIRoute) and not inspect.iscoroutinefunction(route.endpoint)
+    ]
+    assert sync_routes == []
+    assert inspect.iscoroutinefunction(get_current_user)
+    assert inspect.isasyncgenfunction(get_db)
+
+def test_crud_functions_are_coroutines():
+    for name in ("get_todo", "get_todos", "create_todo", "update_todo", "delete_todo",
+                 "get_tag", "get_tags", "create_tag", "get_user_by_username", "create_user"):
+        assert inspect.iscoroutinefunction(getattr(crud, name)), name
+
+def test_concurrent_authenticated_requests(client, headers):
+    # 同時に届いた認証付きのリクエストがそれぞれ正しく処理される
+    for i in range(5):
+        assert client.post("/api/todo", json={"content": f"todo {i}"}, headers=headers).status_code == 201
+
+    async def fetch_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*(async_client.get("/api/todo", headers=headers) for _ in range(10)))
+
+    responses = asyncio.run(fetch_all())
+    assert all(r.status_code == 200 and len(r.json()["items"]) == 5 for r in responses)
+
+def test_shutdown_disposes_the_connection_pool():
+    async def query_app_engine():
+        async with models.AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+
+    with TestClient(app) as test_client:
+        test_client.portal.call(query_app_engine)
+        async_engine = models.async_engine
+        assert async_engine.pool.checkedin() == 1
+    # 終了時に接続を閉じるので、aiosqlite のスレッドが残らない
+    assert async_engine.pool.checkedin() == 0
+    assert models.async_engine is None
@@ -0,0 +1,124 @@
+# tests/test_batch.py
+"""POST /api/todo/batch の atomic / best_effort モード。"""
+import pytest
+
+from src.config import settings
+
+from .conftest import write_queue_statements
+
+def create_todos(client, headers, count):
+    return [
+        client.post("/api/todo", json={"content": f"todo {i}"}, headers=headers).json()["id"]
+        for i in range(count)
+    ]
+
+def todos_by_id(client, headers):
+    return {t["id"]: t for t in client.get("/api/todo", headers=headers).json()["items"]}
+
+def test_atomic_batch_applies_every_kind_of_operation(client, headers):
+    a, b, c = create_todos(client, headers, 3)
+    response = client.post("/api/todo/batch", json={"operations": [
+        {"op": "create", "content": "new", "due_date": "2026-10-20"},
+        {"op": "update", "id": a, "content": "renamed"},
+        {"op": "toggle", "id": b},
+        {"op": "delete", "id": c},
+    ]}, headers=headers)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["committed"] is True
+    assert [r["status"] for r in body["results"]] == ["ok"] * 4
+    assert body["results"][2]["is_completed"] is True
+
+    todos = todos_by_id(client, headers)
+    new_id = body["results"][0]["id"]
+    assert todos[new_id]["content"] == "new" and todos[new_id]["due_date"] == "2026-10-20"
+    assert todos[a]["content"] == "renamed"
+    assert todos[b]["is_completed"] is True
+    assert c not in todos
+
+def test_atomic_batch_applies_nothing_when_one_operation_fails(client, headers):
+    a, = create_todos(client, headers, 1)
+    response = client.post("/api/todo/batch", json={"operations": [
+        {"op": "create", "content": "new"},
+        {"op": "toggle", "id": a},
+        {"op": "delete", "id": 999},
+    ]}, headers=headers)
+    assert response.status_code == 409
+    body = response.json()
+    assert body["committed"] is False
+    assert [r["status"] for r in body["results"]] == ["aborted", "aborted", "not_found"]
+    todos = todos_by_id(client, headers)
+    assert list(todos) == [a]
+    assert todos[a]["is_completed"] is False
+
+def test_best_effort_batch_applies_the_valid_operations(client, headers):
+    a, b = create_todos(client, headers, 2)
+    response = client.post("/api/todo/batch", json={"mode": "best_effort", "operations": [
+        {"op": "toggle", "id": a},
+        {"op": "toggle", "id": a},
+        {"op": "update", "id": b},
+        {"op": "delete", "id": 999},
+        {"op": "create"},
+    ]}, headers=headers)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["committed"] is True
+    assert [(r["status"], r.get("error")) for r in body["results"]] == [
+        ("ok", None),
+        ("invalid", "duplicate id in batch"),
+        ("invalid", "content is required"),
+        ("not_found", "todo not found"),
+        ("invalid", "content is required"),
+    ]
+    todos = todos_by_id(client, headers)
+    assert todos[a]["is_completed"] is True
+    assert todos[b]["content"] == "todo 1"
+
+def test_create_and_update_apply_is_completed(client, headers):
+    a, b = create_todos(client, headers, 2)
+    client.put(f"/api/todo/{b}/toggle", headers=headers)
+    response = client.post("/api/todo/batch", json={"operations": [
+        {"op": "create", "content": "done already", "is_completed": True},
+        {"op": "update", "id": a, "content": "finished", "is_completed": True},
+        {"op": "update", "id": b, "content": "still done"},
+    ]}, headers=headers)
+    assert response.status_code == 200, response.text
+    todos = todos_by_id(client, headers)
+    assert todos[response.json()["results"][0]["id"]]["is_completed"] is True
+    assert todos[a]["is_completed"] is True and todos[a]["content"] == "finished"
+    assert todos[b]["is_completed"] is True # 省略すれば変更しない
+
+def test_is_completed_is_rejected_for_toggle_and_delete(client, headers):
+    a, b = create_todos(client, headers, 2)
+    response = client.post("/api/todo/batch", json={"mode": "best_effort", "operations": [
+        {"op": "toggle", "id": a, "is_completed": False},
+        {"op": "delete", "id": b, "is_completed": True},
+    ]}, headers=headers)
+    assert [(r["status"], r["error"]) for r in response.json()["results"]] == [
+        ("invalid", "is_completed is not allowed for toggle"),
+        ("invalid", "is_completed is not allowed for delete"),
+    ]
+    assert set(todos_by_id(client, headers)) == {a, b}
+
+def test_batch_size_is_limited(client, headers):
+    operations = [{"op": "create", "content": "x"}] * (settings.todo_batch_max_size + 1)
+    response = client.post("/api/todo/batch", json={"operations": operations}, headers=headers)
+    assert response.status_code == 422
+    response = client.post("/api/todo/batch", json={"operations": []}, headers=headers)
+    assert response.status_code == 422
+
+@pytest.mark.parametrize("size", [1, 20])
+def test_statements_do_not_grow_with_batch_size(client, headers, count_queries, size):
+    ids = create_todos(client, headers, size * 2)
+    operations = (
+        [{"op": "create", "content": f"new {i}"} for i in range(size)]
+        + [{"op": "toggle", "id": todo_id} for todo_id in ids[:size]]
+        + [{"op": "delete", "id": todo_id} for todo_id in ids[size:]]
+    )
+    with count_queries() as counter:
+        response = client.post("/api/todo/batch", json={"operations": operations}, headers=headers)
+    assert response.status_code == 200, response.text
+    # 同期用シーケンス、存在チェック、INSERT、トグルのUPDATEと読み直し、タグの関連とTodoのDELETE、
+    # 墓標のINSERT、変更カウンタ
+    expected = 9 + write_queue_statements()
+    assert len([s for s in counter.statements if not s.startswith("SELECT users")]) == expected, counter.statements
@@ -0,0 +1,53 @@
+# tests/test_benchmarks.py
+"""benchmarks/routes.py (ルートごとの負荷テスト) のシナリオの網羅と、劣化の判定。"""
+import json
+
+import pytest
+
+from benchmarks import routes
+from src.main import app
+
+def test_every_route_has_a_scenario_or_a_reason_to_skip():
+    covered = {scenario.route for scenario in routes.SCENARIOS} | set(routes.SKIPPED_ROUTES)
+    assert routes._app_routes(app) - covered == set()
+    # 存在しないルートのシナリオも残さない
+    assert {scenario.route for scenario in routes.SCENARIOS} - routes._app_routes(app) == set()
+    assert len({scenario.name for scenario in routes.SCENARIOS}) == len(routes.SCENARIOS)
+
+def test_percentile_uses_the_nearest_rank():
+    values = list(range(1, 101))
+    assert routes._percentile(values, 0.50) == 50
+    assert routes._percentile(values, 0.99) == 99
+    assert routes._percentile([7], 0.95) == 7
+
+def result(p50=1.0, p95=2.0, rps=100.0, queries=3.0):
+    return {"p50_ms": p50, "p95_ms": p95, "rps": rps, "queries": queries}
+
+def test_regressions_flag_latency_throughput_and_query_growth():
+    baseline = {"sizes": {"1000": {"a": result(), "b": result(), "c": result(), "d": result()}}}
+    current = {"sizes": {"1000": {
+        "a": result(p50=1.1, rps=90.0),  # 閾値 (20%) 以内
+        "b": result(p95=3.0),
+        "c": result(rps=50.0, queries=4.0),
+        "d": result(),
+        "new": result(p50=100.0),        # 以前の結果にないシナリオは比べない
+    }}, "1000000": {"a": result(p50=100.0)}}
+    found = routes._regressions(baseline, current, threshold=0.2)
+    assert [(size, name, detail.split()[0]) for size, name, detail in found] == [
+        ("1000", "b", "p95_ms"),
+        ("1000", "c", "rps"),
+        ("1000", "c", "queries"),
+    ]
+
+def test_small_run_writes_json_and_compares_clean(tmp_path, capsys):
+    output = tmp_path / "routes.json"
+    args = ["--sizes", "40", "--requests", "4", "--warmup", "1", "--concurrency", "2", "--only", "GET /api/todo"]
+    routes.main(args + ["--output", str(output)])
+    report = json.loads(output.read_text(encoding="utf-8"))
+    result = report["sizes"]["40"]["GET /api/todo"]
+    assert result["requests"] == 4 and result["errors"] == 0 and result["queries"] > 0
+    assert report["metadata"]["requests"] == 4
+
+    # 同じ結果と比べれば劣化はない
+    assert routes._regressions(report, report, 0.2) == []
+    assert "routes without a scenario" not in capsys.readouterr().out
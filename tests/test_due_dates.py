@@ -0,0 +1,90 @@
+# tests/test_due_dates.py
+"""期限 (DATE型) の絞り込み・並び替えと、文字列からの移行。"""
+import importlib.util
+from datetime import date
+from pathlib import Path
+
+from sqlalchemy import text
+
+from src import crud
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def create_todos(client, headers, due_dates):
+    ids = []
+    for i, due_date in enumerate(due_dates):
+        response = client.post("/api/todo", json={"content": f"todo {i}", "due_date": due_date}, headers=headers)
+        assert response.status_code == 201, response.text
+        ids.append(response.json()["id"])
+    return ids
+
+def list_ids(client, headers, **params):
+    response = client.get("/api/todo", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return [t["id"] for t in response.json()["items"]]
+
+def test_due_dates_round_trip_as_iso_dates(client, headers):
+    todo_id, = create_todos(client, headers, ["2026-10-20"])
+    assert client.get(f"/api/todo/{todo_id}", headers=headers).json()["due_date"] == "2026-10-20"
+    response = client.post("/api/todo", json={"content": "x", "due_date": "10/20/2026"}, headers=headers)
+    assert response.status_code == 422
+
+def test_filters_by_due_range_and_completion(client, headers):
+    early, mid, late, undated = create_todos(client, headers, ["2026-10-01", "2026-10-15", "2026-11-01", None])
+    client.put(f"/api/todo/{mid}/toggle", headers=headers)
+
+    # due_after は含み、due_before は含まない。期限のないTodoは範囲指定で除外される
+    assert list_ids(client, headers, due_after="2026-10-01", due_before="2026-11-01") == [early, mid]
+    assert list_ids(client, headers, due_after="2026-10-02") == [mid, late]
+    assert list_ids(client, headers, is_completed="false", due_before="2026-12-01") == [early, late]
+    assert list_ids(client, headers, is_completed="true") == [mid]
+    assert undated in list_ids(client, headers)
+
+def test_order_by_due_date_pages_through_null_dates(client, headers):
+    due_dates = [None, "2026-10-02", None, "2026-10-01", "2026-10-02", None]
+    ids = create_todos(client, headers, due_dates)
+    seen, cursor = [], None
+    while True:
+        params = {"order_by": "due_date", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/todo", params=params, headers=headers).json()
+        seen += [t["id"] for t in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    # 期限のないものが先頭 (id順)、その後は期限順 (同じ日はid順)
+    expected = sorted(zip(due_dates, ids), key=lambda pair: (pair[0] is not None, pair[0] or "", pair[1]))
+    assert seen == [todo_id for _, todo_id in expected]
+
+def test_malformed_date_cursor_is_rejected(client, headers):
+    create_todos(client, headers, ["2026-10-01"])
+    cursor = crud.encode_cursor("due_date", "not-a-date", 1)
+    response = client.get("/api/todo", params={"order_by": "due_date", "cursor": cursor}, headers=headers)
+    assert response.status_code == 400
+
+def test_edit_form_rejects_malformed_dates(client, headers):
+    todo_id, = create_todos(client, headers, [None])
+    response = client.post(
+        f"/todo/{todo_id}/update", data={"content": "x", "due_date": "someday"}, follow_redirects=False
+    )
+    assert response.status_code == 400
+
+def test_completion_and_due_filter_uses_the_composite_index(app_engine):
+    with app_engine.connect() as connection:
+        plan = connection.execute(text(
+            'EXPLAIN QUERY PLAN SELECT id FROM "Todo" '
+            'WHERE owner_id = 1 AND "完了/未完了" = 0 AND "期限" < \'2026-11-01\''
+        )).all()
+    assert any("SEARCH" in row[-1] and "ix_Todo_owner_id_完了_期限" in row[-1] for row in plan), plan
+
+def test_migration_parses_common_date_spellings(monkeypatch):
+    # マイグレーションは env.py が alembic/ をインポートパスに追加した状態で読み込まれる
+    monkeypatch.syspath_prepend(str(ROOT / "alembic"))
+    path = ROOT / "alembic" / "versions" / "d41a7c6e2b58_convert_todo_due_date_to_date.py"
+    spec = importlib.util.spec_from_file_location("convert_due_date", path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    for raw in ["2025-10-21", "2025/10/21", "2025年10月21日", "20251021", "10/21/2025", " 2025.10.21 "]:
+        assert migration.parse_due_date(raw) == date(2025, 10, 21), raw
+    for raw in [None, "", "来週", "2025-13-01", "2025-02-30"]:
+        assert migration.parse_due_date(raw) is None, raw
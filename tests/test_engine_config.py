@@ -0,0 +1,49 @@
+# tests/test_engine_config.py
+"""設定 (config.py) からのエンジンの組み立てとSQLiteのPRAGMA。"""
+from sqlalchemy import text
+
+from src import models
+from src.config import Settings, settings
+
+def test_async_url_is_derived_from_the_sync_url():
+    assert models.to_async_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert models.to_async_url("postgresql://u:pw@db/todo") == "postgresql+asyncpg://u:pw@db/todo"
+    assert models.to_async_url("mysql://u:pw@db/todo") == "mysql+aiomysql://u:pw@db/todo"
+    # 非同期ドライバ指定済み、または対応表にないものはそのまま
+    assert models.to_async_url("postgresql+asyncpg://u@db/todo") == "postgresql+asyncpg://u@db/todo"
+    assert models.to_async_url("oracle://u@db/todo") == "oracle://u@db/todo"
+
+def test_settings_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u:pw@db/todo")
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    configured = Settings()
+    assert configured.database_url == "postgresql://u:pw@db/todo"
+    assert configured.db_pool_size == 3
+
+def test_engine_options_per_backend():
+    assert models.engine_options("sqlite:///x.db")["connect_args"] == {"check_same_thread": False}
+    assert "connect_args" not in models.engine_options("sqlite+aiosqlite:///x.db")
+    assert "pool_size" not in models.engine_options("sqlite:///x.db")
+
+    options = models.engine_options("postgresql+asyncpg://u@db/todo")
+    assert options["pool_size"] == settings.db_pool_size
+    assert options["max_overflow"] == settings.db_max_overflow
+    assert options["pool_recycle"] == settings.db_pool_recycle
+    assert options["pool_pre_ping"] is settings.db_pool_pre_ping
+
+def test_sqlite_connections_are_tuned(client):
+    # models.engine は lifespan で作られる
+    with models.engine.connect() as connection:
+        pragma = lambda name: connection.execute(text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode").lower() == settings.sqlite_journal_mode.lower()
+        assert pragma("synchronous") == 1 # NORMAL
+        assert pragma("busy_timeout") == settings.sqlite_busy_timeout_ms
+        assert pragma("cache_size") == -settings.sqlite_cache_size_kib
+
+def test_startup_log_hides_the_password(monkeypatch):
+    monkeypatch.setattr(models, "SQLALCHEMY_DATABASE_URL", "postgresql://u:secret@db/todo")
+    monkeypatch.setattr(models, "ASYNC_SQLALCHEMY_DATABASE_URL", "postgresql+asyncpg://u:secret@db/todo")
+    line = models.describe_engine_config()
+    assert "secret" not in line
+    assert "async_driver=postgresql+asyncpg" in line
+    assert f"pool_size={settings.db_pool_size}" in line
@@ -0,0 +1,178 @@
+# tests/test_etags.py
+"""ETagと条件付きリクエスト (If-None-Match → 304 / If-Match → 412)。"""
+import pytest
+from sqlalchemy import delete, update
+
+from src import crud, models
+
+def create_todo(client, headers, content="todo"):
+    return client.post("/api/todo", json={"content": content}, headers=headers).json()["id"]
+
+def create_tag(client, headers, description="tag"):
+    return client.post("/api/tag", json={"description": description}, headers=headers).json()["id"]
+
+def test_todo_list_etag_304_until_a_write(client, headers):
+    create_todo(client, headers)
+    response = client.get("/api/todo", headers=headers)
+    etag = response.headers["ETag"]
+
+    response = client.get("/api/todo", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    # 弱いETagとしても一致する
+    response = client.get("/api/todo", headers={**headers, "If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+    # クエリが違えば別のETag
+    response = client.get("/api/todo", params={"limit": 1}, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    create_todo(client, headers, "another")
+    response = client.get("/api/todo", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_tag_list_etag_changes_with_todo_writes(client, headers):
+    tag_id = create_tag(client, headers)
+    etag = client.get("/api/tag", headers=headers).headers["ETag"]
+    assert client.get("/api/tag", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    # 件数はTodoの関連付けで変わるため、Todo側の変更でもETagが変わる
+    todo_id = create_todo(client, headers)
+    client.post(f"/api/todo/{todo_id}/tags/{tag_id}", headers=headers)
+    response = client.get("/api/tag", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["todo_count"] == 1
+
+def test_todo_item_etag_follows_the_row_version(client, headers):
+    todo_id = create_todo(client, headers)
+    response = client.get(f"/api/todo/{todo_id}", headers=headers)
+    etag = response.headers["ETag"]
+    assert client.get(f"/api/todo/{todo_id}", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    response = client.put(f"/api/todo/{todo_id}/toggle", headers={**headers, "If-Match": etag})
+    assert response.status_code == 200, response.text
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+    assert client.get(f"/api/todo/{todo_id}", headers=headers).headers["ETag"] == new_etag
+
+    # タグの付け外しでもTodoのバージョンが上がる
+    tag_id = create_tag(client, headers)
+    client.post(f"/api/todo/{todo_id}/tags/{tag_id}", headers=headers)
+    response = client.get(f"/api/todo/{todo_id}", headers={**headers, "If-None-Match": new_etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != new_etag
+
+def test_if_match_mismatch_is_412(client, headers):
+    todo_id = create_todo(client, headers)
+    etag = client.get(f"/api/todo/{todo_id}", headers=headers).headers["ETag"]
+    client.put(f"/api/todo/{todo_id}", json={"content": "edited"}, headers=headers)
+
+    stale = {**headers, "If-Match": etag}
+    for response in (
+        client.put(f"/api/todo/{todo_id}", json={"content": "lost update"}, headers=stale),
+        client.put(f"/api/todo/{todo_id}/toggle", headers=stale),
+        client.delete(f"/api/todo/{todo_id}", headers=stale),
+    ):
+        assert response.status_code == 412, response.text
+        assert response.headers["ETag"] != etag
+    # 弱いETagは If-Match に一致しない
+    current = client.get(f"/api/todo/{todo_id}", headers=headers).headers["ETag"]
+    weak = {**headers, "If-Match": f"W/{current}"}
+    assert client.delete(f"/api/todo/{todo_id}", headers=weak).status_code == 412
+
+    todo = client.get(f"/api/todo/{todo_id}", headers=headers).json()
+    assert todo["content"] == "edited" and todo["is_completed"] is False
+    assert client.delete(f"/api/todo/{todo_id}", headers={**headers, "If-Match": current}).status_code == 200
+    assert client.delete(f"/api/todo/{todo_id}", headers={**headers, "If-Match": "*"}).status_code == 404
+
+def test_tag_item_etag_and_if_match(client, headers):
+    tag_id = create_tag(client, headers)
+    etag = client.get(f"/api/tag/{tag_id}", headers=headers).headers["ETag"]
+    assert client.get(f"/api/tag/{tag_id}", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    response = client.put(f"/api/tag/{tag_id}", json={"description": "renamed"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
+    response = client.put(f"/api/tag/{tag_id}", json={"description": "again"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+
+def test_change_counters_count_writes(client, headers, run_db):
+    async def counters(db):
+        return await crud.get_change_counters(db, crud.TODO_COUNTER, crud.TAG_COUNTER)
+
+    before = run_db(counters)
+    todo_id = create_todo(client, headers)
+    client.put(f"/api/todo/{todo_id}/toggle", headers=headers)
+    create_tag(client, headers)
+    after = run_db(counters)
+    assert after[crud.TODO_COUNTER] == before[crud.TODO_COUNTER] + 2
+    assert after[crud.TAG_COUNTER] == before[crud.TAG_COUNTER] + 1
+
+def test_counter_is_bumped_in_one_statement(client, run_db, count_queries):
+    async def bump_twice(db):
+        first = await crud.next_change_seq(db)
+        second = await crud.next_change_seq(db)
+        await db.commit()
+        return first, second
+
+    with count_queries() as counter:
+        first, second = run_db(bump_twice)
+    assert second == first + 1
+    # 行がなければ作り、あれば +1 して新しい値を返す1文 (INSERT ... ON CONFLICT DO UPDATE ... RETURNING)
+    assert len([s for s in counter.statements if s.startswith("INSERT INTO change_counter")]) == 2, counter.statements
+    assert len(counter.statements) == 2, counter.statements
+
+def change_before(monkeypatch, session_factory, name, make_statement):
+    """
+    crud の name を呼ぶ直前に、別のセッションで make_statement(その呼び出しのキーワード引数) を実行してコミットします。
+    (エンドポイントが読み込んでから書き込むまでの間に、別のリクエストが同じ行を変更した場合)
+    """
+    original = getattr(crud, name)
+
+    async def racing(db, **kwargs):
+        async with session_factory() as other:
+            await other.execute(make_statement(**kwargs))
+            await other.commit()
+        return await original(db, **kwargs)
+    monkeypatch.setattr(crud, name, racing)
+
+def bump_todo(todo_id, **_):
+    return update(models.Todo).where(models.Todo.id == todo_id).values(version=models.Todo.version + 1)
+
+def complete_todo(todo_id, **_):
+    return (
+        update(models.Todo).where(models.Todo.id == todo_id)
+        .values(is_completed=True, version=models.Todo.version + 1)
+    )
+
+def delete_todo(todo_id, **_):
+    return delete(models.Todo).where(models.Todo.id == todo_id)
+
+def delete_tag(tag_id, **_):
+    return delete(models.Tag).where(models.Tag.id == tag_id)
+
+def test_concurrent_change_is_412_only_with_if_match(client, headers, session_factory, monkeypatch):
+    todo_id = create_todo(client, headers)
+    etag = client.get(f"/api/todo/{todo_id}", headers=headers).headers["ETag"]
+    change_before(monkeypatch, session_factory, "update_todo", bump_todo)
+    change_before(monkeypatch, session_factory, "toggle_todo", complete_todo)
+
+    # If-Match は通ったが、その後に別のリクエストが更新した
+    response = client.put(f"/api/todo/{todo_id}", json={"content": "x"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412, response.text
+    # If-Match がなければ、書き込みの時点の行に対して変更する (別のリクエストが完了にした後に切り替える)
+    response = client.put(f"/api/todo/{todo_id}/toggle", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["is_completed"] is False
+
+def test_writes_to_rows_deleted_after_the_read_are_404(client, headers, session_factory, monkeypatch):
+    first, second = create_todo(client, headers), create_todo(client, headers)
+    tag_id = create_tag(client, headers)
+    change_before(monkeypatch, session_factory, "update_todo", delete_todo)
+    change_before(monkeypatch, session_factory, "toggle_todo", delete_todo)
+    change_before(monkeypatch, session_factory, "update_tag", delete_tag)
+
+    assert client.put(f"/api/todo/{first}", json={"content": "x"}, headers=headers).status_code == 404
+    assert client.put(f"/api/todo/{second}/toggle", headers=headers).status_code == 404
+    assert client.put(f"/api/tag/{tag_id}", json={"description": "x"}, headers=headers).status_code == 404
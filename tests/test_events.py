@@ -0,0 +1,136 @@
+# tests/test_events.py
+"""変更イベントの配信 (src/events.py と GET /api/events)。"""
+import threading
+import time
+
+import orjson
+import pytest
+
+from src import events
+from src.events import EventHub, event_hub
+
+def drain(subscriber) -> list:
+    """キューに溜まったイベントを (id, データ) のリストで取り出します。"""
+    items = []
+    while not subscriber.queue.empty():
+        event = subscriber.queue.get_nowait()
+        items.append(None if event is None else (event.id, orjson.loads(event.data)))
+    return items
+
+RESYNC = {"op": "resync"}
+
+def test_overflow_and_resync():
+    hub = EventHub(max_queue=3, replay_size=10)
+    slow, fast = hub.subscribe(1), hub.subscribe(1)
+    for i in range(3):
+        hub.publish(1, "todo", "upsert", [i])
+    drain(fast)
+    hub.publish(1, "todo", "delete", [3])
+    # あふれたクライアントは溜まっていた分を捨てて resync 1件だけになり、他のクライアントには影響しない
+    assert drain(slow) == [(4, RESYNC)]
+    assert drain(fast) == [(4, {"entity": "todo", "op": "delete", "ids": [3]})]
+    assert hub.stats() == {"subscribers": 2, "last_event_id": 4, "overflows": 1}
+
+    # resync の後は普通にイベントを受け取る
+    hub.publish(1, "tag", "upsert", [1])
+    assert drain(slow) == [(5, {"entity": "tag", "op": "upsert", "ids": [1]})]
+
+def test_empty_changes_are_not_published():
+    hub = EventHub(max_queue=3, replay_size=10)
+    subscriber = hub.subscribe(1)
+    hub.publish(1, "todo", "delete", [])
+    assert drain(subscriber) == [] and hub.stats()["last_event_id"] == 0
+
+def test_reconnect_replays_from_last_event_id():
+    hub = EventHub(max_queue=10, replay_size=3)
+    for i in range(5):
+        hub.publish(1, "todo", "upsert", [i])
+    # 覚えているのは 3, 4, 5 番
+    assert [event_id for event_id, _ in drain(hub.subscribe(1, "3"))] == [4, 5]
+    assert [event_id for event_id, _ in drain(hub.subscribe(1, "2"))] == [3, 4, 5]
+    assert drain(hub.subscribe(1, "5")) == []
+    # 古すぎる・未来の番号 (サーバーの再起動)・不正な値は resync
+    for last_event_id in ("1", "6", "abc"):
+        assert drain(hub.subscribe(1, last_event_id)) == [(5, RESYNC)], last_event_id
+
+def test_events_only_reach_their_owner():
+    hub = EventHub(max_queue=10, replay_size=10)
+    mine, theirs = hub.subscribe(1), hub.subscribe(2)
+    hub.publish(1, "todo", "upsert", [1])
+    hub.publish(2, "todo", "upsert", [2])
+    assert drain(mine) == [(1, {"entity": "todo", "op": "upsert", "ids": [1]})]
+    assert drain(theirs) == [(2, {"entity": "todo", "op": "upsert", "ids": [2]})]
+    # 再接続時の再送も自分のイベントだけ
+    assert [event_id for event_id, _ in drain(hub.subscribe(2, "0"))] == [2]
+
+def test_close_ends_every_stream_even_when_queues_are_full():
+    hub = EventHub(max_queue=2, replay_size=10)
+    full, empty = hub.subscribe(1), hub.subscribe(1)
+    hub.publish(1, "todo", "upsert", [1])
+    hub.publish(1, "todo", "upsert", [2])
+    drain(empty)
+    hub.close()
+    assert drain(full)[-1] is None and drain(empty) == [None]
+
+def test_writes_publish_events_after_commit(client, headers):
+    user_id = client.get("/api/users/me", headers=headers).json()["id"]
+    other = event_hub.subscribe(user_id + 1)
+    subscriber = event_hub.subscribe(user_id)
+    try:
+        todo_id = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+        tag_id = client.post("/api/tag", json={"description": "t"}, headers=headers).json()["id"]
+        client.post(f"/api/todo/{todo_id}/tags/{tag_id}", headers=headers)
+        client.put(f"/api/todo/{todo_id}/toggle", headers=headers)
+        client.post("/api/todo/batch", json={"operations": [
+            {"op": "create", "content": "b"}, {"op": "delete", "id": todo_id},
+        ]}, headers=headers)
+        client.delete(f"/api/tag/{tag_id}", headers=headers)
+        # 失敗した書き込み (アトミックなバッチの中止) はイベントを出さない
+        client.post("/api/todo/batch", json={"operations": [{"op": "delete", "id": 10_000}]}, headers=headers)
+        published = [data for _, data in drain(subscriber)]
+        assert drain(other) == []
+    finally:
+        event_hub.unsubscribe(subscriber)
+        event_hub.unsubscribe(other)
+    assert published == [
+        {"entity": "todo", "op": "upsert", "ids": [todo_id]},
+        {"entity": "tag", "op": "upsert", "ids": [tag_id]},
+        {"entity": "todo", "op": "upsert", "ids": [todo_id]},
+        {"entity": "todo", "op": "upsert", "ids": [todo_id]},
+        {"entity": "todo", "op": "upsert", "ids": [todo_id + 1]},
+        {"entity": "todo", "op": "delete", "ids": [todo_id]},
+        {"entity": "tag", "op": "delete", "ids": [tag_id]},
+    ]
+
+def test_events_endpoint_streams_sse(client, headers, monkeypatch):
+    monkeypatch.setattr(events.settings, "event_heartbeat_seconds", 0.05)
+    user_id = client.get("/api/users/me", headers=headers).json()["id"]
+    before = event_hub.stats()["last_event_id"]
+
+    def publish_then_close():
+        # ストリームが登録されるのを待ってから、イベントを流してストリームを終わらせる
+        while event_hub.stats()["subscribers"] == 0:
+            time.sleep(0.01)
+        time.sleep(0.1) # ハートビートが出るまで待つ
+        client.portal.call(event_hub.publish, user_id + 1, "todo", "upsert", [8])
+        client.portal.call(event_hub.publish, user_id, "todo", "upsert", [7])
+        client.portal.call(event_hub.close)
+
+    thread = threading.Thread(target=publish_then_close)
+    thread.start()
+    response = client.get("/api/events", headers={**headers, "Last-Event-ID": str(before)})
+    thread.join()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    body = response.text
+    assert body.startswith("retry: 3000\n\n")
+    assert ": ping\n\n" in body
+    assert f'id: {before + 2}\ndata: {{"entity":"todo","op":"upsert","ids":[7]}}\n\n' in body
+    assert "[8]" not in body
+    # 切断 (ここではストリームの終了) で登録が解除される
+    assert event_hub.stats()["subscribers"] == 0
+
+def test_events_endpoint_requires_login(client):
+    assert client.get("/api/events").status_code == 401
@@ -0,0 +1,81 @@
+# tests/test_export.py
+"""GET /api/todo/export (NDJSON / CSV のストリーミング書き出し)。"""
+import csv
+import io
+import json
+
+import pytest
+
+from src import export
+from src.config import settings
+
+@pytest.fixture(autouse=True)
+def export_session(monkeypatch, session_factory):
+    # 書き出しはリクエストの依存関係ではなく自前のセッションを開くので、テスト用のDBに向ける
+    monkeypatch.setattr(export, "AsyncReadSessionLocal", session_factory)
+
+def seed(client, headers):
+    tag_ids = [
+        client.post("/api/tag", json={"description": d}, headers=headers).json()["id"]
+        for d in ("仕事", "home")
+    ]
+    rows = [
+        {"content": "plain", "due_date": "2026-01-02"},
+        {"content": 'comma, "quote"\nnewline', "due_date": None},
+        {"content": "日本語", "due_date": None},
+    ]
+    ids = [client.post("/api/todo", json=row, headers=headers).json()["id"] for row in rows]
+    client.post(f"/api/todo/{ids[0]}/tags", json={"tag_ids": tag_ids}, headers=headers)
+    client.put(f"/api/todo/{ids[2]}/toggle", headers=headers)
+    return ids, tag_ids
+
+def test_ndjson_export(client, headers):
+    ids, tag_ids = seed(client, headers)
+    response = client.get("/api/todo/export", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'filename="todos.ndjson"' in response.headers["content-disposition"]
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == ids
+    assert rows[0] == {
+        "id": ids[0], "content": "plain", "due_date": "2026-01-02", "is_completed": False,
+        "tags": [{"id": tag_ids[0], "description": "仕事"}, {"id": tag_ids[1], "description": "home"}],
+    }
+    assert rows[1]["content"] == 'comma, "quote"\nnewline' and rows[1]["due_date"] is None
+    assert rows[2]["is_completed"] is True and rows[2]["tags"] == []
+
+def test_csv_export(client, headers):
+    ids, _ = seed(client, headers)
+    response = client.get("/api/todo/export", params={"format": "csv"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == export.CSV_COLUMNS
+    assert rows[1:] == [
+        [str(ids[0]), "plain", "2026-01-02", "false", "仕事;home"],
+        [str(ids[1]), 'comma, "quote"\nnewline', "", "false", ""],
+        [str(ids[2]), "日本語", "", "true", ""],
+    ]
+
+def test_empty_export(client, headers):
+    assert client.get("/api/todo/export", headers=headers).text == ""
+    rows = list(csv.reader(io.StringIO(client.get("/api/todo/export", params={"format": "csv"}, headers=headers).text)))
+    assert rows == [export.CSV_COLUMNS]
+
+def test_export_requires_login_and_a_known_format(client, headers):
+    assert client.get("/api/todo/export").status_code == 401
+    assert client.get("/api/todo/export", params={"format": "xml"}, headers=headers).status_code == 422
+
+def test_export_reads_tags_once_per_batch(client, headers, monkeypatch, count_queries):
+    monkeypatch.setattr(settings, "todo_export_batch_size", 2)
+    ids, _ = seed(client, headers)
+    for i in range(4):
+        client.post("/api/todo", json={"content": f"more {i}"}, headers=headers)
+    with count_queries() as counter:
+        response = client.get("/api/todo/export", headers=headers)
+    assert len(response.text.splitlines()) == 7
+    statements = [s for s in counter.statements if not s.startswith("SELECT users")]
+    # Todoを読むクエリ1回と、2件ずつのバッチ (4つ) ごとのタグのクエリ
+    assert len(statements) == 1 + 4, statements
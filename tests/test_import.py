@@ -0,0 +1,174 @@
+# tests/test_import.py
+"""POST /api/todo/import と `python -m src.cli import-todos` (NDJSON / CSV の取り込み)。"""
+import json
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from sqlalchemy.exc import IntegrityError
+
+from src import cli, crud, export
+from src.config import settings
+
+from .conftest import write_queue_statements
+
+def upload(client, headers, body, filename="todos.ndjson", **params):
+    files = {"file": (filename, body.encode("utf-8") if isinstance(body, str) else body)}
+    return client.post("/api/todo/import", files=files, params=params, headers=headers)
+
+def all_todos(client, headers):
+    return client.get("/api/todo", params={"limit": 100}, headers=headers).json()["items"]
+
+def test_ndjson_import_creates_todos_and_tags(client, headers):
+    existing = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+    body = "\n".join([
+        json.dumps({"content": "first", "due_date": "2026-03-01", "tags": ["home", "仕事"]}, ensure_ascii=False),
+        "",
+        json.dumps({"content": "second", "is_completed": True, "tags": [{"id": 999, "description": "仕事"}]}, ensure_ascii=False),
+    ])
+    response = upload(client, headers, body)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"imported": 2, "failed": 0, "tags_created": 1, "errors": [], "errors_truncated": False}
+
+    first, second = all_todos(client, headers)
+    assert first["content"] == "first" and first["due_date"] == "2026-03-01"
+    assert [tag["description"] for tag in first["tags"]] == ["home", "仕事"]
+    assert first["tags"][0]["id"] == existing
+    assert second["is_completed"] is True and second["tags"] == first["tags"][1:]
+
+def test_csv_import_with_the_export_layout(client, headers):
+    body = "﻿id,content,due_date,is_completed,tags\r\n7,\"comma, \"\"quote\"\"\",2026-01-02,true,a;b\r\n8,plain,,,\r\n"
+    response = upload(client, headers, body, filename="todos.csv")
+    assert response.json()["imported"] == 2, response.text
+
+    first, second = all_todos(client, headers)
+    assert (first["content"], first["due_date"], first["is_completed"]) == ('comma, "quote"', "2026-01-02", True)
+    assert [tag["description"] for tag in first["tags"]] == ["a", "b"]
+    assert (second["content"], second["due_date"], second["is_completed"], second["tags"]) == ("plain", None, False, [])
+
+def test_export_round_trips_through_import(client, headers, monkeypatch, session_factory):
+    monkeypatch.setattr(export, "AsyncReadSessionLocal", session_factory)
+    upload(client, headers, '{"content": "x", "due_date": "2026-05-05", "tags": ["t1", "t2"]}\n{"content": "y"}\n')
+    for format in ("ndjson", "csv"):
+        exported = client.get("/api/todo/export", params={"format": format}, headers=headers).content
+        before = all_todos(client, headers)
+        response = upload(client, headers, exported, filename=f"todos.{format}")
+        assert response.json()["imported"] == len(before)
+        assert response.json()["tags_created"] == 0
+        after = all_todos(client, headers)[len(before):]
+        strip = lambda todos: [{k: v for k, v in todo.items() if k not in ("id", "created_at")} for todo in todos]
+        assert strip(after) == strip(before)
+
+def test_invalid_lines_are_skipped_and_reported(client, headers):
+    body = "\n".join([
+        '{"content": "ok"}',
+        "{not json",
+        "[1, 2]",
+        '{"content": "bad date", "due_date": "2026-13-01"}',
+        '{"due_date": "2026-01-01"}',
+        '{"content": "also ok"}',
+    ])
+    summary = upload(client, headers, body).json()
+    assert summary["imported"] == 2 and summary["failed"] == 4
+    assert [error["line"] for error in summary["errors"]] == [2, 3, 4, 5]
+    assert "invalid JSON" in summary["errors"][0]["error"]
+    assert summary["errors"][2]["error"].startswith("due_date")
+    assert summary["errors"][3]["error"].startswith("content")
+    assert [todo["content"] for todo in all_todos(client, headers)] == ["ok", "also ok"]
+
+    csv_summary = upload(client, headers, "content,due_date\nfine,\nbad,yesterday\n", filename="x.csv").json()
+    assert csv_summary["imported"] == 1
+    assert [error["line"] for error in csv_summary["errors"]] == [3]
+
+def test_whole_file_errors_are_400(client, headers):
+    assert upload(client, headers, "name\nx\n", filename="todos.csv").status_code == 400
+    assert upload(client, headers, "{}", filename="todos.txt").status_code == 400
+    assert upload(client, headers, '{"content": "x"}', filename="todos.txt", format="ndjson").json()["imported"] == 1
+    assert upload(client, headers, b"\xff\xfe", filename="todos.csv").status_code == 400
+
+def test_each_chunk_is_one_transaction_with_constant_statements(client, headers, monkeypatch, count_queries):
+    monkeypatch.setattr(settings, "todo_import_chunk_size", 5)
+    body = "\n".join(json.dumps({"content": f"todo {i}", "tags": [f"tag {i % 3}"]}) for i in range(10))
+    with count_queries() as counter:
+        summary = upload(client, headers, body).json()
+    assert summary["imported"] == 10 and summary["tags_created"] == 3
+    statements = [s for s in counter.statements if not s.startswith("SELECT users")]
+    # チャンクごとにTodoと関連付けを1文ずつ (executemany を1つのINSERTにまとめる) で挿入する。
+    # タグは1チャンク目で解決・作成され、2チャンク目では読み直さない
+    assert len([s for s in statements if s.startswith('INSERT INTO "Todo"')]) == 2, statements
+    assert len([s for s in statements if s.startswith('INSERT INTO "設定"')]) == 2, statements
+    assert len([s for s in statements if s.startswith('INSERT INTO "Tag"')]) == 1, statements
+    assert len([s for s in statements if s.startswith('SELECT "Tag"')]) == 1, statements
+    # 1チャンク目: 同期用シーケンス、タグのSELECTとINSERT、変更カウンタ (タグ)、Todo、関連付け、変更カウンタ (Todo)
+    # 2チャンク目: 同期用シーケンス、Todo、関連付け、変更カウンタ (Todo)
+    assert len(statements) == 7 + 4 + 2 * write_queue_statements(), statements
+
+@pytest.fixture
+def cli_user(app_engine):
+    """CLIはアプリのDBを使うので、そちらに取り込み先のユーザーを作ります。(テスト後に削除)"""
+    username = f"cli-{uuid.uuid4().hex[:12]}"
+    with app_engine.begin() as connection:
+        user_id = connection.execute(
+            text("INSERT INTO users (username, hashed_password, is_active) VALUES (:name, 'x', 1) RETURNING id"),
+            {"name": username},
+        ).scalar()
+    yield username, user_id
+    with app_engine.begin() as connection:
+        connection.execute(text('DELETE FROM "Todo" WHERE owner_id = :id'), {"id": user_id})
+        connection.execute(text("DELETE FROM users WHERE id = :id"), {"id": user_id})
+
+def test_chunk_is_retried_when_a_tag_is_created_concurrently(client, headers, monkeypatch):
+    monkeypatch.setattr(settings, "todo_import_chunk_size", 1)
+    original = crud._get_or_create_tag_ids
+    calls = []
+
+    async def conflicting(db, owner_id, descriptions, seq):
+        # 2チャンク目の1回目は、タグが一意索引に違反した (別のリクエストが同じ説明で作成した) ことにする
+        calls.append(list(descriptions))
+        result = await original(db, owner_id, descriptions, seq)
+        if len(calls) == 2:
+            raise IntegrityError("INSERT INTO Tag", None, Exception("UNIQUE constraint failed"))
+        return result
+    monkeypatch.setattr(crud, "_get_or_create_tag_ids", conflicting)
+
+    existing = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+    body = "\n".join(json.dumps({"content": f"todo {i}", "tags": ["home", "work"]}) for i in range(2))
+    summary = upload(client, headers, body).json()
+    assert summary["imported"] == 2 and summary["tags_created"] == 1
+    # やり直しでは、1チャンク目で解決済みのものも含めてチャンクのタグをすべて読み直す
+    assert calls == [["home", "work"], [], ["home", "work"]]
+    # 2チャンク目の1回目の書き込みはロールバックされている
+    tags = client.get("/api/tag", headers=headers).json()["items"]
+    assert sorted(t["description"] for t in tags) == ["home", "work"]
+    todos = all_todos(client, headers)
+    assert len(todos) == 2
+    assert all(sorted(t["id"] for t in todo["tags"]) == sorted(t["id"] for t in tags) for todo in todos)
+    assert existing in [t["id"] for t in tags]
+
+def test_cli_imports_a_file(app_engine, cli_user, tmp_path, capsys):
+    username, user_id = cli_user
+    path = tmp_path / "todos.ndjson"
+    path.write_text('{"content": "from the cli"}\n{"content": ""}\n{"oops": 1}\n', encoding="utf-8")
+    with pytest.raises(SystemExit) as exc:
+        cli.main(["import-todos", "--user", username, str(path)])
+    assert exc.value.code == 1 # 失敗した行があれば終了コード1
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["imported"] == 2 and summary["failed"] == 1
+    with app_engine.connect() as connection:
+        rows = connection.execute(text('SELECT "内容" FROM "Todo" WHERE owner_id = :id ORDER BY id'), {"id": user_id}).scalars().all()
+    assert rows == ["from the cli", ""]
+
+def test_cli_needs_an_existing_user(app_engine, tmp_path):
+    path = tmp_path / "todos.ndjson"
+    path.write_text('{"content": "a"}\n', encoding="utf-8")
+    with pytest.raises(SystemExit) as exc:
+        cli.main(["import-todos", "--user", "nobody-at-all", str(path)])
+    assert exc.value.code == "user not found: nobody-at-all"
+
+def test_cli_needs_a_known_format(tmp_path):
+    path = tmp_path / "todos.txt"
+    path.write_text("", encoding="utf-8")
+    with pytest.raises(SystemExit) as exc:
+        cli.main(["import-todos", "--user", "someone", str(path)])
+    assert "format" in str(exc.value.code)
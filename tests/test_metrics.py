@@ -0,0 +1,119 @@
+# tests/test_metrics.py
+"""リクエストごとの計測 (src/metrics.py)、GET /metrics と遅いリクエストのログ。"""
+import logging
+import re
+
+import pytest
+
+from src import metrics, writer
+from src.config import settings
+
+def sample(text: str, name: str, **labels) -> float:
+    """Prometheus のテキストから、name とラベルが一致する行の値を返します。(なければ0)"""
+    for line in text.splitlines():
+        match = re.match(r"(\w+)\{(.*)\} (\S+)$", line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2)))
+        if all(found.get(k) == v for k, v in labels.items()):
+            return float(match.group(3))
+    return 0.0
+
+@pytest.fixture(autouse=True)
+def scrape_from_testclient(monkeypatch):
+    # TestClient のリクエストのクライアントのアドレスは "testclient"
+    monkeypatch.setattr(settings, "metrics_allowed_clients", ["testclient"])
+
+def scrape(client) -> str:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    return response.text
+
+@pytest.fixture
+def instrumented(engine):
+    # テストではアプリのエンジンではなくテスト用のエンジンでSQLが実行される
+    metrics.instrument_engine(engine.sync_engine)
+
+def test_requests_are_labelled_by_route_template(client, headers, instrumented):
+    todo_id = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    before = scrape(client)
+    client.get(f"/api/todo/{todo_id}", headers=headers)
+    client.get("/api/todo/999999", headers=headers)
+    after = scrape(client)
+
+    route = {"method": "GET", "route": "/api/todo/{id}"}
+    assert sample(after, "http_requests_total", status="200", **route) == sample(before, "http_requests_total", status="200", **route) + 1
+    assert sample(after, "http_requests_total", status="404", **route) == sample(before, "http_requests_total", status="404", **route) + 1
+    assert f"/api/todo/{todo_id}" not in after
+    assert sample(after, "http_request_duration_seconds_count", **route) == sample(before, "http_request_duration_seconds_count", **route) + 2
+    # SQLの数と時間も同じルートで記録される
+    assert sample(after, "http_request_sql_statements_sum", **route) > sample(before, "http_request_sql_statements_sum", **route)
+    assert sample(after, "http_request_sql_duration_seconds_count", **route) == sample(before, "http_request_sql_duration_seconds_count", **route) + 2
+
+def test_phases_are_recorded(client, headers):
+    client.get("/login")
+    client.get("/api/todo", headers=headers)
+    text = scrape(client)
+    assert sample(text, "http_request_phase_duration_seconds_count", route="/api/token", phase="password_hash") > 0
+    assert sample(text, "http_request_phase_duration_seconds_count", route="/login", phase="template") > 0
+    assert sample(text, "http_request_phase_duration_seconds_count", route="/api/todo", method="GET", phase="serialize") > 0
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("h", "help", ("route",), (1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(('a"b',), value)
+    assert histogram.render()[2:] == [
+        'h_bucket{route="a\\"b",le="1"} 2',
+        'h_bucket{route="a\\"b",le="5"} 3',
+        'h_bucket{route="a\\"b",le="+Inf"} 4',
+        'h_sum{route="a\\"b"} 14.5',
+        'h_count{route="a\\"b"} 4',
+    ]
+
+def test_phase_outside_a_request_does_nothing():
+    with metrics.phase("auth"):
+        pass
+
+def test_slow_requests_log_their_sql_without_parameters(client, headers, instrumented, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_request_log_ms", 0.001)
+    monkeypatch.setattr(settings, "slow_request_log_max_statements", 1)
+    client.post("/api/todo", json={"content": "secret content"}, headers=headers)
+    # 検索はリクエストの中でSQLを実行する (書き込みはグループコミットではキューのタスクで実行される)
+    with caplog.at_level(logging.WARNING, logger="uvicorn.error"):
+        client.get("/api/todo/search", params={"q": "secret content"}, headers=headers)
+    message = next(r.getMessage() for r in caplog.records if r.getMessage().startswith("slow request: GET /api/todo/search"))
+    assert "-> 200" in message and "sql " in message and "SELECT" in message
+    assert "secret" not in message
+    assert re.search(r"\.\.\. \d+ more statements", message)
+
+def test_slow_request_log_is_off_by_default(client, headers, caplog):
+    with caplog.at_level(logging.WARNING, logger="uvicorn.error"):
+        client.get("/api/todo", headers=headers)
+    assert not any(r.getMessage().startswith("slow request") for r in caplog.records)
+
+def test_metrics_can_be_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_enabled", False)
+    assert client.get("/metrics").status_code == 404
+
+def test_metrics_are_not_public(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_allowed_clients", ["127.0.0.1", "::1"])
+    assert client.get("/metrics").status_code == 404
+    # トークンを設定すれば、許可していないアドレスからも Bearer トークンで読める
+    monkeypatch.setattr(settings, "metrics_token", "scrape-secret")
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 404
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200 and "http_requests_total" in response.text
+
+def test_queued_writes_are_not_counted_as_request_sql(client, headers, instrumented):
+    if not writer.write_queue.running:
+        pytest.skip("グループコミット (WRITE_GROUP_COMMIT) が有効なときだけ")
+    client.get("/api/users/me", headers=headers) # ユーザーをキャッシュして、認証のSQLをなくす
+    route = {"method": "POST", "route": "/api/todo"}
+    before = scrape(client)
+    client.post("/api/todo", json={"content": "a"}, headers=headers)
+    after = scrape(client)
+    write_queue = {"phase": "write_queue", **route}
+    assert sample(after, "http_request_phase_duration_seconds_count", **write_queue) == sample(before, "http_request_phase_duration_seconds_count", **write_queue) + 1
+    # INSERT と変更カウンタは書き込み用のタスクで実行されるので、リクエストのSQLには入らない
+    assert sample(after, "http_request_sql_statements_sum", **route) == sample(before, "http_request_sql_statements_sum", **route)
@@ -0,0 +1,159 @@
+# tests/test_migrations.py
+"""Alembicのマイグレーション。(一時ファイルのSQLite DBに対して実行する)"""
+import sqlite3
+
+import pytest
+from alembic import command
+from sqlalchemy import create_engine
+
+from src import models
+
+def test_association_primary_key_drops_duplicate_and_null_links(migrate):
+    db = migrate("e210cf5ce668")
+    # 主キーの列名はリビジョンによって違うので指定しない (1, 2 が振られる)
+    db.execute('INSERT INTO "Todo" ("内容") VALUES (\'a\'), (\'b\')')
+    db.execute('INSERT INTO "Tag" ("説明") VALUES (\'x\'), (\'y\')')
+    db.execute(
+        'INSERT INTO "設定" (todo_id, tag_id) VALUES (1, 1), (1, 1), (1, 2), (2, 1), (2, NULL), (NULL, 1)'
+    )
+    db.commit()
+    db.close()
+
+    db = migrate("4b8f2c1d9e7a")
+    assert db.execute('SELECT todo_id, tag_id FROM "設定" ORDER BY 1, 2').fetchall() == [(1, 1), (1, 2), (2, 1)]
+    columns = {row[1]: row[5] for row in db.execute('PRAGMA table_info("設定")')} # 名前 -> 主キー内の位置
+    assert columns == {"todo_id": 1, "tag_id": 2}
+    assert "ix_設定_tag_id_todo_id" in {row[1] for row in db.execute('PRAGMA index_list("設定")')}
+    with pytest.raises(sqlite3.IntegrityError):
+        db.execute('INSERT INTO "設定" (todo_id, tag_id) VALUES (1, 1)')
+
+def test_owner_migration_assigns_existing_rows_to_the_first_user(migrate):
+    db = migrate("5b1d7e9a2c46")
+    db.execute("INSERT INTO users (username, hashed_password, is_active) VALUES ('first', 'x', 1), ('second', 'x', 1)")
+    db.execute('INSERT INTO "Todo" ("内容") VALUES (\'a\')')
+    db.execute('INSERT INTO "Tag" ("説明") VALUES (\'x\')')
+    db.commit()
+    db.close()
+
+    db = migrate("8d4f2a6c1e37")
+    (first,) = db.execute("SELECT id FROM users WHERE username = 'first'").fetchone()
+    assert db.execute('SELECT owner_id FROM "Todo"').fetchall() == [(first,)]
+    assert db.execute('SELECT owner_id FROM "Tag"').fetchall() == [(first,)]
+    assert {"ix_Todo_owner_id_id", "ix_Todo_owner_id_完了_期限"} <= {row[1] for row in db.execute('PRAGMA index_list("Todo")')}
+    # 作り直したTodo表でも全文検索の索引が追従する
+    db.execute('INSERT INTO "Todo" ("内容", owner_id) VALUES (\'searchable\', ?)', (first,))
+    db.commit()
+    assert db.execute('SELECT count(*) FROM "Todo_fts" WHERE "Todo_fts" MATCH \'searchable\'').fetchone() == (1,)
+    db.close()
+
+    db = migrate("5b1d7e9a2c46", downgrade=True)
+    assert "owner_id" not in {row[1] for row in db.execute('PRAGMA table_info("Todo")')}
+    assert "ix_Todo_完了_期限" in {row[1] for row in db.execute('PRAGMA index_list("Todo")')}
+
+# 最初のモデルを create_all で作ったDB (Alembicを使う前のもの)。主キーは最初から id で、ユーザーと作成日時もある
+CREATE_ALL_BASELINE = [
+    'CREATE TABLE "Todo" (id INTEGER NOT NULL, "内容" VARCHAR, "期限" VARCHAR, "完了/未完了" BOOLEAN, '
+    '"作成日時" DATETIME DEFAULT (CURRENT_TIMESTAMP), PRIMARY KEY (id))',
+    'CREATE INDEX "ix_Todo_id" ON "Todo" (id)',
+    'CREATE INDEX "ix_Todo_内容" ON "Todo" ("内容")',
+    'CREATE TABLE "Tag" (id INTEGER NOT NULL, "説明" VARCHAR, PRIMARY KEY (id))',
+    'CREATE INDEX "ix_Tag_id" ON "Tag" (id)',
+    'CREATE INDEX "ix_Tag_説明" ON "Tag" ("説明")',
+    'CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR NOT NULL, hashed_password VARCHAR NOT NULL, '
+    'is_active BOOLEAN, PRIMARY KEY (id))',
+    'CREATE INDEX ix_users_id ON users (id)',
+    'CREATE UNIQUE INDEX ix_users_username ON users (username)',
+    'CREATE TABLE "設定" (todo_id INTEGER, tag_id INTEGER, '
+    'FOREIGN KEY(todo_id) REFERENCES "Todo" (id), FOREIGN KEY(tag_id) REFERENCES "Tag" (id))',
+]
+
+def assert_upgraded_data(db):
+    assert db.execute('SELECT id, "内容", "期限" FROM "Todo" ORDER BY id').fetchall() == [
+        (1, "alpha", "2025-10-21"), (2, "bravo", None),
+    ]
+    assert db.execute('SELECT id, "説明" FROM "Tag" ORDER BY id').fetchall() == [(1, "x")]
+    assert db.execute('SELECT todo_id, tag_id FROM "設定"').fetchall() == [(1, 1)]
+    # 全文検索の索引は既存のTodoから作られ、トリガーで追従する
+    assert db.execute('SELECT rowid FROM "Todo_fts" WHERE "Todo_fts" MATCH \'alpha\'').fetchall() == [(1,)]
+    db.execute('INSERT INTO "Todo" ("内容") VALUES (\'searchable\')')
+    db.commit()
+    assert db.execute('SELECT count(*) FROM "Todo_fts" WHERE "Todo_fts" MATCH \'searchable\'').fetchone() == (1,)
+
+def test_upgrade_from_a_create_all_baseline(migrate):
+    db = sqlite3.connect(migrate.path)
+    for statement in CREATE_ALL_BASELINE:
+        db.execute(statement)
+    db.execute("INSERT INTO users (username, hashed_password, is_active) VALUES ('alice', 'x', 1)")
+    db.execute('INSERT INTO "Todo" ("内容", "期限", "完了/未完了") VALUES (\'alpha\', \'2025/10/21\', 0), (\'bravo\', NULL, 1)')
+    db.execute('INSERT INTO "Tag" ("説明") VALUES (\'x\')')
+    db.execute('INSERT INTO "設定" (todo_id, tag_id) VALUES (1, 1)')
+    db.commit()
+    db.close()
+
+    # create_all のDBは e210cf5ce668 に相当するので、そこに stamp してから上げる
+    command.stamp(migrate.config, "e210cf5ce668")
+    db = migrate("head")
+    assert_upgraded_data(db)
+    assert db.execute('SELECT DISTINCT owner_id FROM "Todo" WHERE "内容" IN (\'alpha\', \'bravo\')').fetchall() == [(1,)]
+
+def test_upgrade_from_the_original_primary_key_names(migrate):
+    db = migrate("e210cf5ce668")
+    assert "Todo番号" in {row[1] for row in db.execute('PRAGMA table_info("Todo")')}
+    db.execute('INSERT INTO "Todo" ("内容", "期限", "完了/未完了") VALUES (\'alpha\', \'2025-10-21\', 0), (\'bravo\', NULL, 1)')
+    db.execute('INSERT INTO "Tag" ("説明") VALUES (\'x\')')
+    db.execute('INSERT INTO "設定" (todo_id, tag_id) VALUES (1, 1)')
+    db.commit()
+    db.close()
+
+    db = migrate("a7c2e9f4b180")
+    assert {"id", "内容"} <= {row[1] for row in db.execute('PRAGMA table_info("Todo")')}
+    assert "ix_Todo_id" in {row[1] for row in db.execute('PRAGMA index_list("Todo")')}
+    db.close()
+    assert_upgraded_data(migrate("head"))
+
+def test_association_downgrade_restores_the_surrogate_key(migrate):
+    db = migrate("4b8f2c1d9e7a")
+    db.execute('INSERT INTO "Todo" ("内容") VALUES (\'a\')')
+    db.execute('INSERT INTO "Tag" ("説明") VALUES (\'x\'), (\'y\')')
+    db.execute('INSERT INTO "設定" (todo_id, tag_id) VALUES (1, 1), (1, 2)')
+    db.commit()
+    db.close()
+
+    db = migrate("a7c2e9f4b180", downgrade=True)
+    assert db.execute('SELECT id, todo_id, tag_id FROM "設定" ORDER BY id').fetchall() == [(1, 1, 1), (2, 1, 2)]
+    assert "ix_設定_id" in {row[1] for row in db.execute('PRAGMA index_list("設定")')}
+    db.close()
+
+def fts_schema(db) -> dict:
+    """全文検索の表とトリガーの {名前: 空白を詰めたSQL}。"""
+    rows = db.execute("SELECT name, sql FROM sqlite_master WHERE name LIKE 'Todo_fts%' AND sql IS NOT NULL")
+    return {name: " ".join(sql.split()) for name, sql in rows}
+
+def test_migrated_search_index_matches_the_models(migrate, tmp_path):
+    # Todo表を作り直すマイグレーションの後もトリガーが残り、create_all のDBと同じになる
+    migrated = fts_schema(migrate("head"))
+    assert {"Todo_fts", "Todo_fts_ai", "Todo_fts_ad", "Todo_fts_au"} <= set(migrated)
+    engine = create_engine(f"sqlite:///{tmp_path}/create_all.db")
+    models.Base.metadata.create_all(engine)
+    engine.dispose()
+    assert migrated == fts_schema(sqlite3.connect(tmp_path / "create_all.db"))
+
+def test_full_downgrade_to_base(migrate):
+    migrate("head").close()
+    db = migrate("base", downgrade=True)
+    assert {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")} == {"alembic_version"}
+
+def test_owner_migration_merges_duplicate_tags(migrate):
+    db = migrate("5b1d7e9a2c46")
+    db.execute('INSERT INTO "Todo" ("内容") VALUES (\'a\'), (\'b\')')
+    db.execute('INSERT INTO "Tag" ("説明") VALUES (\'x\'), (\'x\'), (\'y\'), (\'x\')')
+    # 1 は 1 と 2 (同じ x) の両方に、2 は 4 (x) に付いている
+    db.execute('INSERT INTO "設定" (todo_id, tag_id) VALUES (1, 1), (1, 2), (1, 3), (2, 4)')
+    db.commit()
+    db.close()
+
+    db = migrate("8d4f2a6c1e37")
+    assert db.execute('SELECT id, "説明" FROM "Tag" ORDER BY id').fetchall() == [(1, "x"), (3, "y")]
+    assert db.execute('SELECT todo_id, tag_id FROM "設定" ORDER BY 1, 2').fetchall() == [(1, 1), (1, 3), (2, 1)]
+    with pytest.raises(sqlite3.IntegrityError):
+        db.execute('INSERT INTO "Tag" ("説明", owner_id) VALUES (\'z\', 1), (\'z\', 1)')
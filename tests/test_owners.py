@@ -0,0 +1,84 @@
+# tests/test_owners.py
+"""Todoとタグの持ち主 (owner_id)。他のユーザーの行は存在しないものとして扱う。"""
+from src import crud
+
+from .conftest import login
+
+def test_todos_are_isolated_between_users(client, headers):
+    other = login(client, "owner-other")
+    mine = client.post("/api/todo", json={"content": "mine alpha"}, headers=headers).json()["id"]
+    theirs = client.post("/api/todo", json={"content": "theirs alpha"}, headers=other).json()["id"]
+
+    assert [t["id"] for t in client.get("/api/todo", headers=headers).json()["items"]] == [mine]
+    assert [t["id"] for t in client.get("/api/todo/search", params={"q": "alpha"}, headers=headers).json()["items"]] == [mine]
+    assert [t["id"] for t in client.get("/api/sync", params={"since": 0}, headers=headers).json()["todos"]] == [mine]
+    assert "theirs" not in client.get("/api/todo/export", headers=headers).text
+
+    # 他のユーザーのTodoは読めず、変更も削除もできない (404)
+    assert client.get(f"/api/todo/{theirs}", headers=headers).status_code == 404
+    assert client.put(f"/api/todo/{theirs}", json={"content": "x"}, headers=headers).status_code == 404
+    assert client.put(f"/api/todo/{theirs}/toggle", headers=headers).status_code == 404
+    assert client.delete(f"/api/todo/{theirs}", headers=headers).status_code == 404
+    batch = client.post("/api/todo/batch", json={"operations": [{"op": "delete", "id": theirs}]}, headers=headers)
+    assert batch.status_code == 409
+    assert client.get(f"/api/todo/{theirs}", headers=other).json()["content"] == "theirs alpha"
+
+def test_tags_are_isolated_between_users(client, headers):
+    other = login(client, "owner-tags")
+    todo_id = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    mine = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+    # 説明はユーザーごとに一意なので、同じ説明のタグを作れる
+    response = client.post("/api/tag", json={"description": "home"}, headers=other)
+    assert response.status_code == 201
+    theirs = response.json()["id"]
+
+    assert [t["id"] for t in client.get("/api/tag", headers=headers).json()["items"]] == [mine]
+    assert client.get(f"/api/tag/{theirs}", headers=headers).status_code == 404
+    assert client.get(f"/api/tag/{theirs}/todos", headers=headers).status_code == 404
+    assert client.delete(f"/api/tag/{theirs}", headers=headers).status_code == 404
+    # 他のユーザーのタグは付けられない
+    assert client.post(f"/api/todo/{todo_id}/tags/{theirs}", headers=headers).status_code == 404
+    assert client.get(f"/api/todo/{todo_id}", headers=headers).json()["tags"] == []
+
+def test_list_etags_differ_between_users(client, headers):
+    other = login(client, "owner-etag")
+    mine = client.get("/api/todo", headers=headers)
+    theirs = client.get("/api/todo", headers=other)
+    assert mine.headers["ETag"] != theirs.headers["ETag"]
+    assert client.get("/api/todo", headers={**other, "If-None-Match": mine.headers["ETag"]}).status_code == 200
+
+def test_html_pages_use_the_cookie_token(client, headers):
+    todo_id = client.post("/api/todo", json={"content": "page todo"}, headers=headers).json()["id"]
+    assert "page todo" in client.get(f"/todo/{todo_id}").text
+
+    client.cookies.clear()
+    response = client.get(f"/todo/{todo_id}", follow_redirects=False)
+    assert response.status_code == 303 and response.headers["location"] == "/login"
+    client.cookies.set("todo_access_token", "not-a-token")
+    assert client.get(f"/todo/{todo_id}", follow_redirects=False).status_code == 303
+
+    login(client, "owner-page") # Cookieは別のユーザーのトークンになる
+    assert client.get(f"/todo/{todo_id}").status_code == 404
+
+async def skip_check(db, owner_id, description, tag_id=None):
+    pass
+
+def test_duplicate_tags_are_refused_by_the_unique_index(client, headers, monkeypatch):
+    tag_id = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+    other_id = client.post("/api/tag", json={"description": "work"}, headers=headers).json()["id"]
+    todo_id = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    # 書き込みの中の確認をすり抜けた (別のワーカーで同時に作成された) 場合も、一意索引で400になる
+    monkeypatch.setattr(crud, "_check_description_free", skip_check)
+
+    response = client.post("/api/tag", json={"description": "home"}, headers=headers)
+    assert response.status_code == 400 and "already exists" in response.text
+    response = client.put(f"/api/tag/{other_id}", json={"description": "home"}, headers=headers)
+    assert response.status_code == 400 and "already exists" in response.text
+    # HTMLのフォームは作成済みとして扱う
+    response = client.post("/tag/create/from-page", data={"description": "home", "todo_id": todo_id}, follow_redirects=False)
+    assert response.status_code == 303
+
+    tags = client.get("/api/tag", headers=headers).json()["items"]
+    assert [(t["id"], t["description"]) for t in tags] == [(tag_id, "home"), (other_id, "work")]
+    # 失敗した書き込みの後も、同じセッションで書き込める
+    assert client.post("/api/tag", json={"description": "new"}, headers=headers).status_code == 201
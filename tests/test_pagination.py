@@ -0,0 +1,81 @@
+# tests/test_pagination.py
+"""GET /api/todo と GET /api/tag のキーセットページング。"""
+from src import crud
+
+def create_todos(client, headers, contents):
+    ids = []
+    for content in contents:
+        response = client.post("/api/todo", json={"content": content}, headers=headers)
+        assert response.status_code == 201, response.text
+        ids.append(response.json()["id"])
+    return ids
+
+def fetch_all(client, headers, path, **params):
+    """next_cursor をたどって全ページを取得し、(項目, ページ数) を返します。"""
+    items, pages, cursor = [], 0, None
+    while True:
+        query = dict(params, **({"cursor": cursor} if cursor else {}))
+        response = client.get(path, params=query, headers=headers)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        items += body["items"]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+def test_pages_follow_cursor_in_id_order(client, headers):
+    ids = create_todos(client, headers, [f"todo {i}" for i in range(5)])
+    first = client.get("/api/todo", params={"limit": 2}, headers=headers).json()
+    assert [t["id"] for t in first["items"]] == ids[:2]
+    assert first["next_cursor"] is not None
+
+    items, pages = fetch_all(client, headers, "/api/todo", limit=2)
+    assert [t["id"] for t in items] == ids
+    assert pages == 3
+
+def test_no_row_cap_beyond_first_hundred(client, headers):
+    ids = create_todos(client, headers, [f"todo {i}" for i in range(crud.DEFAULT_PAGE_SIZE * 2 + 5)])
+    items, pages = fetch_all(client, headers, "/api/todo")
+    assert [t["id"] for t in items] == ids
+    assert pages == 3
+
+def test_sort_by_content_breaks_ties_by_id(client, headers):
+    ids = create_todos(client, headers, ["b", "a", "b", "a", "c"])
+    items, _ = fetch_all(client, headers, "/api/todo", limit=2, order_by="content")
+    assert [(t["content"], t["id"]) for t in items] == sorted(zip(["b", "a", "b", "a", "c"], ids))
+
+def test_insert_between_pages_does_not_shift_results(client, headers):
+    ids = create_todos(client, headers, ["b", "d", "f"])
+    first = client.get("/api/todo", params={"limit": 2, "order_by": "content"}, headers=headers).json()
+    # 1ページ目より前に並ぶ項目を挿入しても、2ページ目は続きから始まる
+    create_todos(client, headers, ["a"])
+    second = client.get(
+        "/api/todo", params={"limit": 2, "order_by": "content", "cursor": first["next_cursor"]}, headers=headers
+    ).json()
+    assert [t["id"] for t in first["items"] + second["items"]] == ids
+
+def test_invalid_cursor_is_rejected(client, headers):
+    create_todos(client, headers, ["a", "b", "c"])
+    response = client.get("/api/todo", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+    # 別の並び順のカーソルは使えない
+    cursor = client.get("/api/todo", params={"limit": 1, "order_by": "content"}, headers=headers).json()["next_cursor"]
+    response = client.get("/api/todo", params={"cursor": cursor, "order_by": "id"}, headers=headers)
+    assert response.status_code == 400
+
+def test_page_size_is_capped(client, headers):
+    response = client.get("/api/todo", params={"limit": crud.MAX_PAGE_SIZE + 1}, headers=headers)
+    assert response.status_code == 422
+    response = client.get("/api/todo", params={"limit": 0}, headers=headers)
+    assert response.status_code == 422
+
+def test_tag_pages(client, headers):
+    descriptions = ["work", "home", "errand"]
+    for description in descriptions:
+        response = client.post("/api/tag", json={"description": description}, headers=headers)
+        assert response.status_code == 201, response.text
+    items, pages = fetch_all(client, headers, "/api/tag", limit=2, order_by="description")
+    assert [t["description"] for t in items] == sorted(descriptions)
+    assert pages == 2
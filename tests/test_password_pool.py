@@ -0,0 +1,60 @@
+# tests/test_password_pool.py
+"""bcrypt を上限付きのワーカープールで実行すること。"""
+import asyncio
+import threading
+
+import pytest
+
+from src import security
+
+def test_hashing_runs_on_the_pool_threads():
+    async def run():
+        hashed = await security.get_password_hash_async("pw")
+        thread_name = await security.password_hash_pool.run(lambda: threading.current_thread().name)
+        return (
+            await security.verify_password_async("pw", hashed),
+            await security.verify_password_async("other", hashed),
+            thread_name,
+        )
+
+    ok, wrong, thread_name = asyncio.run(run())
+    assert ok is True and wrong is False
+    assert thread_name.startswith("password-hash")
+
+def test_saturated_pool_rejects_instead_of_queueing():
+    pool = security.PasswordHashPool(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def run():
+        # 実行中1件 + 待ち1件で満杯になる
+        in_flight = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(security.PasswordHashPoolSaturated):
+            await pool.run(release.wait)
+        stats = pool.stats()
+        release.set()
+        await asyncio.gather(*in_flight)
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 1 and stats["queued"] == 1 and stats["rejected"] == 1
+    assert pool.stats()["completed"] == 2
+    # 空いたら再び受け付ける
+    assert asyncio.run(pool.run(lambda: "ok")) == "ok"
+
+def test_login_returns_503_when_the_pool_is_saturated(client, headers, monkeypatch):
+    client.post("/api/users/register", json={"username": "busy", "password": "pw"})
+
+    async def saturated(*args):
+        raise security.PasswordHashPoolSaturated("password hash pool is saturated")
+
+    monkeypatch.setattr(security, "verify_password_async", saturated)
+    response = client.post("/api/token", data={"username": "busy", "password": "pw"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+def test_pool_stats_endpoint(client, headers):
+    assert client.get("/api/security/password-pool").status_code == 401
+    stats = client.get("/api/security/password-pool", headers=headers).json()
+    assert stats["max_workers"] == security.PASSWORD_HASH_WORKERS
+    assert stats["completed"] >= 2 # 登録とログイン
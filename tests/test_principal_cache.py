@@ -0,0 +1,123 @@
+# tests/test_principal_cache.py
+"""get_current_user の認証済みユーザー (principal) のキャッシュ。"""
+import time
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from src import cli, crud
+from src.cache import TTLCache, cache_principal, principal_cache, tag_cache
+
+from .conftest import login
+
+@pytest.fixture(autouse=True)
+def empty_principal_cache():
+    principal_cache.clear()
+    yield
+    principal_cache.clear()
+
+def test_cached_token_skips_verification_and_lookup(client, headers, count_queries):
+    with count_queries() as first:
+        assert client.get("/api/users/me", headers=headers).status_code == 200
+    with count_queries() as second:
+        assert client.get("/api/users/me", headers=headers).status_code == 200
+    assert first.count == 1 # users表の検索
+    assert second.count == 0
+    stats = client.get("/api/security/principal-cache", headers=headers).json()
+    assert stats["entries"] == 1 and stats["hits"] >= 2
+
+def test_invalid_token_is_not_cached(client):
+    response = client.get("/api/users/me", headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
+    assert principal_cache.stats()["entries"] == 0
+
+def test_entry_never_outlives_token_exp():
+    cache_principal("expired", object(), expires_at=time.time() - 1)
+    assert principal_cache.get("expired") is None
+    cache_principal("short", object(), expires_at=time.time() + 0.05)
+    assert principal_cache.get("short") is not None
+    time.sleep(0.1)
+    assert principal_cache.get("short") is None
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    assert cache.get("a") == 1
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_deactivated_user_is_dropped_from_cache(client, headers, run_db):
+    user_id = client.get("/api/users/me", headers=headers).json()["id"]
+    assert principal_cache.stats()["entries"] == 1
+
+    run_db(lambda db: crud.set_user_active(db, user_id, False))
+    assert principal_cache.stats()["entries"] == 0
+    response = client.get("/api/users/me", headers=headers)
+    assert response.status_code == 400
+    assert "Inactive user" in response.text
+
+def test_deleting_me_removes_owned_rows_and_cached_principal(client, headers, user_id, run_db):
+    other = login(client, f"other-{uuid.uuid4().hex[:12]}")
+    tag_id = client.post("/api/tag", json={"description": "mine"}, headers=headers).json()["id"]
+    todo_id = client.post("/api/todo", json={"content": "mine"}, headers=headers).json()["id"]
+    assert client.post(f"/api/todo/{todo_id}/tags/{tag_id}", headers=headers).status_code == 200
+    deleted = client.post("/api/todo", json={"content": "gone"}, headers=headers).json()["id"]
+    assert client.delete(f"/api/todo/{deleted}", headers=headers).status_code == 200 # 墓標を残す
+    other_todo = client.post("/api/todo", json={"content": "theirs"}, headers=other).json()["id"]
+    assert client.get(f"/api/tag/{tag_id}", headers=headers).status_code == 200 # タグをキャッシュに載せる
+
+    assert client.delete("/api/users/me", headers=headers).status_code == 204
+    assert principal_cache.stats()["entries"] == 1 # other のものだけ
+    assert client.get("/api/users/me", headers=headers).status_code == 401
+    assert tag_cache.get_by_id(tag_id) == (False, None)
+    async def leftovers(db):
+        counts = {}
+        for table in ("Todo", "Tag", "sync_tombstone"):
+            stmt = text(f'SELECT count(*) FROM "{table}" WHERE owner_id = :id')
+            counts[table] = (await db.execute(stmt, {"id": user_id})).scalar()
+        counts["設定"] = (await db.execute(text('SELECT count(*) FROM "設定"'))).scalar()
+        return counts
+    assert run_db(leftovers) == {"Todo": 0, "Tag": 0, "sync_tombstone": 0, "設定": 0}
+    assert client.get(f"/api/todo/{other_todo}", headers=other).status_code == 200
+
+@pytest.fixture
+def cli_user(app_engine):
+    """CLIはアプリのDBを使うので、そちらにユーザーを作ります。(テスト後に削除)"""
+    username = f"cli-{uuid.uuid4().hex[:12]}"
+    with app_engine.begin() as connection:
+        user_id = connection.execute(
+            text("INSERT INTO users (username, hashed_password, is_active) VALUES (:name, 'x', 1) RETURNING id"),
+            {"name": username},
+        ).scalar()
+    yield username, user_id
+    with app_engine.begin() as connection:
+        connection.execute(text('DELETE FROM "Todo" WHERE owner_id = :id'), {"id": user_id})
+        connection.execute(text("DELETE FROM users WHERE id = :id"), {"id": user_id})
+
+def test_cli_deactivates_and_reactivates_a_user(app_engine, cli_user, capsys):
+    username, user_id = cli_user
+    def is_active():
+        with app_engine.connect() as connection:
+            return connection.execute(text("SELECT is_active FROM users WHERE id = :id"), {"id": user_id}).scalar()
+    cli.main(["set-user-active", "--user", username, "--inactive"])
+    assert capsys.readouterr().out == f"{username} deactivated\n"
+    assert not is_active()
+    cli.main(["set-user-active", "--user", username, "--active"])
+    assert is_active()
+
+def test_cli_deletes_a_user_with_their_todos(app_engine, cli_user, capsys):
+    username, user_id = cli_user
+    with app_engine.begin() as connection:
+        connection.execute(text('INSERT INTO "Todo" ("内容", owner_id) VALUES (\'x\', :id)'), {"id": user_id})
+    cli.main(["delete-user", "--user", username])
+    assert capsys.readouterr().out == f"{username} deleted\n"
+    with app_engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM users WHERE id = :id"), {"id": user_id}).scalar() == 0
+        assert connection.execute(text('SELECT count(*) FROM "Todo" WHERE owner_id = :id'), {"id": user_id}).scalar() == 0
+    with pytest.raises(SystemExit) as exc:
+        cli.main(["delete-user", "--user", username])
+    assert exc.value.code == f"user not found: {username}"
@@ -0,0 +1,71 @@
+# tests/test_query_counts.py
+"""
+読み込みのクエリ数がTodoやタグの件数で増えないこと (N+1 になっていないこと) を確認します。
+キャッシュを空にしてから数えるので、キャッシュが効かない場合の件数です。
+"""
+import pytest
+
+from src.cache import fragment_cache, principal_cache, tag_cache
+
+SIZES = [(1, 1), (30, 8)] # (Todoの件数, 各Todoに付けるタグの件数)
+
+def seed(client, headers, todos: int, tags: int) -> int:
+    """タグとTodoを作って、すべてのTodoにすべてのタグを付けます。最後に作ったTodoのIDを返します。"""
+    tag_ids = []
+    for i in range(tags):
+        response = client.post("/api/tag", json={"description": f"tag {i}"}, headers=headers)
+        assert response.status_code == 201, response.text
+        tag_ids.append(response.json()["id"])
+    todo_id = None
+    for i in range(todos):
+        response = client.post("/api/todo", json={"content": f"todo {i}"}, headers=headers)
+        assert response.status_code == 201, response.text
+        todo_id = response.json()["id"]
+        for tag_id in tag_ids:
+            response = client.post(f"/api/todo/{todo_id}/tags/{tag_id}", headers=headers)
+            assert response.status_code == 200, response.text
+    return todo_id
+
+def clear_caches():
+    """プロセス内のキャッシュをすべて捨てます。"""
+    principal_cache.clear()
+    tag_cache.clear()
+    fragment_cache.clear()
+
+def request_queries(client, count_queries, path: str, **kwargs):
+    clear_caches()
+    with count_queries() as counter:
+        response = client.get(path, **kwargs)
+    assert response.status_code == 200, response.text
+    return response, counter
+
+@pytest.mark.parametrize("todos,tags", SIZES)
+def test_list_todos(client, headers, count_queries, todos, tags):
+    seed(client, headers, todos, tags)
+    response, counter = request_queries(client, count_queries, "/api/todo", headers=headers)
+    assert len(response.json()["items"]) == todos
+    assert all(len(item["tags"]) == tags for item in response.json()["items"])
+    # ユーザー、ETag用の変更カウンタ、Todoの1ページ、そのページのタグ
+    assert counter.count == 4, counter.statements
+
+@pytest.mark.parametrize("todos,tags", SIZES)
+def test_get_todo(client, headers, count_queries, todos, tags):
+    todo_id = seed(client, headers, todos, tags)
+    response, counter = request_queries(client, count_queries, f"/api/todo/{todo_id}", headers=headers)
+    assert len(response.json()["tags"]) == tags
+    # ユーザー、ETag用のバージョン、Todo、そのタグ
+    assert counter.count == 4, counter.statements
+
+@pytest.mark.parametrize("todos,tags", SIZES)
+def test_todo_detail_page(client, headers, count_queries, todos, tags):
+    todo_id = seed(client, headers, todos, tags)
+    _, counter = request_queries(client, count_queries, f"/todo/{todo_id}")
+    # ユーザー (Cookieのトークン)、Todo、そのタグ
+    assert counter.count == 3, counter.statements
+
+@pytest.mark.parametrize("todos,tags", SIZES)
+def test_manage_tags_page(client, headers, count_queries, todos, tags):
+    todo_id = seed(client, headers, todos, tags)
+    _, counter = request_queries(client, count_queries, f"/todo/{todo_id}/manage-tags")
+    # ユーザー (Cookieのトークン)、Todo、そのタグ、タグ選択欄のキャッシュキー用の変更カウンタ、すべてのタグ
+    assert counter.count == 5, counter.statements
@@ -0,0 +1,88 @@
+# tests/test_read_write_split.py
+"""SQLiteの読み込み専用の接続と書き込み用の接続の分離 (DB_READ_WRITE_SPLIT)。"""
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+from src import models
+from src.config import settings
+from src.main import app
+
+def test_read_only_url():
+    assert models.to_read_only_url("sqlite+aiosqlite:////tmp/todo.db") == "sqlite+aiosqlite:///file:/tmp/todo.db?mode=ro&uri=true"
+    assert models.to_read_only_url("sqlite+aiosqlite:///./my todo.db") == "sqlite+aiosqlite:///file:./my%20todo.db?mode=ro&uri=true"
+    # すでにURIファイル名なら mode=ro を足すだけ
+    assert models.to_read_only_url("sqlite+aiosqlite:///file:todo.db?uri=true") == "sqlite+aiosqlite:///file:todo.db?mode=ro&uri=true"
+
+def test_split_only_applies_to_file_backed_sqlite(monkeypatch):
+    assert models.uses_read_write_split("sqlite+aiosqlite:///./todo.db")
+    assert not models.uses_read_write_split("sqlite+aiosqlite://")
+    assert not models.uses_read_write_split("sqlite+aiosqlite:///:memory:")
+    assert not models.uses_read_write_split("sqlite+aiosqlite:///file:mem?mode=memory&uri=true")
+    assert not models.uses_read_write_split("postgresql+asyncpg://u@db/todo")
+    monkeypatch.setattr(settings, "db_read_write_split", False)
+    assert not models.uses_read_write_split("sqlite+aiosqlite:///./todo.db")
+
+def test_pool_sizes_per_role():
+    writer = models.engine_options("sqlite+aiosqlite:///x.db", role="write")
+    assert writer["pool_size"] == settings.sqlite_writer_pool_size and writer["max_overflow"] == 0
+    assert models.engine_options("sqlite+aiosqlite:///x.db", role="read")["pool_size"] == settings.sqlite_reader_pool_size
+
+@pytest.fixture
+def app_client(app_engine):
+    """get_db を差し替えずに、アプリのDB (読み書きを分けたエンジン) を使うクライアント。"""
+    with TestClient(app) as client:
+        yield client
+
+class EngineLog:
+    """どちらのエンジンでSQL文が実行されたかを記録します。"""
+    def __init__(self):
+        self.roles = []
+
+    def __enter__(self):
+        self.listeners = [
+            (models.async_engine.sync_engine, lambda *args: self.roles.append("write")),
+            (models.async_read_engine.sync_engine, lambda *args: self.roles.append("read")),
+        ]
+        for engine, listener in self.listeners:
+            event.listen(engine, "before_cursor_execute", listener)
+        return self
+
+    def __exit__(self, *exc):
+        for engine, listener in self.listeners:
+            event.remove(engine, "before_cursor_execute", listener)
+
+def test_requests_use_the_session_for_their_method(app_client):
+    assert models.async_read_engine is not models.async_engine
+    username = f"split-{uuid.uuid4().hex[:12]}"
+    assert app_client.post("/api/users/register", json={"username": username, "password": "pw"}).status_code == 201
+    with EngineLog() as log:
+        token = app_client.post("/api/token", data={"username": username, "password": "pw"}).json()["access_token"]
+    # ログインはユーザーを読むだけなので @db_access("read") で読み込み用
+    assert set(log.roles) == {"read"}
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with EngineLog() as log:
+        todo_id = app_client.post("/api/todo", json={"content": "split"}, headers=headers).json()["id"]
+    assert "write" in log.roles and "read" not in log.roles
+    with EngineLog() as log:
+        assert app_client.get(f"/api/todo/{todo_id}", headers=headers).json()["content"] == "split"
+        assert app_client.get("/api/todo/export", headers=headers).status_code == 200
+    assert set(log.roles) == {"read"}
+
+async def try_write():
+    async with models.async_read_engine.connect() as connection:
+        await connection.execute(text('DELETE FROM "Todo"'))
+
+def test_read_connections_refuse_writes(app_client):
+    with pytest.raises(OperationalError, match="readonly|read-only|query_only"):
+        app_client.portal.call(try_write)
+
+def test_without_split_both_sessions_share_one_engine(app_engine, monkeypatch):
+    monkeypatch.setattr(settings, "db_read_write_split", False)
+    with TestClient(app):
+        assert models.async_read_engine is models.async_engine
+    assert models.async_read_engine is None
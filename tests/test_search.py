@@ -0,0 +1,78 @@
+# tests/test_search.py
+"""GET /api/todo/search (SQLite FTS5、trigramトークナイザ)。"""
+from sqlalchemy import text
+
+from src import cli
+
+def create_todos(client, headers, contents):
+    return [
+        client.post("/api/todo", json={"content": content}, headers=headers).json()["id"]
+        for content in contents
+    ]
+
+def search(client, headers, q, **params):
+    response = client.get("/api/todo/search", params={"q": q, **params}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def found_ids(client, headers, q):
+    return sorted(todo["id"] for todo in search(client, headers, q)["items"])
+
+def test_terms_match_as_substrings_and_are_anded(client, headers):
+    milk, bread, both = create_todos(client, headers, ["牛乳を買う", "パンを買う", "牛乳とパンを買いに行く"])
+    assert found_ids(client, headers, "牛乳を") == [milk]
+    assert found_ids(client, headers, "を買う") == [milk, bread]
+    assert found_ids(client, headers, "牛乳と パンを") == [both]
+    assert found_ids(client, headers, "存在しない") == []
+
+def test_short_terms_fall_back_to_like(client, headers):
+    milk, bread = create_todos(client, headers, ["牛乳を買う", "パンを買う"])
+    assert found_ids(client, headers, "牛乳") == [milk]
+    assert found_ids(client, headers, "買う パン") == [bread]
+    # LIKE の特殊文字はエスケープされる
+    assert found_ids(client, headers, "%") == []
+
+def test_index_follows_updates_deletes_and_batches(client, headers):
+    first, second = create_todos(client, headers, ["write report", "call mother"])
+    client.put(f"/api/todo/{first}", json={"content": "write letter"}, headers=headers)
+    client.delete(f"/api/todo/{second}", headers=headers)
+    response = client.post("/api/todo/batch", json={"operations": [{"op": "create", "content": "report draft"}]}, headers=headers)
+    created = response.json()["results"][0]["id"]
+
+    assert found_ids(client, headers, "report") == [created]
+    assert found_ids(client, headers, "letter") == [first]
+    assert found_ids(client, headers, "mother") == []
+
+def test_fts_syntax_in_the_query_is_not_interpreted(client, headers):
+    quoted, = create_todos(client, headers, ['say "hello" OR bye'])
+    assert found_ids(client, headers, '"hello"') == [quoted]
+    assert found_ids(client, headers, "hello OR nothing") == []
+    assert found_ids(client, headers, "NEAR(") == []
+
+def test_results_are_paged_by_rank(client, headers):
+    ids = create_todos(client, headers, [f"task number {i}" for i in range(5)])
+    seen, cursor = [], None
+    while True:
+        page = search(client, headers, "task", limit=2, **({"cursor": cursor} if cursor else {}))
+        seen += [todo["id"] for todo in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(seen) == ids and len(seen) == len(set(seen))
+    response = client.get("/api/todo/search", params={"q": "task", "cursor": "broken"}, headers=headers)
+    assert response.status_code == 400
+
+def test_cli_rebuilds_the_index(app_engine, capsys):
+    # CLIはアプリのDBを使う
+    with app_engine.begin() as connection:
+        todo_id = connection.execute(text('INSERT INTO "Todo" ("内容") VALUES (\'rebuild me\') RETURNING id')).scalar()
+        connection.execute(text('INSERT INTO "Todo_fts"("Todo_fts") VALUES (\'delete-all\')'))
+    try:
+        cli.main(["rebuild-search-index"])
+        assert "search index rebuilt" in capsys.readouterr().out
+        with app_engine.connect() as connection:
+            hits = connection.execute(text('SELECT rowid FROM "Todo_fts" WHERE "Todo_fts" MATCH \'"rebuild"\'')).all()
+        assert hits == [(todo_id,)]
+    finally:
+        with app_engine.begin() as connection:
+            connection.execute(text('DELETE FROM "Todo" WHERE id = :id'), {"id": todo_id})
@@ -0,0 +1,59 @@
+# tests/test_serialization.py
+"""orjson でのレスポンスと、一覧APIの行ベースの高速経路 (schemas と同じ形の辞書を返すこと)。"""
+import pytest
+
+from src import crud, schemas
+
+def seed(client, headers):
+    tag_ids = [
+        client.post("/api/tag", json={"description": d}, headers=headers).json()["id"]
+        for d in ("仕事", "home")
+    ]
+    ids = [
+        client.post("/api/todo", json={"content": "牛乳を買う", "due_date": "2026-02-03"}, headers=headers).json()["id"],
+        client.post("/api/todo", json={"content": "no tags"}, headers=headers).json()["id"],
+    ]
+    client.post(f"/api/todo/{ids[0]}/tags", json={"tag_ids": tag_ids}, headers=headers)
+    client.put(f"/api/todo/{ids[1]}/toggle", headers=headers)
+    return ids, tag_ids
+
+def test_todo_list_items_match_the_validated_single_item(client, headers):
+    ids, _ = seed(client, headers)
+    response = client.get("/api/todo", headers=headers)
+    assert response.headers["content-type"] == "application/json"
+    # orjson はASCII以外をエスケープしない
+    assert "牛乳を買う".encode("utf-8") in response.content
+    items = response.json()["items"]
+    for item in items:
+        single = client.get(f"/api/todo/{item['id']}", headers=headers).json()
+        assert list(item) == list(single)
+        assert item == single
+        assert schemas.Todo.model_validate(item).model_dump(mode="json") == item
+    assert items[0]["due_date"] == "2026-02-03" and items[1]["due_date"] is None
+
+def test_tag_lists_match_their_schemas(client, headers):
+    ids, tag_ids = seed(client, headers)
+    page = client.get("/api/tag", headers=headers).json()
+    assert schemas.TagPage.model_validate(page).model_dump(mode="json") == page
+    assert [item["todo_count"] for item in page["items"]] == [1, 1]
+
+    page = client.get(f"/api/tag/{tag_ids[0]}/todos", headers=headers).json()
+    assert schemas.TagTodoPage.model_validate(page).model_dump(mode="json") == page
+    assert [todo["id"] for todo in page["items"]] == [ids[0]]
+
+def test_row_fast_path_matches_the_orm_path(client, headers, user_id, run_db):
+    seed(client, headers)
+
+    async def both(db):
+        rows, rows_cursor = await crud.get_todo_rows(db, user_id, limit=1)
+        todos, todos_cursor = await crud.get_todos(db, user_id, limit=1)
+        return rows, rows_cursor, todos, todos_cursor
+
+    rows, rows_cursor, todos, todos_cursor = run_db(both)
+    assert rows_cursor == todos_cursor
+    assert rows == [schemas.Todo.model_validate(todo).model_dump() for todo in todos]
+
+def test_list_response_model_is_still_documented(client):
+    schema = client.get("/openapi.json").json()
+    ok = schema["paths"]["/api/todo"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert ok == {"$ref": "#/components/schemas/TodoPage"}
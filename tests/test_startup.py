@@ -0,0 +1,64 @@
+# tests/test_startup.py
+"""インポート時に副作用がないこと、lifespan でのエンジン・スキーマの準備 (SCHEMA_MODE)。"""
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import models, schema
+from src.config import settings
+from src.main import app
+
+from .conftest import ROOT
+
+def test_importing_the_app_does_not_touch_the_database(tmp_path):
+    path = tmp_path / "untouched.db"
+    code = "import src.main, src.models as m; assert m.engine is None and m.async_engine is None"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True)
+    assert not path.exists()
+
+def test_lifespan_creates_and_disposes_engines_and_templates():
+    assert models.engine is None
+    with TestClient(app) as client:
+        assert models.engine is not None and models.async_engine is not None
+        assert app.state.templates is not None
+        assert client.get("/login").status_code == 200
+    assert models.engine is None and models.async_engine is None
+
+@pytest.fixture
+def alembic_mode(monkeypatch, migrate):
+    """schema_mode="alembic" で、アプリのDBを migrate の一時DBに向けます。"""
+    monkeypatch.setattr(settings, "schema_mode", "alembic")
+    monkeypatch.setattr(settings, "alembic_config", str(ROOT / "alembic.ini"))
+    url = f"sqlite:///{migrate.path}"
+    monkeypatch.setattr(models, "SQLALCHEMY_DATABASE_URL", url)
+    monkeypatch.setattr(models, "ASYNC_SQLALCHEMY_DATABASE_URL", models.to_async_url(url))
+    return migrate
+
+def test_alembic_mode_refuses_a_database_that_is_not_at_head(alembic_mode):
+    alembic_mode("base")
+    with pytest.raises(schema.SchemaNotAtHeadError, match="no revision"):
+        with TestClient(app):
+            pass
+    # 起動に失敗してもエンジンは閉じる
+    assert models.engine is None
+    # create_all でテーブルを作ったりはしない
+    tables = {row[0] for row in sqlite3.connect(alembic_mode.path).execute("SELECT name FROM sqlite_master")}
+    assert "Todo" not in tables
+
+def test_alembic_upgrade_head_builds_the_schema_the_app_needs(alembic_mode):
+    alembic_mode("head").close()
+    with TestClient(app) as client:
+        response = client.post("/api/users/register", json={"username": "alice", "password": "pw"})
+        assert response.status_code == 201, response.text
+        token = client.post("/api/token", data={"username": "alice", "password": "pw"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        tag_id = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+        todo = client.post("/api/todo", json={"content": "牛乳を買う", "due_date": "2026-01-01"}, headers=headers).json()
+        client.post(f"/api/todo/{todo['id']}/tags/{tag_id}", headers=headers)
+        assert client.get("/api/todo/search", params={"q": "牛乳を"}, headers=headers).json()["items"][0]["id"] == todo["id"]
+        assert client.get("/api/todo", headers=headers).json()["items"][0]["tags"][0]["id"] == tag_id
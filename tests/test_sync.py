@@ -0,0 +1,116 @@
+# tests/test_sync.py
+"""GET /api/sync (変更シーケンスと墓標による差分同期) と墓標の圧縮。"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from src import cli, crud
+
+def sync(client, headers, since=0, **params):
+    response = client.get("/api/sync", params={"since": since, **params}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def ids(rows):
+    return [row["id"] for row in rows]
+
+def test_full_then_delta_sync(client, headers):
+    tag_id = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+    a = client.post("/api/todo", json={"content": "a", "due_date": "2026-01-01"}, headers=headers).json()["id"]
+    b = client.post("/api/todo", json={"content": "b"}, headers=headers).json()["id"]
+    client.post(f"/api/todo/{a}/tags/{tag_id}", headers=headers)
+
+    full = sync(client, headers)
+    assert full["since"] == 0 and full["has_more"] is False
+    assert ids(full["todos"]) == [b, a] # change_seq の順 (a はタグの付与で更新されている)
+    assert full["todos"][1]["due_date"] == "2026-01-01" and full["todos"][1]["version"] == 2
+    assert ids(full["tags"]) == [tag_id]
+    assert [(l["todo_id"], l["tag_id"]) for l in full["links"]] == [(a, tag_id)]
+    assert full["tombstones"] == []
+
+    # 変更がなければ空で、next_since は変わらない
+    since = full["next_since"]
+    assert sync(client, headers, since) == {
+        "since": since, "next_since": since, "has_more": False, "todos": [], "tags": [], "links": [], "tombstones": [],
+    }
+
+    client.put(f"/api/todo/{b}/toggle", headers=headers)
+    client.delete(f"/api/todo/{a}/tags", params={"tag_id": [tag_id]}, headers=headers)
+    delta = sync(client, headers, since)
+    assert ids(delta["todos"]) == [b, a]
+    assert delta["todos"][0]["is_completed"] is True
+    assert delta["tags"] == [] and delta["links"] == []
+    assert [(t["entity"], t["id"], t["tag_id"]) for t in delta["tombstones"]] == [("todo_tag", a, tag_id)]
+
+def test_deletes_become_tombstones(client, headers):
+    tag_id = client.post("/api/tag", json={"description": "home"}, headers=headers).json()["id"]
+    a = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    b = client.post("/api/todo", json={"content": "b"}, headers=headers).json()["id"]
+    client.post(f"/api/todo/{a}/tags/{tag_id}", headers=headers)
+    since = sync(client, headers)["next_since"]
+
+    client.delete(f"/api/todo/{b}", headers=headers)
+    client.delete(f"/api/tag/{tag_id}", headers=headers)
+    client.post("/api/todo/batch", json={"operations": [{"op": "delete", "id": a}]}, headers=headers)
+    delta = sync(client, headers, since)
+    assert [(t["entity"], t["id"]) for t in delta["tombstones"]] == [("todo", b), ("tag", tag_id), ("todo", a)]
+    # タグの削除で a のバージョンが上がったが、その後で削除されたので行としては返らない
+    assert delta["todos"] == []
+
+def test_pages_end_on_sequence_boundaries(client, headers):
+    # 1つのバッチ (=1つのシーケンス) の5件は、limit より多くても同じページに入る
+    client.post("/api/todo/batch", json={"operations": [{"op": "create", "content": f"batch {i}"} for i in range(5)]}, headers=headers)
+    singles = [client.post("/api/todo", json={"content": f"single {i}"}, headers=headers).json()["id"] for i in range(3)]
+
+    first = sync(client, headers, limit=2)
+    assert len(first["todos"]) == 5 and first["has_more"] is True
+    seen, page = list(ids(first["todos"])), first
+    while page["has_more"]:
+        page = sync(client, headers, page["next_since"], limit=2)
+        assert len({todo["change_seq"] for todo in page["todos"]}) <= 2
+        seen += ids(page["todos"])
+    assert seen == ids(sync(client, headers)["todos"])
+    assert seen[-3:] == singles
+
+def test_since_ahead_of_head_is_410(client, headers):
+    head = sync(client, headers)["next_since"]
+    assert client.get("/api/sync", params={"since": head + 1}, headers=headers).status_code == 410
+    assert client.get("/api/sync", params={"since": -1}, headers=headers).status_code == 422
+
+def test_compaction_expires_old_sync_points(client, headers, run_db):
+    a = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    b = client.post("/api/todo", json={"content": "b"}, headers=headers).json()["id"]
+    old_since = sync(client, headers)["next_since"]
+    client.delete(f"/api/todo/{a}", headers=headers)
+    after_delete = sync(client, headers)["next_since"]
+
+    # まだ期限内の墓標は消さない
+    assert run_db(lambda db: crud.compact_tombstones(db, datetime.utcnow() - timedelta(days=1))) == 0
+    assert run_db(lambda db: crud.compact_tombstones(db, datetime.utcnow() + timedelta(days=1))) == 1
+
+    response = client.get("/api/sync", params={"since": old_since}, headers=headers)
+    assert response.status_code == 410
+    assert "compacted" in response.text
+    # 圧縮した位置以降と、since=0 (全件) は取得できる
+    assert sync(client, headers, after_delete)["tombstones"] == []
+    assert ids(sync(client, headers)["todos"]) == [b]
+
+def test_cli_compacts_tombstones(app_engine, capsys):
+    # CLIはアプリのDBを使う
+    with app_engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO sync_tombstone (change_seq, entity, entity_id, deleted_at) "
+            "VALUES (1, 'todo', 1, '2000-01-01 00:00:00'), (2, 'todo', 2, CURRENT_TIMESTAMP)"
+        ))
+    try:
+        cli.main(["compact-tombstones", "--days", "30"])
+        assert "1 tombstones removed" in capsys.readouterr().out
+        with app_engine.connect() as connection:
+            assert connection.execute(text("SELECT entity_id FROM sync_tombstone")).scalars().all() == [2]
+            compacted = connection.execute(text("SELECT value FROM change_counter WHERE name = 'sync_compacted'")).scalar()
+        assert compacted == 1
+    finally:
+        with app_engine.begin() as connection:
+            connection.execute(text("DELETE FROM sync_tombstone"))
+            connection.execute(text("DELETE FROM change_counter WHERE name = 'sync_compacted'"))
@@ -0,0 +1,133 @@
+# tests/test_tag_cache.py
+"""タグのキャッシュ (読み込みのキャッシュ、書き込み後の更新、他のワーカーでの変更の反映)。"""
+import time
+
+import pytest
+
+from src import crud, schemas
+from src.cache import CachedTag, TagCache, tag_cache
+from src.config import settings
+
+from .conftest import login
+
+def create_tag(client, headers, description="tag"):
+    return client.post("/api/tag", json={"description": description}, headers=headers).json()["id"]
+
+def change_in_other_worker(run_db, owner_id, tag_id, description):
+    """キャッシュを通さずにDBのタグを変更します。(別のプロセスでの書き込みの代わり)"""
+    async def change(db):
+        db_tag = await crud._load_tag(db, tag_id, owner_id)
+        db_tag.description = description
+        await crud.bump_change_counters(db, crud.TAG_COUNTER)
+        await db.commit()
+    run_db(change)
+
+def test_tag_reads_are_served_from_the_cache(client, headers, count_queries):
+    tag_id = create_tag(client, headers)
+    # 存在しないIDも一度DBで確認すれば「存在しない」として覚える
+    assert client.get(f"/api/tag/{tag_id + 100}", headers=headers).status_code == 404
+    with count_queries() as counter:
+        assert client.get(f"/api/tag/{tag_id}", headers=headers).json()["description"] == "tag"
+        assert client.get(f"/api/tag/{tag_id + 100}", headers=headers).status_code == 404
+    assert counter.count == 0, counter.statements
+    assert tag_cache.stats()["hits"] > 0
+
+def test_missing_descriptions_are_cached(client, headers, user_id, run_db, count_queries):
+    assert run_db(lambda db: crud.get_tag_by_description(db, user_id, "nope")) is None
+    with count_queries() as counter:
+        assert run_db(lambda db: crud.get_tag_by_description(db, user_id, "nope")) is None
+    assert counter.count == 0
+    # 作成すると「存在しない」の記録は書き換えられる
+    tag_id = create_tag(client, headers, "nope")
+    assert run_db(lambda db: crud.get_tag_by_description(db, user_id, "nope")).id == tag_id
+
+def test_writes_update_the_cache(client, headers, user_id, run_db):
+    tag_id = create_tag(client, headers, "before")
+    assert [t["id"] for t in client.get("/api/tag", headers=headers).json()["items"]] == [tag_id]
+
+    client.put(f"/api/tag/{tag_id}", json={"description": "after"}, headers=headers)
+    assert client.get(f"/api/tag/{tag_id}", headers=headers).json()["description"] == "after"
+    assert run_db(lambda db: crud.get_tag_by_description(db, user_id, "before")) is None
+    # 古い説明は空いたので、別のタグで使える
+    other_id = create_tag(client, headers, "before")
+    assert [t["id"] for t in client.get("/api/tag", headers=headers).json()["items"]] == [tag_id, other_id]
+
+    client.delete(f"/api/tag/{tag_id}", headers=headers)
+    assert client.get(f"/api/tag/{tag_id}", headers=headers).status_code == 404
+    assert [t["id"] for t in client.get("/api/tag", headers=headers).json()["items"]] == [other_id]
+    assert run_db(lambda db: crud.get_missing_tag_ids(db, user_id, [tag_id, other_id])) == [tag_id]
+
+def test_other_worker_changes_are_picked_up_when_sync_is_enabled(client, headers, user_id, run_db, monkeypatch):
+    monkeypatch.setattr(settings, "tag_cache_sync_interval", 0.01)
+    tag_id = create_tag(client, headers, "mine")
+    assert client.get(f"/api/tag/{tag_id}", headers=headers).json()["description"] == "mine"
+
+    change_in_other_worker(run_db, user_id, tag_id, "theirs")
+    time.sleep(0.02)
+    assert client.get(f"/api/tag/{tag_id}", headers=headers).json()["description"] == "theirs"
+
+def test_without_sync_the_cache_is_only_bounded_by_its_ttl(client, headers, user_id, run_db):
+    tag_id = create_tag(client, headers, "mine")
+    client.get(f"/api/tag/{tag_id}", headers=headers)
+    change_in_other_worker(run_db, user_id, tag_id, "theirs")
+    assert client.get(f"/api/tag/{tag_id}", headers=headers).json()["description"] == "mine"
+
+def test_if_match_on_tags_reads_the_version_from_the_database(client, headers, user_id, run_db):
+    tag_id = create_tag(client, headers, "mine")
+    etag = client.get(f"/api/tag/{tag_id}", headers=headers).headers["ETag"]
+    change_in_other_worker(run_db, user_id, tag_id, "theirs")
+
+    # キャッシュはまだ古いバージョンだが、If-Match はDBの値と比べるので412になる
+    response = client.put(f"/api/tag/{tag_id}", json={"description": "lost"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+    response = client.delete(f"/api/tag/{tag_id}", headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+
+def test_cached_tags_are_only_visible_to_their_owner(client, headers, user_id, run_db):
+    tag_id = create_tag(client, headers, "shared name")
+    client.get(f"/api/tag/{tag_id}", headers=headers)
+    other = login(client, "tag-cache-other")
+    other_id = client.get("/api/users/me", headers=other).json()["id"]
+
+    # キャッシュにあっても他のユーザーからは存在しないタグとして扱う
+    assert client.get(f"/api/tag/{tag_id}", headers=other).status_code == 404
+    assert run_db(lambda db: crud.get_tag_by_description(db, other_id, "shared name")) is None
+    assert run_db(lambda db: crud.get_missing_tag_ids(db, other_id, [tag_id])) == [tag_id]
+    # 説明はユーザーごとに一意
+    assert create_tag(client, other, "shared name") != tag_id
+    assert run_db(lambda db: crud.get_tag_by_description(db, user_id, "shared name")).id == tag_id
+
+def test_reads_racing_a_write_do_not_store_stale_entries(client, headers, user_id, session_factory, run_db):
+    tag_id = create_tag(client, headers, "old")
+    tag_cache.clear()
+
+    async def read_while_renaming(db):
+        # DBから読んだ直後 (キャッシュに書く前) に、別のリクエストがタグの名前を変える
+        execute = db.execute
+
+        async def execute_then_rename(*args, **kwargs):
+            result = await execute(*args, **kwargs)
+            db.execute = execute
+            async with session_factory() as other:
+                await crud.update_tag(other, tag_id=tag_id, owner_id=user_id, tag=schemas.TagCreate(description="new"))
+            return result
+        db.execute = execute_then_rename
+        return await crud.get_tags(db, user_id)
+
+    (page, _) = run_db(read_while_renaming)
+    assert [t.description for t in page] == ["old"] # このリクエストは読んだ時点の内容を返す
+    # 古い一覧はキャッシュに残らない
+    assert [t["description"] for t in client.get("/api/tag", headers=headers).json()["items"]] == ["new"]
+
+def test_stale_id_lookups_are_not_stored():
+    cache = TagCache(max_entries=10, ttl=60)
+    old, new = CachedTag(id=1, description="old", version=1, owner_id=1), CachedTag(id=1, description="new", version=2, owner_id=1)
+    seen = cache.writes
+    cache.put(new) # DBから old を読んでいる間に書き込まれた
+    cache.set_by_id(1, old, seen)
+    cache.set_by_description(1, "old", old, seen)
+    assert cache.get_by_id(1) == (True, new)
+    assert cache.get_by_description(1, "old") == (False, None)
+    # 書き込みがなければ普通に書き込む
+    cache.set_by_description(1, "other", None, cache.writes)
+    assert cache.get_by_description(1, "other") == (True, None)
@@ -0,0 +1,67 @@
+# tests/test_tag_filters.py
+"""タグによるTodoの絞り込み (any / all) と、タグごとの件数。"""
+import pytest
+
+def setup_todos(client, headers):
+    """work, home の2タグと、(なし / work / home / 両方) の4つのTodoを作ります。"""
+    work, home = (
+        client.post("/api/tag", json={"description": d}, headers=headers).json()["id"] for d in ("work", "home")
+    )
+    todos = {}
+    for name, tag_ids in [("none", []), ("work", [work]), ("home", [home]), ("both", [work, home])]:
+        todo_id = client.post("/api/todo", json={"content": name}, headers=headers).json()["id"]
+        if tag_ids:
+            client.post(f"/api/todo/{todo_id}/tags", json={"tag_ids": tag_ids}, headers=headers)
+        todos[name] = todo_id
+    return work, home, todos
+
+def list_ids(client, headers, **params):
+    response = client.get("/api/todo", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return [t["id"] for t in response.json()["items"]]
+
+def test_any_and_all_tag_modes(client, headers):
+    work, home, todos = setup_todos(client, headers)
+    assert list_ids(client, headers, tag=[work]) == [todos["work"], todos["both"]]
+    assert list_ids(client, headers, tag=[work, home]) == [todos["work"], todos["home"], todos["both"]]
+    assert list_ids(client, headers, tag=[work, home], tag_mode="all") == [todos["both"]]
+    # 同じタグを重ねて指定しても all の件数はずれない
+    assert list_ids(client, headers, tag=[work, work], tag_mode="all") == [todos["work"], todos["both"]]
+    assert list_ids(client, headers, tag=[999]) == []
+    assert client.get("/api/todo", params={"tag": [work], "tag_mode": "some"}, headers=headers).status_code == 422
+
+def test_tag_filter_combines_with_paging_and_other_filters(client, headers):
+    work, home, todos = setup_todos(client, headers)
+    client.put(f"/api/todo/{todos['both']}/toggle", headers=headers)
+    assert list_ids(client, headers, tag=[work], is_completed="false") == [todos["work"]]
+
+    first = client.get("/api/todo", params={"tag": [work, home], "limit": 2}, headers=headers).json()
+    second = client.get(
+        "/api/todo", params={"tag": [work, home], "limit": 2, "cursor": first["next_cursor"]}, headers=headers
+    ).json()
+    assert [t["id"] for t in first["items"] + second["items"]] == [todos["work"], todos["home"], todos["both"]]
+    assert second["next_cursor"] is None
+
+def test_tag_list_includes_todo_counts(client, headers):
+    work, home, _ = setup_todos(client, headers)
+    unused = client.post("/api/tag", json={"description": "unused"}, headers=headers).json()["id"]
+    counts = {t["id"]: t["todo_count"] for t in client.get("/api/tag", headers=headers).json()["items"]}
+    assert counts == {work: 2, home: 2, unused: 0}
+
+def test_tag_todos_page(client, headers):
+    work, _, todos = setup_todos(client, headers)
+    body = client.get(f"/api/tag/{work}/todos", params={"limit": 1}, headers=headers).json()
+    assert body["tag"]["description"] == "work"
+    assert body["todo_count"] == 2
+    assert [t["id"] for t in body["items"]] == [todos["work"]]
+    assert body["next_cursor"] is not None
+    assert client.get("/api/tag/999/todos", headers=headers).status_code == 404
+
+@pytest.mark.parametrize("tags", [2, 15])
+def test_tag_list_counts_do_not_grow_with_page_size(client, headers, count_queries, tags):
+    for i in range(tags):
+        client.post("/api/tag", json={"description": f"tag {i}"}, headers=headers)
+    with count_queries() as counter:
+        client.get("/api/tag", headers=headers)
+    # ETag用の変更カウンタ、タグの1ページ、そのページの件数 (GROUP BY)
+    assert len([s for s in counter.statements if not s.startswith("SELECT users")]) == 3, counter.statements
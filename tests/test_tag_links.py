@@ -0,0 +1,99 @@
+# tests/test_tag_links.py
+"""Todoとタグの関連付け (設定表) をまとめて付け外しするAPI。"""
+import pytest
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from src import crud, models
+
+from .conftest import write_queue_statements
+
+def create_tags(client, headers, count):
+    return [
+        client.post("/api/tag", json={"description": f"tag {i}"}, headers=headers).json()["id"]
+        for i in range(count)
+    ]
+
+def create_todo(client, headers):
+    return client.post("/api/todo", json={"content": "todo"}, headers=headers).json()["id"]
+
+def tag_ids_of(todo):
+    return sorted(tag["id"] for tag in todo["tags"])
+
+def test_attach_is_idempotent_and_detach_removes_only_the_given_tags(client, headers):
+    a, b, c = create_tags(client, headers, 3)
+    todo_id = create_todo(client, headers)
+
+    response = client.post(f"/api/todo/{todo_id}/tags", json={"tag_ids": [a, b]}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert tag_ids_of(response.json()) == [a, b]
+    # 関連付け済みのタグを含めても重複しない
+    response = client.post(f"/api/todo/{todo_id}/tags", json={"tag_ids": [b, c, c]}, headers=headers)
+    assert tag_ids_of(response.json()) == [a, b, c]
+    response = client.post(f"/api/todo/{todo_id}/tags/{a}", headers=headers)
+    assert tag_ids_of(response.json()) == [a, b, c]
+
+    response = client.delete(f"/api/todo/{todo_id}/tags", params={"tag_id": [a, c]}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert tag_ids_of(response.json()) == [b]
+    assert tag_ids_of(client.get(f"/api/todo/{todo_id}", headers=headers).json()) == [b]
+
+def test_missing_todo_or_tag_is_404(client, headers):
+    a, = create_tags(client, headers, 1)
+    todo_id = create_todo(client, headers)
+    assert client.post(f"/api/todo/{todo_id}/tags", json={"tag_ids": [a, 999]}, headers=headers).status_code == 404
+    assert client.get(f"/api/todo/{todo_id}", headers=headers).json()["tags"] == []
+    assert client.post("/api/todo/999/tags", json={"tag_ids": [a]}, headers=headers).status_code == 404
+    assert client.post(f"/api/todo/{todo_id}/tags/999", headers=headers).status_code == 404
+    assert client.delete("/api/todo/999/tags", params={"tag_id": [a]}, headers=headers).status_code == 404
+
+def test_association_rejects_duplicate_rows(run_db):
+    async def insert_twice(db):
+        db.add_all([models.Todo(id=1, content="todo"), models.Tag(id=1, description="tag")])
+        await db.flush()
+        row = {"todo_id": 1, "tag_id": 1}
+        await db.execute(insert(models.todo_tag_association), row)
+        await db.execute(insert(models.todo_tag_association), row)
+
+    with pytest.raises(IntegrityError):
+        run_db(insert_twice)
+
+@pytest.mark.parametrize("tags", [1, 20])
+def test_attach_and_detach_do_not_grow_with_tag_count(client, headers, count_queries, tags):
+    tag_ids = create_tags(client, headers, tags)
+    todo_id = create_todo(client, headers)
+    with count_queries() as attach:
+        client.post(f"/api/todo/{todo_id}/tags", json={"tag_ids": tag_ids}, headers=headers)
+    with count_queries() as detach:
+        client.delete(f"/api/todo/{todo_id}/tags", params={"tag_id": tag_ids}, headers=headers)
+    statements = lambda counter: [s for s in counter.statements if not s.startswith("SELECT users")]
+    # Todoの存在チェック (タグはキャッシュで確認)、書き込みの中での再確認、同期用シーケンス、INSERT ... SELECT、
+    # Todoのバージョン、変更カウンタ (2文)、読み直し (Todoとタグ)
+    assert len(statements(attach)) == 8 + write_queue_statements(), attach.statements
+    # 存在チェックと再確認、同期用シーケンス、墓標のINSERT、DELETE、Todoのバージョン、変更カウンタ (2文)、
+    # 読み直し (Todoとタグ)
+    assert len(statements(detach)) == 9 + write_queue_statements(), detach.statements
+
+@pytest.mark.parametrize("name", ["attach_tags", "detach_tags"])
+def test_todo_deleted_after_the_check_is_404(client, headers, session_factory, monkeypatch, run_db, name):
+    (tag_id,) = create_tags(client, headers, 1)
+    todo_id = create_todo(client, headers)
+    original = getattr(crud, name)
+
+    async def delete_first(db, **kwargs):
+        # エンドポイントが存在を確認した後に、別のリクエストが削除した
+        async with session_factory() as other:
+            await other.execute(delete(models.Todo).where(models.Todo.id == todo_id))
+            await other.commit()
+        return await original(db, **kwargs)
+    monkeypatch.setattr(crud, name, delete_first)
+
+    if name == "attach_tags":
+        response = client.post(f"/api/todo/{todo_id}/tags", json={"tag_ids": [tag_id]}, headers=headers)
+    else:
+        response = client.delete(f"/api/todo/{todo_id}/tags", params={"tag_id": [tag_id]}, headers=headers)
+    assert response.status_code == 404, response.text
+    # 削除されたTodoへの関連付けは残らない
+    assoc = models.todo_tag_association
+    links = run_db(lambda db: db.execute(select(assoc).where(assoc.c.todo_id == todo_id)))
+    assert links.all() == []
@@ -0,0 +1,75 @@
+# tests/test_templating.py
+"""テンプレートのバイトコードキャッシュと、タグ選択欄の断片 (フラグメント) のキャッシュ。"""
+import re
+
+import pytest
+
+from src import templating
+from src.cache import fragment_cache
+from src.config import settings
+
+def create_tag(client, headers, description):
+    return client.post("/api/tag", json={"description": description}, headers=headers).json()["id"]
+
+def selector_options(html: str) -> list:
+    """タグ選択欄の (値, 表示) のリスト。(先頭の「-- タグを選択 --」は除く)"""
+    select = re.search(r'<select name="tag_id".*?</select>', html, re.S).group(0)
+    return [(value, label.strip()) for value, label in re.findall(r'<option value="(\d+)">(.*?)</option>', select)]
+
+def test_selector_lists_only_tags_not_on_the_todo(client, headers):
+    a = create_tag(client, headers, "a")
+    b = create_tag(client, headers, "<b>")
+    todo_id = client.post("/api/todo", json={"content": "todo"}, headers=headers).json()["id"]
+    assert selector_options(client.get(f"/todo/{todo_id}/manage-tags").text) == [(str(b), "&lt;b&gt;"), (str(a), "a")]
+
+    client.post(f"/api/todo/{todo_id}/tags/{a}", headers=headers)
+    assert selector_options(client.get(f"/todo/{todo_id}/manage-tags").text) == [(str(b), "&lt;b&gt;")]
+
+def test_warm_selector_skips_the_tag_list_read(client, headers, count_queries):
+    create_tag(client, headers, "a")
+    todo_id = client.post("/api/todo", json={"content": "todo"}, headers=headers).json()["id"]
+    cold = client.get(f"/todo/{todo_id}/manage-tags").text
+    with count_queries() as counter:
+        warm = client.get(f"/todo/{todo_id}/manage-tags").text
+    assert warm == cold
+    # Todo、そのタグ、変更カウンタ (断片のキー) だけで、タグ一覧は読まない
+    assert counter.count == 3, counter.statements
+    assert not any(s.startswith('SELECT "Tag"') for s in counter.statements)
+
+def test_tag_writes_refresh_the_selector(client, headers):
+    a = create_tag(client, headers, "a")
+    todo_id = client.post("/api/todo", json={"content": "todo"}, headers=headers).json()["id"]
+    client.get(f"/todo/{todo_id}/manage-tags")
+    assert fragment_cache.stats()["entries"] == 1
+
+    b = create_tag(client, headers, "b")
+    # タグの書き込みでキャッシュ済みの選択欄は捨てられる
+    assert fragment_cache.stats()["entries"] == 0
+    assert selector_options(client.get(f"/todo/{todo_id}/manage-tags").text) == [(str(a), "a"), (str(b), "b")]
+    client.put(f"/api/tag/{a}", json={"description": "z"}, headers=headers)
+    assert selector_options(client.get(f"/todo/{todo_id}/manage-tags").text) == [(str(b), "b"), (str(a), "z")]
+    client.delete(f"/api/tag/{b}", headers=headers)
+    assert selector_options(client.get(f"/todo/{todo_id}/manage-tags").text) == [(str(a), "z")]
+
+def test_zero_ttl_turns_the_fragment_cache_off(client, headers, monkeypatch):
+    monkeypatch.setattr(settings, "fragment_cache_ttl_seconds", 0)
+    create_tag(client, headers, "a")
+    todo_id = client.post("/api/todo", json={"content": "todo"}, headers=headers).json()["id"]
+    client.get(f"/todo/{todo_id}/manage-tags")
+    assert fragment_cache.stats()["entries"] == 0
+
+def test_bytecode_cache_is_written_to_the_configured_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "template_bytecode_cache_dir", str(tmp_path))
+    templating.create_templates().get_template("login.html")
+    assert list(tmp_path.iterdir())
+
+    # 2つ目の環境 (別のワーカーの代わり) はコンパイルせずにキャッシュから読み込む
+    templates = templating.create_templates()
+    def no_compile(*args, **kwargs):
+        raise AssertionError("template was compiled again")
+    monkeypatch.setattr(templates.env, "compile", no_compile)
+    assert "<form" in templates.get_template("login.html").render(request=None)
+
+def test_bytecode_cache_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(settings, "template_bytecode_cache", False)
+    assert templating.create_templates().env.bytecode_cache is None
@@ -0,0 +1,169 @@
+# tests/test_write_queue.py
+"""書き込みのグループコミット (src/writer.py、WRITE_GROUP_COMMIT)。"""
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from src import models, writer
+from src.config import settings
+from src.main import app
+from src.writer import WriteQueue, write_queue
+
+def add_user(name: str):
+    """ユーザーを1人追加する書き込み。(コミットしない)"""
+    async def write(db):
+        db.add(models.User(username=name, hashed_password="x"))
+        return name
+    return write
+
+async def fail(db):
+    db.add(models.User(username="rolled back", hashed_password="x"))
+    await db.flush()
+    raise ValueError("boom")
+
+@pytest.fixture
+def run(client):
+    """run(queue, coro) で、queue を起動してコルーチンを実行し、終わったら止めます。"""
+    async def call(queue, make_coro):
+        await queue.start()
+        try:
+            return await make_coro()
+        finally:
+            await queue.stop()
+    return lambda queue, make_coro: client.portal.call(call, queue, make_coro)
+
+def usernames(run_db) -> set:
+    return set(run_db(lambda db: db.scalars(select(models.User.username))).all())
+
+def test_concurrent_writes_share_one_commit(run, run_db):
+    queue = WriteQueue(max_batch=100, max_delay=0.05)
+    results = run(queue, lambda: asyncio.gather(*(queue.submit(add_user(f"u{i}")) for i in range(5))))
+    assert results == [f"u{i}" for i in range(5)]
+    assert {f"u{i}" for i in range(5)} <= usernames(run_db)
+    assert queue.stats() == {"running": False, "batches": 1, "operations": 5, "failures": 0, "queued": 0}
+
+def test_a_failing_write_is_rolled_back_alone(run, run_db):
+    queue = WriteQueue(max_batch=100, max_delay=0.05)
+    results = run(queue, lambda: asyncio.gather(
+        queue.submit(add_user("before")), queue.submit(fail), queue.submit(add_user("after")),
+        return_exceptions=True,
+    ))
+    assert results[0] == "before" and isinstance(results[1], ValueError) and results[2] == "after"
+    names = usernames(run_db)
+    assert {"before", "after"} <= names and "rolled back" not in names
+    assert queue.batches == 1 and queue.operations == 2 and queue.failures == 1
+
+def test_batches_are_capped_at_max_batch(run):
+    queue = WriteQueue(max_batch=2, max_delay=0.05)
+    run(queue, lambda: asyncio.gather(*(queue.submit(add_user(f"capped {i}")) for i in range(5))))
+    assert queue.batches == 3 and queue.operations == 5
+
+def test_stop_commits_what_is_already_queued(client, run_db):
+    queue = WriteQueue(max_batch=100, max_delay=10)
+
+    async def submit_then_stop():
+        await queue.start()
+        pending = [asyncio.create_task(queue.submit(add_user(f"queued {i}"))) for i in range(3)]
+        await asyncio.sleep(0.01) # 書き込みのタスクが最初の1件を取り出して、後続を待っている
+        await queue.stop()
+        return await asyncio.gather(*pending)
+
+    assert client.portal.call(submit_then_stop) == ["queued 0", "queued 1", "queued 2"]
+    assert {"queued 0", "queued 1", "queued 2"} <= usernames(run_db)
+
+def test_submit_needs_a_running_queue(client):
+    with pytest.raises(RuntimeError, match="not running"):
+        client.portal.call(WriteQueue(max_batch=1, max_delay=0).submit, add_user("x"))
+
+@pytest.fixture
+def group_commit(monkeypatch):
+    monkeypatch.setattr(settings, "write_group_commit", True)
+    monkeypatch.setattr(write_queue, "max_delay", 0.05)
+
+@pytest.fixture
+def queued_client(group_commit, client):
+    """グループコミットを有効にして起動したアプリのクライアント。"""
+    assert write_queue.running
+    return client
+
+def test_api_writes_go_through_the_queue(queued_client, headers):
+    client = queued_client
+    before = write_queue.operations
+    todo_id = client.post("/api/todo", json={"content": "queued"}, headers=headers).json()["id"]
+    tag_id = client.post("/api/tag", json={"description": "queued"}, headers=headers).json()["id"]
+    assert client.post(f"/api/todo/{todo_id}/tags/{tag_id}", headers=headers).status_code == 200
+    toggled = client.put(f"/api/todo/{todo_id}/toggle", headers=headers).json()
+    assert toggled["is_completed"] is True and [t["id"] for t in toggled["tags"]] == [tag_id]
+    assert client.delete(f"/api/todo/{todo_id}", headers=headers).status_code == 200
+    assert write_queue.operations - before == 5
+    assert client.get(f"/api/todo/{todo_id}", headers=headers).status_code == 404
+
+def test_concurrent_requests_are_committed_together(queued_client, headers):
+    client = queued_client
+    batches = write_queue.batches
+    threads = [
+        threading.Thread(target=client.post, args=("/api/todo",), kwargs={"json": {"content": f"c{i}"}, "headers": headers})
+        for i in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(client.get("/api/todo", params={"limit": 100}, headers=headers).json()["items"]) == 10
+    assert write_queue.batches - batches < 10
+
+def test_stale_if_match_is_still_412(queued_client, headers):
+    client = queued_client
+    todo_id = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    etag = client.get(f"/api/todo/{todo_id}", headers=headers).headers["ETag"]
+    client.put(f"/api/todo/{todo_id}/toggle", headers=headers)
+    response = client.put(f"/api/todo/{todo_id}", json={"content": "lost"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+    assert client.get(f"/api/todo/{todo_id}", headers=headers).json()["content"] == "a"
+
+def test_queue_stops_with_the_app(group_commit, session_factory, monkeypatch):
+    monkeypatch.setattr(writer, "AsyncSessionLocal", session_factory)
+    with TestClient(app):
+        assert write_queue.running
+    assert not write_queue.running
+
+def concurrently(count, call) -> list:
+    """call(i) を count 個のスレッドで同時に実行し、結果を返します。"""
+    results = [None] * count
+
+    def run(i):
+        results[i] = call(i)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_toggles_all_apply(queued_client, headers):
+    client = queued_client
+    todo_id = client.post("/api/todo", json={"content": "flip"}, headers=headers).json()["id"]
+    responses = concurrently(10, lambda i: client.put(f"/api/todo/{todo_id}/toggle", headers=headers))
+    assert [r.status_code for r in responses] == [200] * 10
+    # それぞれが書き込みの時点の値を反転するので、10回で元に戻る
+    todo = client.get(f"/api/todo/{todo_id}", headers=headers).json()
+    assert todo["is_completed"] is False
+
+def test_concurrent_puts_with_the_same_if_match(queued_client, headers):
+    client = queued_client
+    todo_id = client.post("/api/todo", json={"content": "v1"}, headers=headers).json()["id"]
+    etag = client.get(f"/api/todo/{todo_id}", headers=headers).headers["ETag"]
+    responses = concurrently(5, lambda i: client.put(
+        f"/api/todo/{todo_id}", json={"content": f"v{i + 2}"}, headers={**headers, "If-Match": etag},
+    ))
+    assert sorted(r.status_code for r in responses) == [200, 412, 412, 412, 412]
+
+def test_put_keeps_the_completion_written_meanwhile(queued_client, headers):
+    client = queued_client
+    todo_id = client.post("/api/todo", json={"content": "a"}, headers=headers).json()["id"]
+    client.put(f"/api/todo/{todo_id}/toggle", headers=headers)
+    todo = client.put(f"/api/todo/{todo_id}", json={"content": "b"}, headers=headers).json()
+    assert todo["content"] == "b" and todo["is_completed"] is True